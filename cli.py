@@ -14,6 +14,13 @@ import pandas as pd
 from google.cloud import bigquery
 
 from edgar_funcs.edgar import load_filing_catalog
+from edgar_funcs.rag.vectorize.chunking import (
+    CHUNK_ALGORITHM_VERSIONS,
+    CHUNK_ALORITHM_VERSION,
+    TOKEN_CHUNK_ALGORITHM_VERSIONS,
+    chunk_algorithm_versions,
+)
+from edgar_funcs.rag.vectorize.manifest import chunk_manifest
 from func_helpers import (
     create_publisher,
     get_default_project_id,
@@ -55,6 +62,7 @@ def _request_payload(
     embedding_model: str,
     embedding_dimension: int,
     extraction_model: str,
+    chunk_algo_version: str = CHUNK_ALORITHM_VERSION,
 ):
     return {
         "batch_id": batch_id,
@@ -65,7 +73,7 @@ def _request_payload(
         "embedding_model": embedding_model,
         "embedding_dimension": embedding_dimension,
         "model": extraction_model,
-        "chunk_algo_version": "4",
+        "chunk_algo_version": chunk_algo_version,
     }
 
 
@@ -184,6 +192,32 @@ def export_result(batch_id: str):
             pass
 
 
+def skip_chunked(
+    todo_list: list[dict[Hashable, Any]], args: argparse.Namespace
+) -> list[dict[Hashable, Any]]:
+    """
+    with chunk --skip-chunked, remove the filings that the chunk manifest lists
+    as chunked already
+    """
+    if args.command != "chunk" or not args.skip_chunked:
+        return todo_list
+
+    manifest = chunk_manifest()
+    if manifest is None:
+        print("# CHUNK_MANIFEST_PATH is not set, chunked filings are not skipped")
+        return todo_list
+
+    manifest.pull()
+    chunked = manifest.chunked(
+        [str(row["accession_number"]) for row in todo_list],
+        model=args.embedding_model,
+        dimension=args.embedding_dimension,
+        chunk_algo_version=args.chunk_algo_version,
+    )
+    print(f"# skipping {len(chunked)} filings already chunked")
+    return [row for row in todo_list if str(row["accession_number"]) not in chunked]
+
+
 def batch_request(todo_list: list[dict[Hashable, Any]], topic: str, payload_func):
     batch_id = _batch_id()
     n_processed = 0
@@ -269,12 +303,24 @@ def parse_cli():
         default="vertex_ai/gemini-2.0-flash-001",
         help="Model to use for extraction (default: vertex_ai/gemini-2.0-flash-001)",
     )
+    parser.add_argument(
+        "--chunk-algo-version",
+        type=str,
+        default=CHUNK_ALORITHM_VERSION,
+        choices=chunk_algorithm_versions(),
+        help=f"Version of text chunks to use (default: {CHUNK_ALORITHM_VERSION}), use {CHUNK_ALGORITHM_VERSIONS['section']} for chunks aligned to document sections, {TOKEN_CHUNK_ALGORITHM_VERSIONS['spacy']} or {TOKEN_CHUNK_ALGORITHM_VERSIONS['section']} for chunks sized in tokens",  # noqa E501
+    )
     parser.add_argument(
         "--topic",
         type=str,
         default="edgarai-request",
         help="Pub/Sub topic to publish request messages to, use any value begins with _ for skipping publishing the request messages",  # noqa E501
     )
+    parser.add_argument(
+        "--skip-chunked",
+        action="store_true",
+        help="with chunk, skip the filings already chunked according to the chunk manifest at CHUNK_MANIFEST_PATH",  # noqa E501
+    )
     args = parser.parse_args()
 
     if re.match(r"^\d{10}-\d{2}-\d{6}$", args.arg1):
@@ -311,6 +357,7 @@ def main():
         embedding_model=args.embedding_model,
         embedding_dimension=args.embedding_dimension,
         extraction_model=args.extraction_model,
+        chunk_algo_version=args.chunk_algo_version,
     )
 
     if args.mode == "list":
@@ -351,7 +398,7 @@ def main():
     else:
         # batch request mode, publishes messages to Pub/Sub topic
         batch_request(
-            todo_list=todo_list,
+            todo_list=skip_chunked(todo_list, args),
             topic=args.topic,
             payload_func=payload_func,
         )
@@ -1,7 +1,7 @@
-from rank_bm25 import BM25Okapi
-from scipy.spatial.distance import cosine
+import numpy as np
 
 from edgar_funcs.rag.vectorize import TextChunksWithEmbedding
+from edgar_funcs.rag.vectorize.quantize import similarity_vectors
 
 
 def top_adjacent_chunks(relevance_scores) -> list[str]:
@@ -149,72 +149,82 @@ def gather_chunk_distances(results: list[dict]) -> dict:
 
 
 def nearest_chunks(
-    queries: list[list[float]],
-    contents: list[list[float]],
+    queries,
+    contents,
     top_k: int,
     filtered_chunk_nums: list[int] = [],
+    normalized: bool = False,
 ):
     """
     Find nearest chunks to query embeddings based on cosine distance.
 
     Args:
         queries: List of query embedding vectors
-        contents: List of content embedding vectors
+        contents: List or array of content embedding vectors, float16 and int8
+                  embeddings are compared as stored, since cosine distance does not
+                  depend on the scale of a vector
         top_k: Number of top results to return
         filtered_indices: Optional list of indices to restrict the search to.
                           If provided, only these indices from contents will be used.
                           This allows pre-filtering using methods like BM25.
+        normalized: queries and contents are unit vectors, e.g. from
+                    TextChunksWithEmbedding.unit_vectors(), the cosine distance
+                    is then 1 - their dot product
 
     Returns:
-        List of dictionaries with query_idx, chunk_num, and distance
+        List of dictionaries with query_idx, chunk_num, and distance, the top_k
+        smallest distances in ascending order. The distances of all queries and
+        chunks are computed in one matrix product and only the top_k are sorted.
     """
-    distances = []
-
     # If filtered_indices is empty, process all contents
     indices_to_process = (
-        range(len(contents)) if not filtered_chunk_nums else filtered_chunk_nums
+        list(range(len(contents))) if not filtered_chunk_nums else filtered_chunk_nums
     )
-
-    for chunk_num in indices_to_process:
-        content_vec = contents[chunk_num]
-        for query_idx, query_vec in enumerate(queries):
-            distance = float(cosine(query_vec, content_vec))
-            distances.append(
-                {
-                    "query_idx": query_idx,
-                    "chunk_num": chunk_num,
-                    "distance": distance,
-                }
-            )
-
-    distances.sort(key=lambda x: x["distance"])
-    return distances[:top_k]
-
-
-def preprocess_text(text: str) -> list[str]:
-    """
-    Preprocess text for BM25 tokenization, with special handling for dollar amounts.
-    This helps match dollar ranges regardless of formatting.
-    """
-    # Basic lowercase and split
-    tokens = text.lower().split()
-
-    # Process tokens to handle dollar amounts
-    processed_tokens = []
-    for token in tokens:
-        # Keep original token
-        processed_tokens.append(token)
-
-        # Handle dollar signs and commas in numbers
-        if "$" in token or "," in token:
-            # Remove $ and commas from numbers
-            stripped = token.replace("$", "").replace(",", "")
-            if stripped.isdigit() or (
-                stripped.replace("-", "").isdigit() and "-" in stripped
-            ):
-                processed_tokens.append(stripped)
-
-    return processed_tokens
+    if not indices_to_process or len(queries) == 0 or top_k <= 0:
+        return []
+
+    query_vectors = similarity_vectors(queries)
+    content_vectors = similarity_vectors(contents)
+    if filtered_chunk_nums:
+        content_vectors = content_vectors[filtered_chunk_nums]
+
+    # distances ordered by chunk then query, the order ties are returned in
+    if normalized:
+        distances = (1 - query_vectors @ content_vectors.T).T.ravel()
+    else:
+        distances = _cosine_distances(query_vectors, content_vectors).T.ravel()
+    nearest = _smallest(distances, top_k)
+
+    n_queries = len(query_vectors)
+    return [
+        {
+            "query_idx": int(i % n_queries),
+            "chunk_num": indices_to_process[i // n_queries],
+            "distance": float(distances[i]),
+        }
+        for i in nearest
+    ]
+
+
+def _smallest(values: np.ndarray, k: int) -> np.ndarray:
+    # positions of the k smallest values in ascending order, ties in the order of
+    # their positions as a stable sort of all values would return them
+    if k < len(values):
+        kth = values[np.argpartition(values, k - 1)[:k]].max()
+        candidates = np.flatnonzero(values <= kth)
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.lexsort((candidates, values[candidates]))][:k]
+
+
+def _cosine_distances(queries: np.ndarray, contents: np.ndarray) -> np.ndarray:
+    # cosine distance between each query and each content vector, the products
+    # are divided by the content norms instead of normalizing a copy of contents
+    query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    content_norms = np.sqrt(np.einsum("ij,ij->i", contents, contents))
+    query_norms[query_norms == 0] = 1
+    content_norms[content_norms == 0] = 1
+    return 1 - ((queries / query_norms) @ contents.T) / content_norms
 
 
 def filter_chunks_with_keywords(
@@ -226,18 +236,6 @@ def filter_chunks_with_keywords(
     Filter chunks using BM25 algorithm based on keywords.
     Returns the indices of the top k chunks.
     Handles special cases like dollar amounts with or without $ signs.
+    The BM25 index is built once per chunks and reused by later calls.
     """
-    corpus = chunks.texts
-    # Use custom tokenization that handles dollar amounts
-    tokenized_corpus = [preprocess_text(doc) for doc in corpus]
-    bm25 = BM25Okapi(tokenized_corpus)
-
-    # Preprocess the keywords with the same function
-    tokenized_query = preprocess_text(" ".join(keywords))
-    bm25_scores = bm25.get_scores(tokenized_query)
-
-    # Get indices of top k chunks by BM25 score
-    top_indices = sorted(
-        range(len(bm25_scores)), key=lambda i: bm25_scores[i], reverse=True
-    )[:top_k]
-    return top_indices
+    return chunks.keyword_index().top_chunks(keywords, top_k)
@@ -5,6 +5,9 @@ from typing import Any, Optional, TypedDict
 from pydantic import BaseModel
 
 from ..vectorize import TextChunksWithEmbedding
+from ..vectorize.artifact import ArtifactChangedError
+from ..vectorize.artifact_cache import load_chunks
+from ..vectorize.sections import lookup_section
 from .algo import (
     filter_chunks_with_keywords,
     gather_chunk_distances,
@@ -15,6 +18,7 @@ from .algo import (
     top_chunks,
 )
 from .llm import ask_model
+from .query_bank import query_bank
 
 logger = logging.getLogger(__name__)
 
@@ -40,10 +44,25 @@ FUNDMGR_OWNERSHIP_KEYWORDS = [
     "no ownership",  # Common ownership phrases
 ]
 
+# headings of the portfolio manager ownership section,
+# matched against normalized headings
+FUNDMGR_OWNERSHIP_SECTIONS = [
+    r"\bportfolio managers?\b.*\b(ownership|owned|securities)\b",
+    r"\b(ownership|owned|securities)\b.*\bportfolio managers?\b",
+]
+FUNDMGR_OWNERSHIP_SECTION_KEYWORDS = [
+    "dollar range",
+    "beneficial ownership",
+    "beneficially owned",
+]
+
 
 FUNDMGR_OWNERSHIP_QUERIES = [
     "Show me the beneficial ownership of each portfolio manager, including names and dollar ranges of securities they hold.",  # noqa E501
 ]
+# name of the query set in the query bank, also its file name in storage
+FUNDMGR_OWNERSHIP_QUERY_SET = "fundmgr_ownership_queries"
+query_bank().register(FUNDMGR_OWNERSHIP_QUERY_SET, FUNDMGR_OWNERSHIP_QUERIES)
 
 
 FUND_MGR_OWNERSHIP_PROMPT = """
@@ -108,15 +127,17 @@ def extract_fundmgr_ownership_from_filing(
     embedding_dimension: int,  # ignored for openai embedding model
     model: str,
     chunk_algo_version: str,
+    chunks: TextChunksWithEmbedding | None = None,
     **_,  # ignore any other parameters
 ) -> FundManagerOwnership | None:
-    chunks = TextChunksWithEmbedding.load(
-        cik=cik,
-        accession_number=accession_number,
-        model=embedding_model,
-        dimension=embedding_dimension,
-        chunk_algo_version=chunk_algo_version,
-    )
+    if chunks is None:
+        chunks = load_chunks(
+            cik=cik,
+            accession_number=accession_number,
+            model=embedding_model,
+            dimension=embedding_dimension,
+            chunk_algo_version=chunk_algo_version,
+        )
     queries = _load_fundmgr_ownership_queries(
         embedding_model=embedding_model, embedding_dimension=embedding_dimension
     )
@@ -124,35 +145,25 @@ def extract_fundmgr_ownership_from_filing(
     if chunks is None or queries is None:
         return None
 
-    result = _extract_fundmgr_ownership(queries, chunks, model)
-    return result
-
-
-def _load_fundmgr_ownership_queries(embedding_model: str, embedding_dimension: int):
-    cik, accession_number, chunk_algo_version = "0", "fundmgr_ownership_queries", "0"
     try:
-        return TextChunksWithEmbedding.load(
+        return _extract_fundmgr_ownership(queries, chunks, model)
+    except ArtifactChangedError:
+        # the filing was saved again since its chunks were loaded
+        chunks = load_chunks(
             cik=cik,
             accession_number=accession_number,
             model=embedding_model,
             dimension=embedding_dimension,
             chunk_algo_version=chunk_algo_version,
+            reload=True,
         )
-    except ValueError:
-        # saved queries vectors not found
-        # create new one
-        logger.debug("Creating new trustee compensation queries")
-        queries = TextChunksWithEmbedding(
-            texts=FUNDMGR_OWNERSHIP_QUERIES,
-            metadata={
-                "cik": cik,
-                "accession_number": accession_number,
-                "chunk_algo_version": chunk_algo_version,
-            },
-        )
-        queries.get_embeddings(model=embedding_model, dimension=embedding_dimension)
-        queries.save()
-        return queries
+        return _extract_fundmgr_ownership(queries, chunks, model)
+
+
+def _load_fundmgr_ownership_queries(embedding_model: str, embedding_dimension: int):
+    return query_bank().get(
+        FUNDMGR_OWNERSHIP_QUERY_SET, embedding_model, embedding_dimension
+    )
 
 
 def _extract_fundmgr_ownership(
@@ -201,19 +212,27 @@ def _find_relevant_text(
     chunks: TextChunksWithEmbedding,
     method: str,
 ):
-    # Get filtered chunk indices using BM25
-    filtered_chunk_nums = filter_chunks_with_keywords(
-        chunks, keywords=FUNDMGR_OWNERSHIP_KEYWORDS, top_k=50
+    # use the ownership section located by the section index if possible,
+    # otherwise get filtered chunk indices using BM25
+    filtered_chunk_nums = lookup_section(
+        chunks.metadata.get("section_index"),
+        FUNDMGR_OWNERSHIP_SECTIONS,
+        FUNDMGR_OWNERSHIP_SECTION_KEYWORDS,
     )
+    if not filtered_chunk_nums:
+        filtered_chunk_nums = filter_chunks_with_keywords(
+            chunks, keywords=FUNDMGR_OWNERSHIP_KEYWORDS, top_k=50
+        )
     if not filtered_chunk_nums:
         return [], ""
 
     # Run embedding similarity directly with filtered indices
     relevance_result = nearest_chunks(
-        queries.embeddings,
-        chunks.embeddings,
+        queries.unit_vectors(),
+        chunks.unit_vectors(),
         top_k=20,
         filtered_chunk_nums=filtered_chunk_nums,
+        normalized=True,
     )
 
     if not relevance_result:
@@ -1,4 +1,5 @@
 import logging
+import os
 from datetime import datetime
 from typing import Optional, Type
 
@@ -19,8 +20,17 @@ from tenacity import (
     wait_exponential,
 )
 
+from ..limiter import (
+    MAX_IN_FLIGHT_PER_MODEL,
+    adaptive_limiter,
+    wait_unless_rate_limited,
+)
+
 logger = logging.getLogger(__name__)
 
+# upper bound of the LLM calls in flight for a model, adjusted by the adaptive limiter
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", MAX_IN_FLIGHT_PER_MODEL))
+
 
 def ask_model(
     model: str, prompt: str, responseModelClass: Type[BaseModel]
@@ -61,7 +71,9 @@ def ask_model(
 
 @retry(
     stop=stop_after_attempt(7),
-    wait=wait_exponential(multiplier=1, min=4, max=120),
+    wait=wait_unless_rate_limited(
+        wait_exponential(multiplier=1, min=4, max=120), (RateLimitError,)
+    ),
     retry=retry_if_exception_type(
         (
             RateLimitError,
@@ -78,13 +90,20 @@ def _chat_with_litellm(
     responseModelClass: Type[BaseModel],
 ) -> Optional[str]:
     try:
-        response = litellm.completion(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=4096,
-            response_format=responseModelClass,
-        )
+        # wait for a slot of the model, rate limit errors lower its limit
+        with adaptive_limiter().slot(model_name, LLM_MAX_IN_FLIGHT) as call:
+            try:
+                response = litellm.completion(
+                    model=model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0,
+                    max_tokens=4096,
+                    response_format=responseModelClass,
+                )
+            except RateLimitError as e:
+                call.observe(e, rate_limited=True)
+                raise
+            call.observe(response)
 
         content = response.choices[0].message.content
         if content:
@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+from pathlib import Path
+
+from ..vectorize import TextChunksWithEmbedding
+from ..vectorize.local_embedding import model_path_name
+
+logger = logging.getLogger(__name__)
+
+# precomputed query vectors shipped with the package, saved in the same layout
+# as the storage, i.e. chunks/0/<model>_<dimension>/0/<query set>.chunks. none are
+# shipped until scripts/build_query_vectors.py has built every query set for every
+# supported model, the vectors are embedded once and saved to the storage instead
+QUERY_VECTORS_PATH = str(Path(__file__).parent / "query_vectors")
+QUERY_CIK, QUERY_CHUNK_ALGO_VERSION = "0", "0"
+
+
+class QueryBank:
+    """
+    Embeddings of the extraction queries, kept in memory once loaded.
+
+    Each query set is registered under the name it is saved with. Its vectors
+    for a model and dimension are looked up in the package data, then in the
+    storage, and embedded when neither has them for the current texts of the
+    queries. Embedding happens once per process, under a lock, and the result is
+    saved only if no other process saved it first.
+    """
+
+    def __init__(
+        self,
+        package_path: str = QUERY_VECTORS_PATH,
+        storage_base_path: str | None = None,
+    ):
+        self.package_path = package_path
+        self.storage_base_path = (
+            os.environ.get("STORAGE_PREFIX", "")
+            if storage_base_path is None
+            else storage_base_path
+        )
+        self._query_sets: dict[str, list[str]] = {}
+        self._vectors: dict[tuple[str, str, int], TextChunksWithEmbedding] = {}
+        self._lock = threading.Lock()
+        self._key_locks: dict[tuple[str, str, int], threading.Lock] = {}
+        self.n_embedded = 0
+
+    def register(self, name: str, texts: list[str]) -> None:
+        self._query_sets[name] = texts
+
+    def names(self) -> list[str]:
+        return list(self._query_sets)
+
+    def get(self, name: str, model: str, dimension: int) -> TextChunksWithEmbedding:
+        """
+        return the vectors of a registered query set for a model and dimension
+        """
+        if name not in self._query_sets:
+            raise ValueError(f"Unknown query set {name}")
+
+        key = (name, model_path_name(model), dimension)
+        queries = self._vectors.get(key)
+        if queries is None:
+            with self._key_lock(key):
+                queries = self._vectors.get(key)
+                if queries is None:
+                    queries = self._load_or_embed(name, model, dimension)
+                    self._vectors[key] = queries
+        return queries
+
+    def preload(self, models: list[tuple[str, int]]) -> None:
+        """
+        load the vectors of all registered query sets for each model and dimension
+        """
+        for model, dimension in models:
+            for name in self._query_sets:
+                try:
+                    self.get(name, model, dimension)
+                except Exception as e:
+                    logger.warning(f"cannot preload {name} for {model}: {e}")
+
+    def _key_lock(self, key: tuple[str, str, int]) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load_or_embed(
+        self, name: str, model: str, dimension: int
+    ) -> TextChunksWithEmbedding:
+        texts = self._query_sets[name]
+        stale = False
+        for base_path in (self.package_path, self.storage_base_path):
+            try:
+                queries = TextChunksWithEmbedding.load(
+                    cik=QUERY_CIK,
+                    accession_number=name,
+                    model=model,
+                    dimension=dimension,
+                    chunk_algo_version=QUERY_CHUNK_ALGO_VERSION,
+                    storage_base_path=base_path,
+                )
+            except ValueError:
+                continue
+            if list(queries.texts) == texts:
+                return queries
+            # the queries were changed since their vectors were saved
+            stale = True
+
+        logger.info(f"embedding {name} queries with {model}")
+        queries = TextChunksWithEmbedding(
+            texts=texts,
+            metadata={
+                "cik": QUERY_CIK,
+                "accession_number": name,
+                "chunk_algo_version": QUERY_CHUNK_ALGO_VERSION,
+            },
+        )
+        queries.get_embeddings(model=model, dimension=dimension)
+        self.n_embedded += 1
+        if not queries.save(self.storage_base_path, overwrite=stale):
+            logger.debug(f"{name} queries for {model} were saved by another process")
+        return queries
+
+
+_query_bank = None
+
+
+def query_bank() -> QueryBank:
+    """
+    return the query bank shared in this process
+    """
+    global _query_bank
+    if _query_bank is None:
+        _query_bank = QueryBank()
+    return _query_bank
+
+
+def parse_query_models(spec: str) -> list[tuple[str, int]]:
+    """
+    parse comma separated model:dimension pairs, e.g. the QUERY_BANK_MODELS
+    environment variable "text-embedding-3-small:1536,vertex_ai/text-embedding-005:768"
+    """
+    models = []
+    for item in spec.split(","):
+        if item.strip():
+            model, dimension = item.strip().rsplit(":", 1)
+            models.append((model, int(dimension)))
+    return models
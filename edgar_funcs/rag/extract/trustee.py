@@ -5,6 +5,9 @@ from typing import Any, Optional, Type, TypedDict
 from pydantic import BaseModel
 
 from ..vectorize import TextChunksWithEmbedding
+from ..vectorize.artifact import ArtifactChangedError
+from ..vectorize.artifact_cache import load_chunks
+from ..vectorize.sections import lookup_section
 from .algo import (
     gather_chunk_distances,
     nearest_chunks,
@@ -13,6 +16,7 @@ from .algo import (
     top_adjacent_chunks,
 )
 from .llm import ask_model
+from .query_bank import query_bank
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +26,18 @@ TRUSTEE_COMP_QUERIES = [
     "Board Director or Intereed Person Compensation Details with Amount",
     "Interested Person Compensation Remuneration Detailed Amount",
 ]
+# name of the query set in the query bank, also its file name in storage
+TRUSTEE_COMP_QUERY_SET = "trustee_queries"
+query_bank().register(TRUSTEE_COMP_QUERY_SET, TRUSTEE_COMP_QUERIES)
+
+# headings of the trustee compensation section, matched against normalized headings
+TRUSTEE_COMP_SECTIONS = [
+    r"^(fund )?compensation$",
+    r"\b(trustee|director|board)s?\b.*\bcompensation\b",
+    r"\bcompensation\b.*\b(trustee|director|board)s?\b",
+    r"\bcompensation from (the )?fund complex\b",
+]
+TRUSTEE_COMP_SECTION_KEYWORDS = ["aggregate compensation", "total compensation"]
 
 
 TRUSTEE_COMP_PROMPT = """
@@ -97,15 +113,17 @@ def extract_trustee_comp_from_filing(
     embedding_dimension: int,
     chunk_algo_version: str,
     model: str,
+    chunks: TextChunksWithEmbedding | None = None,
     **_,  # ignore any other parameters
 ) -> TrusteeComp | None:
-    chunks = TextChunksWithEmbedding.load(
-        cik=cik,
-        accession_number=accession_number,
-        model=embedding_model,
-        dimension=embedding_dimension,
-        chunk_algo_version=chunk_algo_version,
-    )
+    if chunks is None:
+        chunks = load_chunks(
+            cik=cik,
+            accession_number=accession_number,
+            model=embedding_model,
+            dimension=embedding_dimension,
+            chunk_algo_version=chunk_algo_version,
+        )
     queries = _load_trustee_comp_queries(
         embedding_model=embedding_model, embedding_dimension=embedding_dimension
     )
@@ -113,40 +131,33 @@ def extract_trustee_comp_from_filing(
     if chunks is None or queries is None:
         return None
 
-    result = _extract_trustee_comp(
-        queries=queries,
-        chunks=chunks,
-        model=model,
-        responseModelClass=TrusteeCompensationResponse,
-    )
-    return result
-
-
-def _load_trustee_comp_queries(embedding_model: str, embedding_dimension: int):
-    cik, accession_number, chunk_algo_version = "0", "trustee_queries", "0"
     try:
-        return TextChunksWithEmbedding.load(
+        return _extract_trustee_comp(
+            queries=queries,
+            chunks=chunks,
+            model=model,
+            responseModelClass=TrusteeCompensationResponse,
+        )
+    except ArtifactChangedError:
+        # the filing was saved again since its chunks were loaded
+        chunks = load_chunks(
             cik=cik,
             accession_number=accession_number,
             model=embedding_model,
             dimension=embedding_dimension,
             chunk_algo_version=chunk_algo_version,
+            reload=True,
         )
-    except ValueError:
-        # saved queries vectors not found
-        # create new one
-        logger.debug("Creating new trustee compensation queries")
-        queries = TextChunksWithEmbedding(
-            texts=TRUSTEE_COMP_QUERIES,
-            metadata={
-                "cik": cik,
-                "accession_number": accession_number,
-                "chunk_algo_version": chunk_algo_version,
-            },
+        return _extract_trustee_comp(
+            queries=queries,
+            chunks=chunks,
+            model=model,
+            responseModelClass=TrusteeCompensationResponse,
         )
-        queries.get_embeddings(model=embedding_model, dimension=embedding_dimension)
-        queries.save()
-        return queries
+
+
+def _load_trustee_comp_queries(embedding_model: str, embedding_dimension: int):
+    return query_bank().get(TRUSTEE_COMP_QUERY_SET, embedding_model, embedding_dimension)
 
 
 def _extract_trustee_comp(
@@ -199,7 +210,20 @@ def _find_relevant_text(
     chunks: TextChunksWithEmbedding,
     method: str,
 ):
-    relevance_result = nearest_chunks(queries.embeddings, chunks.embeddings, top_k=20)
+    # when the section index locates the compensation section,
+    # only rank the chunks in that section
+    section_chunk_nums = lookup_section(
+        chunks.metadata.get("section_index"),
+        TRUSTEE_COMP_SECTIONS,
+        TRUSTEE_COMP_SECTION_KEYWORDS,
+    )
+    relevance_result = nearest_chunks(
+        queries.unit_vectors(),
+        chunks.unit_vectors(),
+        top_k=20,
+        filtered_chunk_nums=section_chunk_nums,
+        normalized=True,
+    )
     if not relevance_result:
         return [], ""
 
@@ -1,8 +1,17 @@
 from functools import lru_cache
 
+import tiktoken
 from google.cloud import storage
 
 
 @lru_cache(maxsize=1)
 def gcs_client():
     return storage.Client()
+
+
+@lru_cache(maxsize=1)
+def tiktoken_encoding():
+    # tiktoken does not support Gemini model
+    # use OpenAI as stand-in.
+    # since token limit is an OpenAI issue anyways.
+    return tiktoken.encoding_for_model("text-embedding-ada-002")
@@ -0,0 +1,240 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+# default max number of calls in flight for one model, EMBEDDING_MAX_IN_FLIGHT
+# and LLM_MAX_IN_FLIGHT set it for embedding and LLM calls
+MAX_IN_FLIGHT_PER_MODEL = int(os.environ.get("MAX_IN_FLIGHT_PER_MODEL", "8"))
+# calls faster than this are never considered slow
+MIN_SLOW_LATENCY = 1.0
+
+
+class _ModelLimit:
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = float(max(1, max_limit // 2))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.pause = 0.0
+        self.latency: float | None = None
+        self.min_latency: float | None = None
+        self.calls = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+
+class CallOutcome:
+    """
+    what the caller learned from one call, passed back to the limiter
+    """
+
+    def __init__(self):
+        self.rate_limited = False
+        # the call raised an error, e.g. a connection or server error
+        self.failed = False
+        self.retry_after: float | None = None
+        self.remaining_requests: int | None = None
+
+    def observe(self, response_or_error, rate_limited: bool = False) -> None:
+        """
+        record a rate limit error and the rate limit headers of a response or error
+        """
+        self.rate_limited = self.rate_limited or rate_limited
+        headers = _response_headers(response_or_error)
+        for name, value in headers.items():
+            name = name.lower()
+            try:
+                if name.endswith("retry-after"):
+                    self.retry_after = float(value)
+                elif name.endswith("x-ratelimit-remaining-requests"):
+                    self.remaining_requests = int(value)
+            except (TypeError, ValueError):
+                pass
+
+
+class AdaptiveLimiter:
+    """
+    Limit the calls in flight for each model, adjusted with additive increase and
+    multiplicative decrease.
+
+    Every successful call raises the limit of its model by 1/limit, so the limit
+    grows by about one per round of calls, up to max_limit. Failed calls neither
+    raise the limit nor count towards the latency. A rate limit error
+    halves the limit, at most once per second, and pauses new calls for the model
+    for the retry-after period given by the provider, or an increasing pause.
+    Calls much slower than the fastest seen so far lower the limit slightly,
+    and a low x-ratelimit-remaining-requests header caps it.
+
+    Callers wait in acquire() instead of sleeping on their own, so that all
+    threads of a process back off together.
+    """
+
+    def __init__(
+        self,
+        max_limit: int = MAX_IN_FLIGHT_PER_MODEL,
+        min_limit: int = 1,
+        decrease_factor: float = 0.5,
+        latency_factor: float = 4.0,
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self._models: dict[str, _ModelLimit] = {}
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, model: str, max_limit: int | None = None) -> Iterator[CallOutcome]:
+        """
+        hold a call slot for model while the block runs, an error raised by the
+        block marks the call failed
+
+        Example:
+            >>> with limiter.slot("gpt-4o") as call:
+            ...     try:
+            ...         response = completion(...)
+            ...         call.observe(response)
+            ...     except RateLimitError as e:
+            ...         call.observe(e, rate_limited=True)
+            ...         raise
+        """
+        self.acquire(model, max_limit)
+        outcome = CallOutcome()
+        start_t = time.monotonic()
+        try:
+            yield outcome
+        except Exception:
+            outcome.failed = True
+            raise
+        finally:
+            self.release(model, time.monotonic() - start_t, outcome)
+
+    def acquire(self, model: str, max_limit: int | None = None) -> None:
+        with self._condition:
+            state = self._model(model, max_limit)
+            while True:
+                now = time.monotonic()
+                if now < state.paused_until:
+                    self._condition.wait(state.paused_until - now)
+                elif state.in_flight >= int(state.limit):
+                    self._condition.wait()
+                else:
+                    break
+            state.in_flight += 1
+
+    def release(self, model: str, latency: float, outcome: CallOutcome) -> None:
+        with self._condition:
+            state = self._models[model]
+            state.in_flight -= 1
+            state.calls += 1
+            now = time.monotonic()
+
+            if outcome.rate_limited:
+                state.rate_limited += 1
+                self._decrease(state, self.decrease_factor, now)
+                # without a retry-after header, pause for 1 second, doubled on
+                # every rate limit error in a row
+                state.pause = min(60.0, state.pause * 2 or 1.0)
+                pause = outcome.retry_after or state.pause
+                state.paused_until = max(state.paused_until, now + pause)
+                logger.info(f"{model} rate limited, in flight limit {int(state.limit)}")
+            elif outcome.failed:
+                state.failed += 1
+            else:
+                state.pause = 0.0
+                if state.latency is None:
+                    state.latency = latency
+                else:
+                    state.latency = 0.8 * state.latency + 0.2 * latency
+                if state.min_latency is None or latency < state.min_latency:
+                    state.min_latency = latency
+                slow_latency = self.latency_factor * state.min_latency
+                if latency > max(MIN_SLOW_LATENCY, slow_latency):
+                    self._decrease(state, 0.9, now)
+                else:
+                    state.limit = min(state.max_limit, state.limit + 1 / state.limit)
+
+            if outcome.remaining_requests is not None:
+                state.limit = max(
+                    self.min_limit, min(state.limit, outcome.remaining_requests)
+                )
+
+            self._condition.notify_all()
+
+    def limits(self) -> dict[str, dict]:
+        """
+        return the current limit and statistics of each model
+        """
+        with self._condition:
+            return {
+                model: {
+                    "limit": int(state.limit),
+                    "max_limit": state.max_limit,
+                    "in_flight": state.in_flight,
+                    "latency": state.latency,
+                    "calls": state.calls,
+                    "rate_limited": state.rate_limited,
+                    "failed": state.failed,
+                }
+                for model, state in self._models.items()
+            }
+
+    def _model(self, model: str, max_limit: int | None) -> _ModelLimit:
+        if model not in self._models:
+            self._models[model] = _ModelLimit(max_limit or self.max_limit)
+        return self._models[model]
+
+    def _decrease(self, state: _ModelLimit, factor: float, now: float) -> None:
+        # decrease at most once per second, calls already in flight when
+        # the limit was lowered do not lower it again
+        if now - state.last_decrease < 1.0:
+            return
+        state.limit = max(self.min_limit, state.limit * factor)
+        state.last_decrease = now
+
+
+_adaptive_limiter = AdaptiveLimiter()
+
+
+def adaptive_limiter() -> AdaptiveLimiter:
+    """
+    return the limiter shared by all embedding and LLM calls in this process
+    """
+    return _adaptive_limiter
+
+
+def wait_unless_rate_limited(wait, rate_limit_errors: tuple):
+    """
+    tenacity wait strategy that retries rate limit errors right away, since the
+    limiter already makes the retry wait for a slot, and uses wait otherwise
+    """
+
+    def _wait(retry_state) -> float:
+        if retry_state.outcome is not None and isinstance(
+            retry_state.outcome.exception(), rate_limit_errors
+        ):
+            return 0
+        return wait(retry_state)
+
+    return _wait
+
+
+def _response_headers(response_or_error) -> dict:
+    # litellm keeps provider headers in different places for responses and errors
+    hidden_params = getattr(response_or_error, "_hidden_params", None) or {}
+    headers = hidden_params.get("additional_headers")
+    if headers is None:
+        headers = getattr(response_or_error, "litellm_response_headers", None)
+    if headers is None:
+        response = getattr(response_or_error, "response", None)
+        headers = getattr(response, "headers", None)
+    try:
+        return dict(headers or {})
+    except (TypeError, ValueError):
+        return {}
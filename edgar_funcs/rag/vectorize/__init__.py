@@ -1,14 +1,59 @@
 import logging
+import multiprocessing
 import os
 import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from pathlib import Path
-from typing import TypedDict
+from functools import partial
+from typing import NotRequired, TypedDict
+
+import numpy as np
 
 from ...edgar import SECFiling
-from ..helper import gcs_client
-from .chunking import chunk_text, trim_html_content
+from ..helper import tiktoken_encoding
+from .artifact import (
+    ARTIFACT_SUFFIX,
+    ArtifactChangedError,
+    ChunkTexts,
+    encode_artifact,
+    read_artifact,
+)
+from .batcher import embedding_batcher
+from .chunking import (
+    CHUNK_ALGORITHM_VERSIONS,
+    chunk_text,
+    load_nlp,
+    mark_text_headings,
+    trim_html_content,
+)
+from .compression import ZSTD_DICTIONARY_PATH, chunk_codec
 from .embedding import batch_embedding
+from .keyword_index import KeywordIndex
+from .local_embedding import model_path_name
+from .manifest import chunk_manifest
+from .matryoshka import source_dimensions, truncate_embeddings
+from .pack import (
+    PACK_INDEX_CACHE_SIZE,
+    PACK_INDEX_TTL,
+    PACK_SUFFIX,
+    USE_CHUNK_PACKS,
+    PackEntryReader,
+    read_pack_index,
+    update_pack,
+)
+from .quantize import (
+    DEFAULT_EMBEDDING_DTYPE,
+    NORMALIZE_EMBEDDINGS,
+    dequantize,
+    normalize_vectors,
+    quantize,
+    similarity_vectors,
+)
+from .sections import SectionIndex
+from .storage import Storage, storage
 
 logger = logging.getLogger(__name__)
 
@@ -20,31 +65,161 @@ class TextEmbeddingMetadata(TypedDict):
     model: str
     dimension: int
     chunk_algo_version: str
+    token_counts: NotRequired[list[int]]
+    section_paths: NotRequired[list[str]]
+    section_index: NotRequired[SectionIndex]
+    embedding_dtype: NotRequired[str]
+    normalized: NotRequired[bool]
+    source_dimension: NotRequired[int]
 
 
 class TextChunksWithEmbedding:
     texts: list[str]
-    embeddings: list[list[float]]
+    # one row per chunk, in the storage dtype recorded in metadata["embedding_dtype"]
+    embeddings: np.ndarray
+    # scale of each row when the embeddings are stored as int8
+    embedding_scales: np.ndarray | None
+    # norm of each row when the embeddings are stored normalized
+    embedding_norms: np.ndarray | None
     metadata: TextEmbeddingMetadata
 
     def __init__(
         self,
         texts: list[str],
-        embeddings: list[list[float]] = [],
-        metadata={
+        embeddings: list[list[float]] | np.ndarray = [],
+        metadata=None,
+        embedding_scales: np.ndarray | None = None,
+        embedding_dtype: str | None = None,
+        embedding_norms: np.ndarray | None = None,
+    ):
+        if not texts:
+            raise ValueError("texts cannot be empty")
+
+        self.texts = texts
+        self.metadata = metadata or {
             "cik": "",
             "accession_number": "",
             "model": "",
             "dimension": 0,
             "chunk_algo_version": "0",
-        },
-    ):
-        if not texts:
-            raise ValueError("texts cannot be empty")
+        }
+        self._keyword_index = None
+        self.set_embeddings(
+            embeddings, embedding_scales, embedding_dtype, embedding_norms=embedding_norms
+        )
 
-        self.texts = texts
-        self.embeddings = embeddings
-        self.metadata = metadata
+    def set_embeddings(
+        self,
+        embeddings: list[list[float]] | np.ndarray,
+        embedding_scales: np.ndarray | None = None,
+        embedding_dtype: str | None = None,
+        embedding_norms: np.ndarray | None = None,
+        normalized: bool | None = None,
+    ) -> None:
+        """
+        Keep the embeddings as a contiguous array of the storage dtype
+
+        Args:
+            embeddings: embeddings returned by the API, or an array already in the
+                        storage dtype, e.g. when loading saved chunks, which is
+                        kept as is unless embedding_dtype asks for another dtype
+            embedding_scales: scale of each row of int8 embeddings
+            embedding_dtype: storage dtype, defaults to metadata["embedding_dtype"]
+                             or the EMBEDDING_DTYPE environment variable
+            embedding_norms: norm of each row of embeddings already normalized
+            normalized: store the embeddings normalized, defaults to
+                        metadata["normalized"] or the NORMALIZE_EMBEDDINGS
+                        environment variable
+        """
+        if (
+            isinstance(embeddings, np.ndarray)
+            and embedding_dtype in (None, str(embeddings.dtype))
+            and (embeddings.dtype != np.int8 or embedding_scales is not None)
+            and normalized in (None, embedding_norms is not None)
+        ):
+            self.embeddings = embeddings
+            self.embedding_scales = embedding_scales
+            self.embedding_norms = embedding_norms
+        else:
+            dtype = (
+                embedding_dtype
+                or self.metadata.get("embedding_dtype")
+                or DEFAULT_EMBEDDING_DTYPE
+            )
+            if normalized is None:
+                normalized = self.metadata.get("normalized", NORMALIZE_EMBEDDINGS)
+            self.embedding_norms = None
+            if normalized and len(embeddings) > 0:
+                embeddings, self.embedding_norms = normalize_vectors(
+                    np.asarray(embeddings, dtype=np.float64)
+                )
+            self.embeddings, self.embedding_scales = quantize(embeddings, dtype)
+
+        self._unit_vectors = None
+        if len(self.embeddings) > 0:
+            self.metadata["embedding_dtype"] = str(self.embeddings.dtype)
+            if self.embedding_norms is not None:
+                self.metadata["normalized"] = True
+            else:
+                self.metadata.pop("normalized", None)
+
+    def vectors(self) -> np.ndarray:
+        """
+        return the embeddings as floats, int8 embeddings are scaled back and
+        normalized embeddings are scaled back to their norms
+        """
+        vectors = dequantize(self.embeddings, self.embedding_scales)
+        if self.embedding_norms is not None:
+            return vectors * self.embedding_norms[:, None]
+        return vectors
+
+    def unit_vectors(self) -> np.ndarray:
+        """
+        return the embeddings scaled to unit length, for cosine similarity as a
+        dot product
+
+        float32 and float64 embeddings stored normalized are returned as is, the
+        others, e.g. chunks saved before normalization, are normalized on the
+        first call and kept with the chunks
+        """
+        if self._unit_vectors is None:
+            if self.embedding_norms is not None and self.embeddings.dtype in (
+                np.float32,
+                np.float64,
+            ):
+                self._unit_vectors = self.embeddings
+            else:
+                vectors = similarity_vectors(self.embeddings)
+                self._unit_vectors = normalize_vectors(vectors)[0]
+        return self._unit_vectors
+
+    def keyword_index(self) -> KeywordIndex:
+        """
+        return the BM25 index of the texts, built on the first call and kept with
+        the chunks
+        """
+        if self._keyword_index is None:
+            self._keyword_index = KeywordIndex(self.texts)
+        return self._keyword_index
+
+    def truncate_dimension(self, dimension: int) -> "TextChunksWithEmbedding":
+        """
+        Derive embeddings of a smaller dimension from these ones
+
+        Only valid for models listed in MATRYOSHKA_DIMENSIONS. The embeddings keep
+        their storage dtype.
+        """
+        dtype = str(self.embeddings.dtype)
+        return TextChunksWithEmbedding(
+            texts=self.texts,
+            embeddings=truncate_embeddings(self.vectors(), dimension),
+            metadata={
+                **self.metadata,
+                "dimension": dimension,
+                "source_dimension": self.metadata["dimension"],
+            },
+            embedding_dtype=dtype,
+        )
 
     def is_ready(self) -> bool:
         return (
@@ -53,7 +228,7 @@ class TextChunksWithEmbedding:
             and len(self.texts) > 0
             and len(self.embeddings) > 0
             and len(self.texts) == len(self.embeddings)
-            and len(self.embeddings[0]) == self.metadata["dimension"]
+            and self.embeddings.shape[1] == self.metadata["dimension"]
         )
 
     def get_embeddings(
@@ -64,8 +239,21 @@ class TextChunksWithEmbedding:
         if not self.texts:
             raise ValueError("texts cannot be empty")
 
+        # reuse the token counts recorded at chunking time, if any
+        token_counts = self.metadata.get("token_counts")
+
         start_t = datetime.now()
-        self.embeddings = batch_embedding(self.texts, model=model, dimension=dimension)
+        batcher = embedding_batcher()
+        if batcher is not None:
+            # share embedding requests with other filings embedded at the same time
+            embeddings = batcher.submit(
+                self.texts, model=model, dimension=dimension, token_counts=token_counts
+            ).result()
+        else:
+            embeddings = batch_embedding(
+                self.texts, model=model, dimension=dimension, token_counts=token_counts
+            )
+        self.set_embeddings(embeddings)
         elapsed_t = datetime.now() - start_t
         logger.debug(
             f"batch_embedding of {len(self.texts)} chunks of text with {model} took {elapsed_t.total_seconds():.2f} seconds"  # noqa E501
@@ -74,27 +262,65 @@ class TextChunksWithEmbedding:
         self.metadata["dimension"] = dimension
 
     def get_text_chunks(self, chunks: list[int]) -> str:
+        if isinstance(self.texts, ChunkTexts):
+            # read the selected texts of a loaded artifact together
+            self.texts.prefetch(chunks)
         return "\n\n".join([self.texts[i] for i in chunks])
 
-    def save(self, storage_base_path=os.environ.get("STORAGE_PREFIX", "")) -> None:
+    def save(
+        self,
+        storage_base_path=os.environ.get("STORAGE_PREFIX", ""),
+        overwrite: bool = True,
+    ) -> bool:
+        """
+        save the chunks, with overwrite=False an existing artifact is kept as is
+
+        Returns:
+            bool: False when the artifact already existed and was not overwritten
+        """
         if self.is_ready():
-            path = _blob_path(**self.metadata)
-            bucket_name, prefix = _storage_prefix(storage_base_path)
-            obj = [self.texts, self.embeddings, self.metadata]
-            if bucket_name:
-                # use GCS bucket
-                bucket = gcs_client().bucket(bucket_name)
-                blob = bucket.blob(f"{prefix}/{path}")
-                blob.upload_from_string(pickle.dumps(obj))
-            else:
-                # save to local file system
-                output_path = Path(prefix) / path
-                os.makedirs(output_path.parent, exist_ok=True)
-                with open(output_path, "wb") as f:
-                    pickle.dump(obj, f)
+            # texts are compressed when CHUNK_COMPRESSION is set
+            codec = chunk_codec(
+                partial(_read_dictionary, storage_base_path=storage_base_path)
+            )
+            content = encode_artifact(
+                self.texts,
+                self.embeddings,
+                self.embedding_scales,
+                self.metadata,
+                codec,
+                norms=self.embedding_norms,
+            )
+            path = _artifact_path(**self.metadata)
+            chunks_storage = storage(storage_base_path)
+            if not chunks_storage.put(path, content, overwrite):
+                return False
+            if USE_CHUNK_PACKS:
+                self._update_pack(chunks_storage, content, storage_base_path)
+            manifest = chunk_manifest()
+            if manifest:
+                manifest.record(self.metadata, len(self.texts), len(content))
+                manifest.flush()
+            return True
         else:
             raise ValueError("cannot save without embedding data")
 
+    def _update_pack(
+        self, chunks_storage: Storage, content: bytes, storage_base_path: str
+    ) -> None:
+        # load reads the pack first, replace the filing in the pack of the CIK, if
+        # it was compacted, so the pack is not older than the artifact. this
+        # downloads and uploads the whole pack on every save. the artifact is
+        # saved already, a failed update leaves the older filing in the pack until
+        # the filing is saved again
+        pack_path = _pack_path(**self.metadata)
+        artifacts = {self.metadata["accession_number"]: content}
+        try:
+            update_pack(chunks_storage, pack_path, artifacts, create=False)
+        except Exception as e:
+            logger.warning(f"cannot update {pack_path}: {type(e)}: {str(e)}")
+        _drop_pack_index(pack_path, storage_base_path)
+
     @classmethod
     def load(
         cls,
@@ -105,57 +331,194 @@ class TextChunksWithEmbedding:
         chunk_algo_version: str,
         storage_base_path=os.environ.get("STORAGE_PREFIX", ""),
     ) -> "TextChunksWithEmbedding":
-        path = _blob_path(
-            cik=cik,
-            accession_number=accession_number,
-            model=model,
-            dimension=dimension,
-            chunk_algo_version=chunk_algo_version,
-        )
-        bucket_name, prefix = _storage_prefix(storage_base_path)
+        key = {
+            "cik": cik,
+            "accession_number": accession_number,
+            "model": model,
+            "dimension": dimension,
+            "chunk_algo_version": chunk_algo_version,
+        }
+        path = _blob_path(**key)
         obj = None
-        if bucket_name:
-            # use GCS bucket
-            bucket = gcs_client().bucket(bucket_name)
-            blob = bucket.blob(f"{prefix}/{path}")
-            if blob.exists():
-                obj = pickle.loads(blob.download_as_bytes())
-        else:
-            # load from local file system
-            output_path = Path(prefix) / path
-            if output_path.exists():
-                with open(output_path, "rb") as f:
-                    obj = pickle.load(f)
-
-        if obj and len(obj) == 3:
+        if USE_CHUNK_PACKS:
+            # filings of the CIK packed together, see scripts/compact_chunks.py
+            pack_path = _pack_path(**key)
+            obj = _read_packed_artifact(pack_path, accession_number, storage_base_path)
+        if obj is None:
+            obj = _read_artifact(_artifact_path(**key), storage_base_path)
+        if obj:
+            texts, embeddings, scales, norms, metadata = obj
             return TextChunksWithEmbedding(
-                texts=obj[0], embeddings=obj[1], metadata=obj[2]
+                texts=texts,
+                embeddings=embeddings,
+                metadata=metadata,
+                embedding_scales=scales,
+                embedding_norms=norms,
             )
 
+        legacy_chunks = _legacy_chunks(_read_blob(path, storage_base_path))
+        if legacy_chunks:
+            return legacy_chunks
+
+        # derive the dimension from embeddings stored at a larger one
+        for stored_dimension in source_dimensions(model, dimension):
+            try:
+                stored = cls.load(
+                    cik=cik,
+                    accession_number=accession_number,
+                    model=model,
+                    dimension=stored_dimension,
+                    chunk_algo_version=chunk_algo_version,
+                    storage_base_path=storage_base_path,
+                )
+            except ValueError:
+                continue
+            logger.debug(f"truncating {stored_dimension} dimensions of {path}")
+            return stored.truncate_dimension(dimension)
+
         raise ValueError(f"Cannot load chunks from {path}")
 
 
-def chunk_filing(filing: SECFiling, method: str = "spacy") -> list[str]:
-    if method != "spacy":
+def _legacy_chunks(obj) -> TextChunksWithEmbedding | None:
+    # chunks pickled as [texts, embeddings, metadata] before the columnar format
+    if not obj or len(obj) != 3:
+        return None
+
+    texts, embeddings, metadata = obj
+    if not isinstance(embeddings, np.ndarray):
+        # chunks saved as lists of floats, keep their full precision
+        return TextChunksWithEmbedding(
+            texts=texts,
+            embeddings=embeddings,
+            metadata=metadata,
+            embedding_dtype="float64",
+        )
+    return TextChunksWithEmbedding(
+        texts=texts,
+        embeddings=embeddings,
+        metadata=metadata,
+        embedding_scales=metadata.pop("embedding_scales", None),
+    )
+
+
+def chunk_filing(
+    filing: SECFiling,
+    method: str = "spacy",
+    size_unit: str = "char",
+    metadata: dict | None = None,
+) -> list[str]:
+    if method not in CHUNK_ALGORITHM_VERSIONS:
         raise ValueError(f"Unsupported chunking method {method}")
 
-    path, content = filing.get_doc_content("485BPOS", file_types=["htm", "txt"])[0]
-    text_content = None
+    path, content = _filing_document(filing)
 
+    start_t = datetime.now()
+    chunks = _chunk_document(path, content, method, size_unit, metadata)
+    elapsed_t = datetime.now() - start_t
+    logger.debug(
+        f"chunking {filing.cik}/{filing.accession_number} into {len(chunks)} chunks took {elapsed_t.total_seconds():.2f} seconds"  # noqa E501
+    )
+    return chunks
+
+
+class ChunkedFiling(TypedDict):
+    cik: str
+    accession_number: str
+    chunks: list[str]
+    metadata: dict
+    elapsed: float
+
+
+def chunk_filings(
+    filings: list[SECFiling],
+    workers: int = 1,
+    method: str = "spacy",
+    size_unit: str = "char",
+) -> list[ChunkedFiling]:
+    """
+    Chunk multiple filings using a pool of worker processes
+
+    The documents are downloaded in the calling process, trimming and chunking
+    runs in the workers. The spaCy model and the tokenizer are loaded before the
+    workers are forked so that each worker does not load them again.
+
+    Args:
+        filings (list[SECFiling]): filings to chunk
+        workers (int): number of worker processes, 1 to chunk in this process
+
+    Returns:
+        list[ChunkedFiling]: chunks of each filing, in the same order as filings,
+                             with the time spent chunking the filing in seconds
+    """
+    if method not in CHUNK_ALGORITHM_VERSIONS:
+        raise ValueError(f"Unsupported chunking method {method}")
+
+    documents = [_filing_document(filing) for filing in filings]
+    paths = [path for path, _ in documents]
+    contents = [content for _, content in documents]
+    chunk_func = partial(_chunk_document_timed, method=method, size_unit=size_unit)
+
+    start_t = datetime.now()
+    if workers > 1 and len(filings) > 1:
+        load_nlp()
+        tiktoken_encoding()
+        mp_context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(filings)), mp_context=mp_context
+        ) as executor:
+            results = list(executor.map(chunk_func, paths, contents))
+    else:
+        results = [chunk_func(path, content) for path, content in documents]
+    elapsed_t = datetime.now() - start_t
+    logger.debug(
+        f"chunking {len(filings)} filings with {workers} workers took {elapsed_t.total_seconds():.2f} seconds"  # noqa E501
+    )
+
+    return [
+        {
+            "cik": filing.cik,
+            "accession_number": filing.accession_number,
+            "chunks": chunks,
+            "metadata": metadata,
+            "elapsed": elapsed,
+        }
+        for filing, (chunks, metadata, elapsed) in zip(filings, results)
+    ]
+
+
+def _filing_document(filing: SECFiling) -> tuple[str, str]:
+    # return the path and content of the 485BPOS document in a filing
+    return filing.get_doc_content("485BPOS", file_types=["htm", "txt"])[0]
+
+
+def _chunk_document(
+    path: str,
+    content: str,
+    method: str,
+    size_unit: str,
+    metadata: dict | None,
+) -> list[str]:
     if path.endswith((".html", ".htm")):
-        text_content = trim_html_content(content)
+        text_content = trim_html_content(content, mark_headings=method == "section")
     elif path.endswith(".txt"):
         text_content = content
+        if method == "section":
+            text_content = mark_text_headings(content)
     else:
         raise ValueError(f"Unsupported document format {path}")
 
+    return chunk_text(text_content, method=method, size_unit=size_unit, metadata=metadata)
+
+
+def _chunk_document_timed(
+    path: str, content: str, method: str, size_unit: str
+) -> tuple[list[str], dict, float]:
+    # runs in worker process, returns chunks, metadata and elapsed seconds
     start_t = datetime.now()
-    chunks = chunk_text(text_content, method=method)
+    metadata = {}
+    chunks = _chunk_document(path, content, method, size_unit, metadata)
     elapsed_t = datetime.now() - start_t
-    logger.debug(
-        f"chunking {filing.cik}/{filing.accession_number} into {len(chunks)} chunks took {elapsed_t.total_seconds():.2f} seconds"  # noqa E501
-    )
-    return chunks
+    return chunks, metadata, elapsed_t.total_seconds()
 
 
 def _blob_path(
@@ -167,19 +530,95 @@ def _blob_path(
     **_,  # ignore any other parameters
 ):
     # return the path for storing a TextChunkWithEmbedding object
-    model_name = model.split("/")[1] if "/" in model else model
+    model_name = model_path_name(model)
     return f"chunks/{chunk_algo_version}/{model_name}_{dimension}/{cik}/{accession_number}.pickle"  # noqa E501
 
 
-def _storage_prefix(storage_base_path: str):
-    # return tuple of (bucket_name, prefix)
-    # if the env var does not beginw with "gs://", returns ""
-    if storage_base_path.startswith("gs://"):
-        parts = storage_base_path[5:].split("/", 1)
-        return parts[0], parts[1] if len(parts) > 1 else ""
-    else:
-        if storage_base_path.startswith("/"):
-            return None, storage_base_path
-        else:
-            local_path = Path(__file__).parent.parent / storage_base_path
-            return None, str(local_path)
+def _artifact_path(**metadata) -> str:
+    # return the path for storing a TextChunkWithEmbedding object in columnar format,
+    # next to where it used to be pickled
+    return _blob_path(**metadata).removesuffix(".pickle") + ARTIFACT_SUFFIX
+
+
+def _pack_path(**metadata) -> str:
+    # return the path of the pack holding the filings of a CIK, next to the
+    # directory of its per filing artifacts
+    return _blob_path(**metadata).rsplit("/", 1)[0] + PACK_SUFFIX
+
+
+# pack indexes read in this process, by storage prefix and pack path, least
+# recently used first
+_pack_indexes: OrderedDict[tuple[str, str], tuple[float, tuple | None]] = OrderedDict()
+_pack_indexes_lock = threading.Lock()
+
+
+def _read_pack_index(path: str, storage_base_path: str):
+    # return the reader and index of the pack at path, None if it does not exist.
+    # indexes are kept for PACK_INDEX_TTL seconds, so loading the filings of a CIK
+    # reads its index once
+    key = (storage_base_path, path)
+    with _pack_indexes_lock:
+        cached = _pack_indexes.get(key)
+        if cached and time.monotonic() - cached[0] < PACK_INDEX_TTL:
+            _pack_indexes.move_to_end(key)
+            return cached[1]
+
+    reader = storage(storage_base_path).range_reader(path)
+    entry = (reader, read_pack_index(reader, reader.size)) if reader else None
+    with _pack_indexes_lock:
+        _pack_indexes[key] = (time.monotonic(), entry)
+        _pack_indexes.move_to_end(key)
+        while len(_pack_indexes) > PACK_INDEX_CACHE_SIZE:
+            _pack_indexes.popitem(last=False)
+    return entry
+
+
+def _drop_pack_index(path: str, storage_base_path: str) -> None:
+    # forget the index of a pack that was written since it was read
+    with _pack_indexes_lock:
+        _pack_indexes.pop((storage_base_path, path), None)
+
+
+def _read_packed_artifact(path: str, accession_number: str, storage_base_path: str):
+    # return texts, embeddings, scales and metadata of a filing in the pack at
+    # path, None if the pack does not exist or does not have the filing
+    try:
+        return _read_pack_entry(path, accession_number, storage_base_path)
+    except ArtifactChangedError:
+        # the pack was compacted again since its index was read, read it again
+        _drop_pack_index(path, storage_base_path)
+        return _read_pack_entry(path, accession_number, storage_base_path)
+
+
+def _read_pack_entry(path: str, accession_number: str, storage_base_path: str):
+    entry = _read_pack_index(path, storage_base_path)
+    if entry is None or accession_number not in entry[1]:
+        return None
+    reader, index = entry
+    return read_artifact(
+        PackEntryReader(reader, index[accession_number][0]),
+        load_dictionary=partial(_read_dictionary, storage_base_path=storage_base_path),
+    )
+
+
+def _read_artifact(path: str, storage_base_path: str):
+    # return texts, embeddings, scales and metadata of the artifact saved at path,
+    # None if it does not exist
+    # only the header and the embeddings are read, the texts of chunks are read
+    # when they are accessed
+    reader = storage(storage_base_path).range_reader(path)
+    if reader is None:
+        return None
+    load_dictionary = partial(_read_dictionary, storage_base_path=storage_base_path)
+    return read_artifact(reader, load_dictionary=load_dictionary)
+
+
+def _read_dictionary(dict_id: str, storage_base_path: str) -> bytes | None:
+    # return the zstd dictionary saved by scripts/train_zstd_dictionary.py
+    return storage(storage_base_path).get(f"{ZSTD_DICTIONARY_PATH}/{dict_id}.dict")
+
+
+def _read_blob(path: str, storage_base_path: str):
+    # return the unpickled object saved at path, None if it does not exist
+    content = storage(storage_base_path).get(path)
+    return pickle.loads(content) if content is not None else None
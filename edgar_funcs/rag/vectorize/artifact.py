@@ -0,0 +1,500 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Protocol
+
+import numpy as np
+from google.api_core.exceptions import NotFound
+
+from .compression import TextBlockCodec
+
+# Columnar layout of a chunks artifact, every section starts at a multiple of
+# ARTIFACT_ALIGNMENT so the arrays can be used in place from a memory map
+#
+#   magic (8 bytes) | version (uint32) | header length (uint32) | header (JSON)
+#   embeddings      one row per chunk, C order, dtype from the header
+#   scales          float32 per row, int8 embeddings only
+#   norms           float64 per row, embeddings stored normalized only
+#   offsets         uint64, chunk i is texts[offsets[i]:offsets[i + 1]]
+#   texts           UTF-8 text of all chunks
+#   blocks          uint64, compressed artifacts only, block b is
+#                   texts[blocks[b]:blocks[b + 1]]
+#
+# the header holds the metadata and the (offset, length) of each section. the
+# texts of compressed artifacts (version 2) are zstd blocks of consecutive chunks,
+# described by the compression entry of the header, offsets then index the
+# decompressed texts. embeddings are never compressed so they can be memory mapped
+ARTIFACT_MAGIC = b"EDGARCHK"
+ARTIFACT_VERSION = 2
+ARTIFACT_SUFFIX = ".chunks"
+ARTIFACT_ALIGNMENT = 64
+# bytes read at once when loading an artifact, enough for the header of most
+# artifacts so loading takes one read for the header and one for the embeddings
+ARTIFACT_HEADER_READ_SIZE = 16 * 1024
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+class ArtifactChangedError(Exception):
+    """
+    the version of an artifact a reader is pinned to was replaced or deleted
+    """
+
+
+class ChunkTexts(Sequence):
+    """
+    Texts of the chunks in an artifact, each text is decoded when it is accessed
+    """
+
+    def __init__(self, buffer, offsets: np.ndarray):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            indices = range(*i.indices(len(self)))
+            self.prefetch(indices)
+            return [self[n] for n in indices]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return self._text(i)
+
+    def __iter__(self):
+        self.prefetch(range(len(self)))
+        return (self._text(i) for i in range(len(self)))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ChunkTexts({len(self)} chunks)"
+
+    @property
+    def nbytes(self) -> int:
+        # size of the UTF-8 texts of all chunks
+        return int(self._offsets[-1])
+
+    def prefetch(self, indices) -> None:
+        """
+        make the texts of the chunks available, all texts are in the buffer already
+        """
+
+    def _text(self, i: int) -> str:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return bytes(self._buffer[start:end]).decode("utf-8")
+
+
+class RangeReadChunkTexts(ChunkTexts):
+    """
+    Texts of the chunks in an artifact that are read from storage on demand
+    """
+
+    def __init__(self, reader: "RangeReader", texts_offset: int, offsets: np.ndarray):
+        super().__init__(None, offsets)
+        self._reader = reader
+        self._texts_offset = texts_offset
+        self._texts: dict[int, str] = {}
+
+    def prefetch(self, indices) -> None:
+        """
+        read the texts of the chunks not read yet, with one read per run of
+        consecutive chunk numbers
+        """
+        for run in _runs(i for i in indices if i not in self._texts):
+            start = int(self._offsets[run[0]])
+            data = self._reader.read(
+                self._texts_offset + start, int(self._offsets[run[-1] + 1]) - start
+            )
+            for i in run:
+                begin, end = self._offsets[i] - start, self._offsets[i + 1] - start
+                self._texts[i] = data[begin:end].decode("utf-8")
+
+    def _text(self, i: int) -> str:
+        if i not in self._texts:
+            self.prefetch([i])
+        return self._texts[i]
+
+
+class CompressedChunkTexts(RangeReadChunkTexts):
+    """
+    Texts of the chunks in a compressed artifact, the blocks holding the accessed
+    chunks are read and decompressed on demand
+    """
+
+    def __init__(
+        self,
+        reader: "RangeReader",
+        texts_offset: int,
+        offsets: np.ndarray,
+        codec: TextBlockCodec,
+        block_offsets: np.ndarray,
+    ):
+        super().__init__(reader, texts_offset, offsets)
+        self._codec = codec
+        self._block_offsets = block_offsets
+
+    def prefetch(self, indices) -> None:
+        """
+        read and decompress the blocks of the chunks not read yet, with one read
+        per run of consecutive blocks
+        """
+        block_chunks = self._codec.block_chunks
+        blocks = {i // block_chunks for i in indices if i not in self._texts}
+        for run in _runs(blocks):
+            start = int(self._block_offsets[run[0]])
+            data = self._reader.read(
+                self._texts_offset + start, int(self._block_offsets[run[-1] + 1]) - start
+            )
+            for b in run:
+                begin = int(self._block_offsets[b]) - start
+                end = int(self._block_offsets[b + 1]) - start
+                block = self._codec.decompress(data[begin:end])
+                first = b * block_chunks
+                base = int(self._offsets[first])
+                for i in range(first, min(first + block_chunks, len(self))):
+                    text_start = int(self._offsets[i]) - base
+                    text_end = int(self._offsets[i + 1]) - base
+                    self._texts[i] = block[text_start:text_end].decode("utf-8")
+
+
+def _runs(indices) -> list[list[int]]:
+    # group chunk or block numbers into runs of consecutive numbers
+    runs: list[list[int]] = []
+    for i in sorted(set(indices)):
+        if runs and runs[-1][-1] == i - 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    return runs
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ARTIFACT_ALIGNMENT) * ARTIFACT_ALIGNMENT
+
+
+def encode_artifact(
+    texts: Sequence[str],
+    embeddings: np.ndarray,
+    scales: np.ndarray | None,
+    metadata: Mapping,
+    codec: TextBlockCodec | None = None,
+    norms: np.ndarray | None = None,
+) -> bytes:
+    """
+    Serialize chunks into the columnar artifact layout, the texts are compressed
+    when a codec is given, norms are the norms of normalized embeddings
+    """
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+
+    columns = [("embeddings", np.ascontiguousarray(embeddings).tobytes())]
+    if scales is not None:
+        columns.append(("scales", np.asarray(scales, dtype="<f4").tobytes()))
+    if norms is not None:
+        columns.append(("norms", np.asarray(norms, dtype="<f8").tobytes()))
+    columns.append(("offsets", offsets.tobytes()))
+    if codec is None:
+        columns.append(("texts", b"".join(encoded)))
+    else:
+        compressed, block_offsets = codec.compress(encoded)
+        columns += [("texts", compressed), ("blocks", block_offsets.tobytes())]
+
+    header = {
+        "metadata": metadata,
+        "count": len(encoded),
+        "shape": list(embeddings.shape),
+        "dtype": str(embeddings.dtype),
+        "sections": {},
+    }
+    if codec is not None:
+        header["compression"] = codec.header()
+    # the section offsets depend on the header length, reserve room for them
+    # with a first pass using placeholder offsets of the final width
+    header["sections"] = {name: [2**40, len(data)] for name, data in columns}
+    header_len = len(json.dumps(header).encode("utf-8"))
+
+    offset = _aligned(_PREAMBLE.size + header_len)
+    for name, data in columns:
+        header["sections"][name] = [offset, len(data)]
+        offset = _aligned(offset + len(data))
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_len)
+
+    out = bytearray(offset)
+    # uncompressed artifacts keep version 1 so older readers can load them
+    version = 1 if codec is None else ARTIFACT_VERSION
+    out[: _PREAMBLE.size] = _PREAMBLE.pack(ARTIFACT_MAGIC, version, header_len)
+    out[_PREAMBLE.size : _PREAMBLE.size + header_len] = header_bytes
+    for name, data in columns:
+        start = header["sections"][name][0]
+        out[start : start + len(data)] = data
+    return bytes(out)
+
+
+def _header_length(head) -> int:
+    # check the preamble of an artifact and return the length of its header
+    if len(head) < _PREAMBLE.size:
+        raise ValueError("not a chunks artifact")
+    magic, version, header_len = _PREAMBLE.unpack_from(head, 0)
+    if magic != ARTIFACT_MAGIC:
+        raise ValueError("not a chunks artifact")
+    if version > ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported chunks artifact version {version}")
+    return header_len
+
+
+def decode_artifact(
+    buffer, load_dictionary=None
+) -> tuple[ChunkTexts, np.ndarray, np.ndarray | None, np.ndarray | None, dict]:
+    """
+    Read chunks from the artifact layout without copying, the embeddings and the
+    texts refer to the buffer, which can be bytes or a memory map
+
+    Args:
+        load_dictionary: callable returning the zstd dictionary of an id, for
+                         artifacts compressed with a dictionary
+
+    Returns:
+        tuple: texts, embeddings, int8 scales or None, norms of normalized
+               embeddings or None, metadata
+    """
+    header_len = _header_length(buffer)
+    header = json.loads(bytes(buffer[_PREAMBLE.size : _PREAMBLE.size + header_len]))
+    sections = header["sections"]
+
+    def column(name: str, dtype: str) -> np.ndarray:
+        offset, length = sections[name]
+        count = length // np.dtype(dtype).itemsize
+        return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+    embeddings = column("embeddings", header["dtype"]).reshape(header["shape"])
+    scales = column("scales", "<f4") if "scales" in sections else None
+    norms = column("norms", "<f8") if "norms" in sections else None
+    offsets = column("offsets", "<u8")
+    texts_offset, texts_len = sections["texts"]
+    if "compression" in header:
+        codec = TextBlockCodec.from_header(header["compression"], load_dictionary)
+        texts = CompressedChunkTexts(
+            BufferRangeReader(buffer),
+            texts_offset,
+            offsets,
+            codec,
+            column("blocks", "<u8"),
+        )
+    else:
+        texts_buffer = memoryview(buffer)[texts_offset : texts_offset + texts_len]
+        texts = ChunkTexts(texts_buffer, offsets)
+    return texts, embeddings, scales, norms, header["metadata"]
+
+
+class RangeReader(Protocol):
+    """
+    reads byte ranges of an artifact of size bytes, bytes_read counts the bytes
+    fetched so far
+    """
+
+    size: int
+    bytes_read: int
+
+    def read(self, offset: int, length: int) -> bytes: ...
+
+    def read_array(self, offset: int, dtype: str, count: int) -> np.ndarray: ...
+
+
+class BufferRangeReader:
+    """
+    reads of an artifact held in memory
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self.size = len(buffer)
+        self.bytes_read = 0
+
+    def read(self, offset: int, length: int) -> bytes:
+        self.bytes_read += length
+        return bytes(self._buffer[offset : offset + length])
+
+    def read_array(self, offset: int, dtype: str, count: int) -> np.ndarray:
+        self.bytes_read += count * np.dtype(dtype).itemsize
+        return np.frombuffer(self._buffer, dtype=dtype, count=count, offset=offset)
+
+
+class LocalRangeReader:
+    """
+    seek based reads of a local artifact, arrays are memory mapped
+
+    the file is closed by close(), at the end of a with block or when the reader
+    is garbage collected, arrays already read keep their memory map
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        # keep the file open, a file saved again in the meantime is a new file
+        # and reads keep returning the content of the artifact being loaded
+        self._file = open(self.path, "rb")
+        self._lock = threading.Lock()
+        self._mapped: mmap.mmap | None = None
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.bytes_read = 0
+
+    def __enter__(self) -> "LocalRangeReader":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if hasattr(self, "_file"):
+            self.close()
+
+    def close(self) -> None:
+        # the memory map is not closed, arrays returned by read_array refer to it
+        # and it is released with the last of them
+        with self._lock:
+            self._mapped = None
+            self._file.close()
+
+    def read(self, offset: int, length: int) -> bytes:
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        self.bytes_read += len(data)
+        return data
+
+    def read_array(self, offset: int, dtype: str, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        self.bytes_read += count * np.dtype(dtype).itemsize
+        with self._lock:
+            # one memory map of the whole file is shared by the arrays read
+            if self._mapped is None:
+                self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            mapped = self._mapped
+        return np.frombuffer(mapped, dtype=dtype, count=count, offset=offset)
+
+
+class GCSRangeReader:
+    """
+    ranged downloads of one generation of an artifact blob
+    """
+
+    def __init__(self, blob):
+        # blob from bucket.get_blob, downloads are pinned to its generation
+        self.blob = blob
+        self.size = blob.size
+        self.bytes_read = 0
+
+    def read(self, offset: int, length: int) -> bytes:
+        if length == 0:
+            return b""
+        try:
+            data = self.blob.download_as_bytes(start=offset, end=offset + length - 1)
+        except NotFound as e:
+            # the generation is gone once the blob is written again
+            raise ArtifactChangedError(f"{self.blob.name} was replaced") from e
+        self.bytes_read += len(data)
+        return data
+
+    def read_array(self, offset: int, dtype: str, count: int) -> np.ndarray:
+        data = self.read(offset, count * np.dtype(dtype).itemsize)
+        return np.frombuffer(data, dtype=dtype, count=count)
+
+
+class S3RangeReader:
+    """
+    ranged downloads of one version of an artifact object in an S3 compatible store
+    """
+
+    def __init__(self, client, bucket_name: str, key: str, size: int, etag: str):
+        # downloads only match the object with etag, as returned by head_object
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.bytes_read = 0
+
+    def read(self, offset: int, length: int) -> bytes:
+        if length == 0:
+            return b""
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                Range=f"bytes={offset}-{offset + length - 1}",
+                IfMatch=self.etag,
+            )
+        except self.client.exceptions.ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("PreconditionFailed", "NoSuchKey"):
+                raise ArtifactChangedError(f"{self.key} was replaced") from e
+            raise
+        data = response["Body"].read()
+        self.bytes_read += len(data)
+        return data
+
+    def read_array(self, offset: int, dtype: str, count: int) -> np.ndarray:
+        data = self.read(offset, count * np.dtype(dtype).itemsize)
+        return np.frombuffer(data, dtype=dtype, count=count)
+
+
+def read_artifact_header(
+    reader: RangeReader, header_size: int = ARTIFACT_HEADER_READ_SIZE
+) -> dict:
+    """
+    Read the header of an artifact, with the metadata, count and sections
+    """
+    head = reader.read(0, header_size)
+    header_len = _header_length(head)
+    if _PREAMBLE.size + header_len > len(head):
+        head += reader.read(len(head), _PREAMBLE.size + header_len - len(head))
+    return json.loads(head[_PREAMBLE.size : _PREAMBLE.size + header_len])
+
+
+def read_artifact(
+    reader: RangeReader,
+    header_size: int = ARTIFACT_HEADER_READ_SIZE,
+    load_dictionary=None,
+) -> tuple[RangeReadChunkTexts, np.ndarray, np.ndarray | None, np.ndarray | None, dict]:
+    """
+    Read the header and the embeddings of an artifact, the texts are read
+    when they are accessed
+
+    Args:
+        load_dictionary: callable returning the zstd dictionary of an id, for
+                         artifacts compressed with a dictionary
+
+    Returns:
+        tuple: texts, embeddings, int8 scales or None, norms of normalized
+               embeddings or None, metadata
+    """
+    header = read_artifact_header(reader, header_size)
+    sections = header["sections"]
+
+    def column(name: str, dtype: str) -> np.ndarray:
+        offset, length = sections[name]
+        return reader.read_array(offset, dtype, length // np.dtype(dtype).itemsize)
+
+    embeddings = column("embeddings", header["dtype"]).reshape(header["shape"])
+    scales = column("scales", "<f4") if "scales" in sections else None
+    norms = column("norms", "<f8") if "norms" in sections else None
+    offsets = np.array(column("offsets", "<u8"))
+    if "compression" in header:
+        codec = TextBlockCodec.from_header(header["compression"], load_dictionary)
+        blocks = np.array(column("blocks", "<u8"))
+        texts = CompressedChunkTexts(reader, sections["texts"][0], offsets, codec, blocks)
+    else:
+        texts = RangeReadChunkTexts(reader, sections["texts"][0], offsets)
+    return texts, embeddings, scales, norms, header["metadata"]
@@ -0,0 +1,198 @@
+import os
+import threading
+from collections import OrderedDict
+
+from . import TextChunksWithEmbedding, _blob_path
+from .artifact import ChunkTexts
+
+# memory budget of the loaded chunks kept in a process
+ARTIFACT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ArtifactCache:
+    """
+    Loaded chunks keyed by storage prefix and blob path, least recently used
+    chunks are evicted when their total size exceeds max_bytes.
+
+    A request for one filing loads the chunks of the filing to check they exist,
+    again to extract from them, and the query vectors of the extraction. All of
+    these are served from here after the first load.
+
+    Entries keep reading their texts on demand, so extraction only reads the
+    texts it selects. Those reads are pinned to the version of the artifact the
+    chunks were loaded from. When another process saves the filing again they
+    raise ArtifactChangedError, and the caller loads the chunks again with
+    load_chunks(..., reload=True).
+    Their unit vectors are made here and keyword indexes built on cached
+    chunks are counted on the next put, so the budget bounds the memory they
+    use.
+    """
+
+    def __init__(self, max_bytes: int = ARTIFACT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # chunks, their size and whether their keyword index is counted in it
+        self._entries: OrderedDict[
+            tuple[str, str], tuple[TextChunksWithEmbedding, int, bool]
+        ] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple[str, str]) -> TextChunksWithEmbedding | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple[str, str], chunks: TextChunksWithEmbedding) -> None:
+        keyword_index = chunks._keyword_index
+        size = _chunks_size(chunks) + (keyword_index.nbytes if keyword_index else 0)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (chunks, size, keyword_index is not None)
+            self._bytes += size
+            self._count_keyword_indexes()
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key: tuple[str, str]) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _count_keyword_indexes(self) -> None:
+        # add the keyword indexes built on cached chunks since they were added
+        for key, (chunks, size, counted) in list(self._entries.items()):
+            if not counted and chunks._keyword_index is not None:
+                index_size = chunks._keyword_index.nbytes
+                self._entries[key] = (chunks, size + index_size, True)
+                self._bytes += index_size
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._count_keyword_indexes()
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate(),
+                "evictions": self.evictions,
+            }
+
+
+_artifact_cache = None
+_artifact_cache_lock = threading.Lock()
+
+
+def artifact_cache() -> ArtifactCache | None:
+    """
+    return the cache of loaded chunks shared in this process, ARTIFACT_CACHE_MB
+    sets its memory budget and 0 disables it
+    """
+    global _artifact_cache
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            max_mb = os.environ.get("ARTIFACT_CACHE_MB", "")
+            max_bytes = int(max_mb) * 1024 * 1024 if max_mb else ARTIFACT_CACHE_MAX_BYTES
+            if max_bytes <= 0:
+                return None
+            _artifact_cache = ArtifactCache(max_bytes)
+
+        return _artifact_cache
+
+
+def load_chunks(
+    cik: str,
+    accession_number: str,
+    model: str,
+    dimension: int,
+    chunk_algo_version: str,
+    storage_base_path=os.environ.get("STORAGE_PREFIX", ""),
+    reload: bool = False,
+) -> TextChunksWithEmbedding:
+    """
+    TextChunksWithEmbedding.load through the artifact cache, the chunks returned
+    are shared and must not be modified
+
+    With reload=True the cached chunks are dropped and loaded again, e.g. after
+    reading their texts raised ArtifactChangedError.
+    """
+    key = (
+        storage_base_path,
+        _blob_path(
+            cik=cik,
+            accession_number=accession_number,
+            model=model,
+            dimension=dimension,
+            chunk_algo_version=chunk_algo_version,
+        ),
+    )
+    cache = artifact_cache()
+    if cache and reload:
+        cache.pop(key)
+    chunks = cache.get(key) if cache else None
+    if chunks is None:
+        chunks = TextChunksWithEmbedding.load(
+            cik=cik,
+            accession_number=accession_number,
+            model=model,
+            dimension=dimension,
+            chunk_algo_version=chunk_algo_version,
+            storage_base_path=storage_base_path,
+        )
+        if cache:
+            cache.put(key, chunks)
+    return chunks
+
+
+def cache_chunks(
+    chunks: TextChunksWithEmbedding,
+    storage_base_path=os.environ.get("STORAGE_PREFIX", ""),
+) -> None:
+    """
+    add chunks that were just saved to the artifact cache
+    """
+    cache = artifact_cache()
+    if cache:
+        cache.put((storage_base_path, _blob_path(**chunks.metadata)), chunks)
+
+
+def _chunks_size(chunks: TextChunksWithEmbedding) -> int:
+    # memory used by the chunks once all their texts are read, the unit vectors
+    # extraction uses are made here so they are counted
+    size = chunks.embeddings.nbytes
+    unit_vectors = chunks.unit_vectors()
+    if unit_vectors is not chunks.embeddings:
+        size += unit_vectors.nbytes
+    if chunks.embedding_scales is not None:
+        size += chunks.embedding_scales.nbytes
+    if chunks.embedding_norms is not None:
+        size += chunks.embedding_norms.nbytes
+    if isinstance(chunks.texts, ChunkTexts):
+        size += chunks.texts.nbytes
+    else:
+        size += sum(len(text) for text in chunks.texts)
+    return size
@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Protocol, TypedDict
+
+from ..helper import tiktoken_encoding
+from . import TextChunksWithEmbedding
+from .embedding import _call_embedding_api, _plan_batches, _truncate_chunk, request_limits
+
+logger = logging.getLogger(__name__)
+
+BATCH_JOB_POLL_INTERVAL = 60
+BATCH_JOB_TIMEOUT = 24 * 3600
+# limits of an OpenAI batch input file, larger jobs are split into parts
+BATCH_JOB_MAX_REQUESTS = 50_000
+BATCH_JOB_MAX_BYTES = 200 * 1024 * 1024
+
+
+class BatchJobBackend(Protocol):
+    """
+    a provider interface that runs the embedding requests in a JSONL job file
+    asynchronously
+    """
+
+    def submit(self, job_path: str) -> str: ...
+
+    def status(self, job_id: str) -> str: ...
+
+    def results(self, job_id: str) -> dict[str, list[list[float]]]: ...
+
+
+class LocalBatchBackend:
+    """
+    Stand-in for a provider batch interface that runs the job in this process.
+
+    Jobs are kept under work_dir. The requests are embedded on the first status
+    poll after submission, with the same embedding call used by batch_embedding,
+    so local/ models can run a whole job offline.
+    """
+
+    def __init__(self, work_dir: str):
+        self.work_dir = Path(work_dir)
+
+    def submit(self, job_path: str) -> str:
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        job_dir = self.work_dir / job_id
+        os.makedirs(job_dir, exist_ok=True)
+        (job_dir / "input.jsonl").write_bytes(Path(job_path).read_bytes())
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        job_dir = self.work_dir / job_id
+        if not (job_dir / "input.jsonl").exists():
+            raise ValueError(f"Unknown batch job {job_id}")
+
+        if not (job_dir / "output.jsonl").exists():
+            self._run(job_dir)
+        return "completed"
+
+    def results(self, job_id: str) -> dict[str, list[list[float]]]:
+        output_path = self.work_dir / job_id / "output.jsonl"
+        with open(output_path, "r") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        return {line["custom_id"]: line["embeddings"] for line in lines}
+
+    def _run(self, job_dir: Path) -> None:
+        with open(job_dir / "input.jsonl", "r") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+
+        with open(job_dir / "output.jsonl", "w") as f:
+            for request in requests:
+                body = request["body"]
+                embeddings = _call_embedding_api(
+                    content=body["input"],
+                    model=body["model"],
+                    task_type="RETRIEVAL_DOCUMENT",
+                    dimension=body["dimensions"],
+                )
+                output = {"custom_id": request["custom_id"], "embeddings": embeddings}
+                f.write(json.dumps(output) + "\n")
+
+
+class OpenAIBatchBackend:
+    """
+    OpenAI Batch API, jobs complete within 24 hours at a lower price than
+    synchronous requests and do not count against the per-minute rate limits
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            from openai import OpenAI
+
+            client = OpenAI()
+        self.client = client
+
+    def submit(self, job_path: str) -> str:
+        with open(job_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/embeddings",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> str:
+        status = self.client.batches.retrieve(job_id).status
+        if status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "completed" if status == "completed" else "in_progress"
+
+    def results(self, job_id: str) -> dict[str, list[list[float]]]:
+        """
+        return the embeddings of each request, requests that failed are in the
+        error file of the batch, or in its output file with an error status
+        """
+        batch = self.client.batches.retrieve(job_id)
+        results, errors = {}, {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                output = json.loads(line)
+                response = output.get("response") or {}
+                if output.get("error") or response.get("status_code") != 200:
+                    body = response.get("body") or {}
+                    errors[output["custom_id"]] = output.get("error") or body.get("error")
+                    continue
+                data = response["body"]["data"]
+                results[output["custom_id"]] = [
+                    item["embedding"] for item in sorted(data, key=lambda d: d["index"])
+                ]
+
+        if errors:
+            custom_id, error = next(iter(errors.items()))
+            raise RuntimeError(
+                f"{len(errors)} requests of batch job {job_id} failed:"
+                f" {', '.join(sorted(errors))}, e.g. {custom_id}: {error}"
+            )
+        return results
+
+
+class EmbeddingJobPart(TypedDict):
+    # JSONL file of the part and the filing and chunk numbers of each request in
+    # it, keyed by its custom_id
+    path: str
+    requests: dict[str, tuple[int, list[int]]]
+
+
+def write_embedding_job(
+    filings: list[TextChunksWithEmbedding],
+    model: str,
+    dimension: int,
+    job_path: str,
+    max_requests: int = BATCH_JOB_MAX_REQUESTS,
+    max_bytes: int = BATCH_JOB_MAX_BYTES,
+) -> list[EmbeddingJobPart]:
+    """
+    Write the chunks of all filings into JSONL job files, one embedding request
+    per line, packed within the request limits of the model
+
+    A job file holds at most max_requests requests and max_bytes bytes, the
+    limits of an OpenAI batch input file, further requests go to the next part.
+    Part n is written next to job_path, e.g. job.0.jsonl for job.jsonl.
+
+    Returns:
+        list[EmbeddingJobPart]: the path and requests of each part
+    """
+    base_path = Path(job_path)
+    os.makedirs(base_path.parent, exist_ok=True)
+    parts: list[EmbeddingJobPart] = []
+    part_bytes = 0
+    f = None
+    try:
+        for custom_id, n, batch, line in _embedding_requests(filings, model, dimension):
+            if (
+                f is None
+                or len(parts[-1]["requests"]) >= max_requests
+                or part_bytes + len(line) > max_bytes
+            ):
+                if f is not None:
+                    f.close()
+                path = base_path.with_name(
+                    f"{base_path.stem}.{len(parts)}{base_path.suffix}"
+                )
+                parts.append({"path": str(path), "requests": {}})
+                f, part_bytes = open(path, "wb"), 0
+            f.write(line)
+            part_bytes += len(line)
+            parts[-1]["requests"][custom_id] = (n, batch)
+    finally:
+        if f is not None:
+            f.close()
+
+    n_requests = sum(len(part["requests"]) for part in parts)
+    logger.debug(
+        f"wrote {n_requests} requests of {len(filings)} filings to {len(parts)} job files"
+    )
+    return parts
+
+
+def _embedding_requests(
+    filings: list[TextChunksWithEmbedding], model: str, dimension: int
+):
+    # yield the custom_id, filing number, chunk numbers and JSONL line of each
+    # embedding request of the filings
+    max_tokens, max_chunks = request_limits(model)
+    encoding = tiktoken_encoding()
+    model_name = model.split("/", 1)[1] if model.startswith("openai/") else model
+
+    n_requests = 0
+    for n, filing in enumerate(filings):
+        texts, token_counts = [], []
+        counts = filing.metadata.get("token_counts")
+        if counts is None or len(counts) != len(filing.texts):
+            counts = [len(t) for t in encoding.encode_ordinary_batch(filing.texts)]
+        for text, text_tokens in zip(filing.texts, counts):
+            if text_tokens > max_tokens:
+                text, text_tokens = _truncate_chunk(text, encoding, max_tokens)
+            texts.append(text)
+            token_counts.append(text_tokens)
+
+        for batch in _plan_batches(token_counts, max_tokens, max_chunks):
+            custom_id = f"{n}-{n_requests}"
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/embeddings",
+                "body": {
+                    "model": model_name,
+                    "input": [texts[i] for i in batch],
+                    "dimensions": dimension,
+                },
+            }
+            yield custom_id, n, batch, (json.dumps(request) + "\n").encode("utf-8")
+            n_requests += 1
+
+
+def run_embedding_job(
+    filings: list[TextChunksWithEmbedding],
+    model: str,
+    dimension: int,
+    backend: BatchJobBackend,
+    job_path: str,
+    poll_interval: float = BATCH_JOB_POLL_INTERVAL,
+    timeout: float = BATCH_JOB_TIMEOUT,
+) -> list[TextChunksWithEmbedding]:
+    """
+    Embed the chunks of many filings with asynchronous batch jobs
+
+    The chunks are written to JSONL job files, split at the batch input file
+    limits, each part is submitted to the backend as a job of its own and the
+    jobs are polled until they all complete. The embeddings are then put back
+    into the filings, which are ready to be saved.
+
+    Args:
+        filings (list[TextChunksWithEmbedding]): chunked filings to embed
+        backend (BatchJobBackend): LocalBatchBackend or OpenAIBatchBackend
+        job_path (str): where to write the job files, see write_embedding_job
+
+    Returns:
+        list[TextChunksWithEmbedding]: the same filings, with embeddings
+    """
+    parts = write_embedding_job(filings, model, dimension, job_path)
+    # job id of each part to its requests
+    pending = {}
+    for part in parts:
+        job_id = backend.submit(part["path"])
+        logger.info(
+            f"submitted batch job {job_id} with {len(part['requests'])} requests"
+            f" from {part['path']}"
+        )
+        pending[job_id] = part["requests"]
+
+    embeddings: list[list[list[float]]] = [[[] for _ in f.texts] for f in filings]
+    start_t = time.monotonic()
+    while pending:
+        for job_id in list(pending):
+            status = backend.status(job_id)
+            if status == "failed":
+                raise RuntimeError(f"batch job {job_id} failed")
+            if status == "completed":
+                requests = pending.pop(job_id)
+                _collect_results(job_id, backend.results(job_id), requests, embeddings)
+        if not pending:
+            break
+        if time.monotonic() - start_t > timeout:
+            raise TimeoutError(
+                f"batch jobs {', '.join(pending)} did not complete in {timeout}s"
+            )
+        time.sleep(poll_interval)
+
+    for filing, filing_embeddings in zip(filings, embeddings):
+        filing.set_embeddings(filing_embeddings)
+        filing.metadata["model"] = model
+        filing.metadata["dimension"] = dimension
+
+    return filings
+
+
+def _collect_results(
+    job_id: str,
+    results: dict[str, list[list[float]]],
+    requests: dict[str, tuple[int, list[int]]],
+    embeddings: list[list[list[float]]],
+) -> None:
+    # put the embeddings returned by a job at the chunks of its requests
+    for custom_id, (n, batch) in requests.items():
+        if custom_id not in results:
+            raise RuntimeError(f"batch job {job_id} has no result for {custom_id}")
+        for i, vector in zip(batch, results[custom_id]):
+            embeddings[n][i] = vector
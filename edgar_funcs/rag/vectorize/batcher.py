@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ..helper import tiktoken_encoding
+from .embedding import EMBEDDING_CONCURRENCY, batch_embedding, request_limits
+
+logger = logging.getLogger(__name__)
+
+# default time a submission waits for others to share its requests
+EMBEDDING_BATCH_MAX_WAIT = 0.05
+
+
+class _Submission:
+    def __init__(self, chunks: list[str], token_counts: list[int], future: Future):
+        self.chunks = chunks
+        self.token_counts = token_counts
+        self.future = future
+        self.submitted_at = time.monotonic()
+
+
+class EmbeddingBatcher:
+    """
+    Coalesce embedding requests from concurrent callers in one process.
+
+    Callers submit the chunks of a filing and get a future for their embeddings.
+    Submissions for the same model, dimension and task type are held for up to
+    max_wait seconds, or until they fill up a request, then embedded together
+    with batch_embedding, so that several small filings share full requests
+    instead of each sending its own partly filled ones.
+    """
+
+    def __init__(self, max_wait: float = EMBEDDING_BATCH_MAX_WAIT):
+        self.max_wait = max_wait
+        self.submissions = 0
+        self.flushes = 0
+        self._pending: dict[tuple[str, int, str], list[_Submission]] = {}
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(EMBEDDING_CONCURRENCY, 1))
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        chunks: list[str],
+        model: str,
+        dimension: int,
+        task_type: str = "RETRIEVAL_DOCUMENT",
+        token_counts: list[int] | None = None,
+    ) -> Future:
+        """
+        queue chunks for embedding
+
+        Returns:
+            Future: resolves to the embeddings of the chunks, in the same order
+        """
+        if token_counts is None or len(token_counts) != len(chunks):
+            tokens = tiktoken_encoding().encode_ordinary_batch(chunks)
+            token_counts = [len(chunk_tokens) for chunk_tokens in tokens]
+
+        future: Future = Future()
+        if not chunks:
+            future.set_result([])
+            return future
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("cannot submit to a closed EmbeddingBatcher")
+            key = (model, dimension, task_type)
+            self._pending.setdefault(key, []).append(
+                _Submission(chunks, token_counts, future)
+            )
+            self.submissions += 1
+            self._condition.notify()
+
+        return future
+
+    def stats(self) -> dict:
+        return {
+            "submissions": self.submissions,
+            "flushes": self.flushes,
+            "submissions_per_flush": self.submissions / self.flushes
+            if self.flushes
+            else 0.0,
+        }
+
+    def close(self) -> None:
+        """
+        embed the pending submissions and stop the batcher
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                ready, timeout = self._ready_submissions()
+                if not ready:
+                    if self._closed and not self._pending:
+                        return
+                    self._condition.wait(timeout)
+                    continue
+
+            for key, submissions in ready:
+                self.flushes += 1
+                self._executor.submit(self._flush, key, submissions)
+
+    def _ready_submissions(self):
+        # return the submissions to embed now, and how long to wait for the next ones
+        ready = []
+        timeout = None
+        now = time.monotonic()
+        for key, submissions in list(self._pending.items()):
+            max_tokens, max_chunks = request_limits(key[0])
+            n_tokens = sum(sum(s.token_counts) for s in submissions)
+            n_chunks = sum(len(s.chunks) for s in submissions)
+            waited = now - submissions[0].submitted_at
+            if (
+                self._closed
+                or waited >= self.max_wait
+                or n_tokens >= max_tokens
+                or n_chunks >= max_chunks
+            ):
+                ready.append((key, self._pending.pop(key)))
+            else:
+                remaining = self.max_wait - waited
+                timeout = remaining if timeout is None else min(timeout, remaining)
+        return ready, timeout
+
+    def _flush(self, key: tuple[str, int, str], submissions: list[_Submission]):
+        model, dimension, task_type = key
+        chunks = [chunk for s in submissions for chunk in s.chunks]
+        token_counts = [count for s in submissions for count in s.token_counts]
+        logger.debug(
+            f"embedding {len(chunks)} chunks from {len(submissions)} submissions with {model}"  # noqa E501
+        )
+        try:
+            embeddings = batch_embedding(
+                chunks,
+                model=model,
+                dimension=dimension,
+                task_type=task_type,
+                token_counts=token_counts,
+            )
+        except Exception as e:
+            for s in submissions:
+                s.future.set_exception(e)
+            return
+
+        start = 0
+        for s in submissions:
+            s.future.set_result(embeddings[start : start + len(s.chunks)])
+            start += len(s.chunks)
+
+
+_embedding_batcher: EmbeddingBatcher | None = None
+_embedding_batcher_lock = threading.Lock()
+
+
+def embedding_batcher() -> EmbeddingBatcher | None:
+    """
+    return the embedding batcher shared by all filings embedded in this process,
+    or None when EMBEDDING_BATCH_WAIT_MS is not set
+    """
+    global _embedding_batcher
+    wait_ms = os.environ.get("EMBEDDING_BATCH_WAIT_MS", "")
+    if not wait_ms:
+        return None
+
+    with _embedding_batcher_lock:
+        if _embedding_batcher is None:
+            _embedding_batcher = EmbeddingBatcher(max_wait=int(wait_ms) / 1000)
+    return _embedding_batcher
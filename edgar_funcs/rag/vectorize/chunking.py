@@ -1,50 +1,309 @@
+import atexit
+import hashlib
+import json
 import logging
+import os
 import re
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable
 
 import html2text
 import spacy
 from bs4 import BeautifulSoup
 
+from ..helper import tiktoken_encoding
+from .sections import build_section_index
+
 logger = logging.getLogger(__name__)
 
 # IMPORTANT:
 # updaet the version if chunk size or chunking details are updated!
 #
-# the chunked text and their embeddings are store in pickle file for faster load
+# the chunked text and their embeddings are stored in artifact files for faster load
 # update the chunking detail without version update can have unpredictable results
-# when older and potentially obselete pickle files are loaded
+# when older and potentially obselete artifact files are loaded
 CHUNK_ALORITHM_VERSION = "4"
+# version of the chunks produced by the structure aware "section" method
+SECTION_CHUNK_ALGORITHM_VERSION = "s1"
+
+CHUNK_ALGORITHM_VERSIONS = {
+    "spacy": CHUNK_ALORITHM_VERSION,
+    "section": SECTION_CHUNK_ALGORITHM_VERSION,
+}
+# versions of the chunks of each method sized in tokens instead of characters
+TOKEN_CHUNK_ALGORITHM_VERSIONS = {
+    "spacy": "4t",
+    "section": "s1t",
+}
+
+
+def chunking_method(chunk_algo_version: str) -> tuple[str, str]:
+    """
+    return the chunking method and size unit that produce chunks of
+    chunk_algo_version
+    """
+    for size_unit, versions in (
+        ("char", CHUNK_ALGORITHM_VERSIONS),
+        ("token", TOKEN_CHUNK_ALGORITHM_VERSIONS),
+    ):
+        for method, version in versions.items():
+            if version == chunk_algo_version:
+                return method, size_unit
+    # older versions are all produced by spacy
+    return "spacy", "char"
+
+
+def chunk_algorithm_versions() -> list[str]:
+    """
+    return the chunk versions that can be produced, e.g. for command line choices
+    """
+    return [
+        *CHUNK_ALGORITHM_VERSIONS.values(),
+        *TOKEN_CHUNK_ALGORITHM_VERSIONS.values(),
+    ]
+
 
 DEFAULT_TEXT_CHUNK_SIZE = 1000
+# chunk size used when chunks are sized in tokens instead of characters
+DEFAULT_TOKEN_CHUNK_SIZE = 250
+# max size of chunks produced by the "section" method, a section smaller than
+# this is kept in one chunk
+DEFAULT_SECTION_CHUNK_SIZE = 3000
+DEFAULT_SECTION_TOKEN_CHUNK_SIZE = 750
+
+# bold lines longer than this are not considered headings
+MAX_HEADING_LENGTH = 120
+# bold lines that are navigation links instead of headings
+_NAVIGATION_REGEX = re.compile(r"^(back to )?table of contents$", re.IGNORECASE)
 
 # version 3 uses chunk size of 3500
+#
+# chunks sized in tokens are different from chunks sized in characters, they are
+# stored under the versions in TOKEN_CHUNK_ALGORITHM_VERSIONS
+
+# max number of lines whose sentence boundaries are kept in memory
+SENTENCE_CACHE_SIZE = 100000
+
+
+class SentenceCache:
+    """
+    Bounded LRU cache of sentence boundaries, keyed by the hash of a line of text.
+
+    Fund families reuse the same paragraphs across many filings, so the boundaries
+    found by spaCy for a line are kept and reused the next time the line is seen.
+    The cache can be saved to and loaded from a json file, entries computed by a
+    different spaCy model are discarded when loading.
+    """
+
+    def __init__(self, maxsize: int = SENTENCE_CACHE_SIZE, model: str = ""):
+        self.maxsize = maxsize
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, list[tuple[int, int]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def split(self, line: str, nlp) -> list[str]:
+        """
+        return the sentences in line, only run nlp on lines not seen before
+        """
+        key = hashlib.blake2b(line.encode("utf-8"), digest_size=16).hexdigest()
+        bounds = self._entries.get(key)
+        if bounds is None:
+            self.misses += 1
+            bounds = [(sent.start_char, sent.end_char) for sent in nlp(line).sents]
+            self._entries[key] = bounds
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+        return [line[start:end] for start, end in bounds]
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
+
+    def save(self, path: str) -> None:
+        # write to a temporary file and replace the cache with it, so a process
+        # killed while saving does not leave a truncated cache behind
+        output_path = Path(path)
+        os.makedirs(output_path.parent, exist_ok=True)
+        tmp_path = output_path.with_name(f"{output_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"model": self.model, "entries": self._entries}, f)
+            os.replace(tmp_path, output_path)
+        finally:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+        logger.debug(f"saved {len(self._entries)} sentence cache entries to {path}")
+
+    def load(self, path: str) -> None:
+        if not Path(path).exists():
+            return
+
+        try:
+            with open(path, "r") as f:
+                content = json.load(f)
+            if content.get("model") != self.model:
+                logger.info(f"ignore sentence cache {path} created by another model")
+                return
+            entries = {
+                key: [(start, end) for start, end in bounds]
+                for key, bounds in content.get("entries", {}).items()
+            }
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"ignore unreadable sentence cache {path}: {e}")
+            return
+
+        self._entries.update(entries)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        logger.debug(f"loaded {len(self._entries)} sentence cache entries from {path}")
+
+
+_sentence_cache: SentenceCache | None = None
+
+
+@lru_cache(maxsize=1)
+def load_nlp():
+    """
+    load the spaCy model once per process
+    """
+    nlp = spacy.load("en_core_web_sm")
+    logger.debug("chunk_text: loaded model")
+    return nlp
+
+
+def sentence_cache(nlp=None) -> SentenceCache:
+    """
+    return the sentence cache shared by all filings chunked in this process
+
+    when SENTENCE_CACHE_PATH is set, the cache is loaded from that file on first
+    use and saved back to it when the process exits
+    """
+    global _sentence_cache
+    if _sentence_cache is None:
+        model = ""
+        if nlp is not None:
+            model = f"{nlp.meta.get('name', '')}-{nlp.meta.get('version', '')}"
+        _sentence_cache = SentenceCache(model=model)
+
+        cache_path = os.environ.get("SENTENCE_CACHE_PATH", "")
+        if cache_path:
+            _sentence_cache.load(cache_path)
+            atexit.register(_sentence_cache.save, cache_path)
+
+    return _sentence_cache
 
 
 def chunk_text(
-    content: str, chunk_size: int = DEFAULT_TEXT_CHUNK_SIZE, method: str = "spacy"
+    content: str,
+    chunk_size: int | None = None,
+    method: str = "spacy",
+    size_unit: str = "char",
+    metadata: dict | None = None,
 ) -> list[str]:
+    """
+    Split text content into chunks
+
+    Args:
+        content (str): The text to split into chunks
+        chunk_size (int): The maximum size of each chunk, measured in size_unit
+        method (str): "spacy" packs sentences into chunks of similar size,
+                      "section" keeps document sections and tables together,
+                      it expects the headings marked by
+                      trim_html_content(..., mark_headings=True)
+        size_unit (str): "char" or "token", tokens are counted with the same
+                         tokenizer used when calling the embedding API
+        metadata (dict): if given, the token count of each chunk is recorded
+                         under "token_counts" so that it can be saved with the chunks.
+                         the "section" method also records the section path of
+                         each chunk under "section_paths". the headings and keywords
+                         found in the chunks are recorded under "section_index"
+
+    Returns:
+        list[str]: A list of text chunks
+    """
+    if size_unit == "char":
+        size_func = len
+    elif size_unit == "token":
+        size_func = count_tokens_in_text
+    else:
+        raise ValueError(f"Unknown size unit: {size_unit}")
+
     if method == "spacy":
-        return _chunk_text_by_spacy(content, chunk_size)
+        if not chunk_size:
+            chunk_size = (
+                DEFAULT_TEXT_CHUNK_SIZE
+                if size_unit == "char"
+                else DEFAULT_TOKEN_CHUNK_SIZE
+            )
+        chunks = _chunk_text_by_spacy(content, chunk_size, size_func)
+        section_paths = None
+    elif method == "section":
+        if not chunk_size:
+            chunk_size = DEFAULT_SECTION_CHUNK_SIZE
+            if size_unit == "token":
+                chunk_size = DEFAULT_SECTION_TOKEN_CHUNK_SIZE
+        chunks, section_paths = _chunk_text_by_section(content, chunk_size, size_func)
+        if metadata is not None:
+            metadata["section_paths"] = section_paths
     else:
         raise RuntimeError(f"Unknown method: {method}")
 
+    if metadata is not None:
+        metadata["token_counts"] = count_tokens(chunks)
+        metadata["section_index"] = build_section_index(chunks, section_paths)
+
+    return chunks
+
+
+def count_tokens(texts: list[str]) -> list[int]:
+    """
+    return the number of tokens in each text, using the shared tokenizer
+    """
+    if not texts:
+        return []
+    return [len(tokens) for tokens in tiktoken_encoding().encode_ordinary_batch(texts)]
+
+
+def count_tokens_in_text(text: str) -> int:
+    return len(tiktoken_encoding().encode_ordinary(text))
+
 
 # ruff: noqa: C901
-def _chunk_text_by_spacy(content: str, chunk_size: int) -> list[str]:
+def _chunk_text_by_spacy(
+    content: str, chunk_size: int, size_func: Callable[[str], int] = len
+) -> list[str]:
     """
     Split a text into chunks of size chunk_size
 
     Args:
         content (str): The text to split into chunks
         chunk_size (int): The size of each chunk
+        size_func (Callable): function that measures the size of a piece of text
 
     Returns:
         list[str]: A list of text chunks
     """
 
-    # Load SpaCy NLP model
-    nlp = spacy.load("en_core_web_sm")
-    logger.debug("chunk_text: loaded model")
+    nlp = load_nlp()
+    sentence_splitter = sentence_cache(nlp)
 
     chunks = []
     current_chunk = []
@@ -72,36 +331,55 @@ def _chunk_text_by_spacy(content: str, chunk_size: int) -> list[str]:
                 if table_buffer:
                     table_content = "\n".join(table_buffer)
                     current_size = _add_to_chunk(
-                        table_content, current_chunk, current_size, chunks, chunk_size
+                        table_content,
+                        current_chunk,
+                        current_size,
+                        chunks,
+                        chunk_size,
+                        size_func,
                     )
                     table_buffer = []  # Clear the buffer for the next table
 
                 # Process non-table lines
-                doc = nlp(line)
-                sentences = [sent.text for sent in doc.sents]
+                sentences = sentence_splitter.split(line, nlp)
                 for sentence in sentences:
                     current_size = _add_to_chunk(
-                        sentence, current_chunk, current_size, chunks, chunk_size
+                        sentence,
+                        current_chunk,
+                        current_size,
+                        chunks,
+                        chunk_size,
+                        size_func,
                     )
 
         # Flush any remaining table in the buffer
         if table_buffer:
             table_content = "\n".join(table_buffer)
             current_size = _add_to_chunk(
-                table_content, current_chunk, current_size, chunks, chunk_size
+                table_content,
+                current_chunk,
+                current_size,
+                chunks,
+                chunk_size,
+                size_func,
             )
 
     # Add any remaining content
     if current_chunk:
         chunks.append("\n\n".join(current_chunk))
 
+    logger.debug(f"chunk_text: sentence cache {sentence_splitter.stats()}")
+
     # Remove empty chunks
     return [chunk for chunk in chunks if chunk.strip() and len(chunk.strip()) > 100]
 
 
-def trim_html_content(content: str) -> str:
+def trim_html_content(content: str, mark_headings: bool = False) -> str:
     """
     remove the hidden div and convert the rest of html into text
+
+    when mark_headings is True, bold lines and html heading tags are converted
+    into markdown headings, the level of heading is determined by font size
     """
     if not content:
         return ""
@@ -114,6 +392,9 @@ def trim_html_content(content: str) -> str:
     if div_to_remove:
         div_to_remove.decompose()  # type: ignore
 
+    if mark_headings:
+        _mark_headings(soup)
+
     return _text2html(str(soup))
 
 
@@ -132,6 +413,7 @@ def _add_to_chunk(
     current_size: int,
     chunks: list[str],
     chunk_size: int,
+    size_func: Callable[[str], int] = len,
 ) -> int:
     """
     Add a piece of content to the current chunk or start a new one if the size exceeds
@@ -142,11 +424,12 @@ def _add_to_chunk(
         current_chunk (list[str]): The current chunk being built.
         current_size (int): The size of the current chunk.
         chunks (list[str]): The list of completed chunks.
+        size_func (Callable): function that measures the size of content_piece.
 
     Returns:
         int: The updated size of the current chunk.
     """
-    content_size = len(content_piece)
+    content_size = size_func(content_piece)
     if current_size + content_size > chunk_size:
         # Save current chunk and start a new one
         chunks.append("\n\n".join(current_chunk))
@@ -189,3 +472,326 @@ def _check_table_row(line: str) -> tuple[bool, bool]:
     )
 
     return True, is_cell_empty
+
+
+def _mark_headings(soup: BeautifulSoup) -> None:
+    """
+    replace the elements that look like headings with <h1>..<h4> tags
+
+    filings seldom use html heading tags, headings are usually a short line of
+    bold text. the larger the font size the higher the heading level,
+    for the same font size, all uppercase heading is higher.
+    """
+    heading_tags = ["h1", "h2", "h3", "h4", "h5", "h6"]
+    candidates = []
+    for element in soup.find_all(heading_tags + ["p", "div"]):
+        if element.find_parent("table") or element.find(["p", "div", "table"]):
+            continue
+
+        text = " ".join(element.get_text(" ", strip=True).split())
+        if len(text) < 3 or len(text) > MAX_HEADING_LENGTH:
+            continue
+        # skip footnotes, bullets and navigation links
+        if not text[0].isalnum() or _NAVIGATION_REGEX.match(text):
+            continue
+
+        if element.name in heading_tags:
+            candidates.append((element, text, int(element.name[1]), None))
+        elif _is_bold_text(element):
+            candidates.append((element, text, 0, (_font_size(element), text.isupper())))
+
+    # rank the distinct (font size, uppercase) of bold headings
+    ranks = sorted({key for _, _, _, key in candidates if key is not None}, reverse=True)
+    levels = {key: min(i + 1, 4) for i, key in enumerate(ranks)}
+
+    for element, text, level, key in candidates:
+        heading = soup.new_tag(f"h{level if key is None else levels[key]}")
+        heading.string = text
+        element.replace_with(heading)
+
+
+def _is_bold_text(element) -> bool:
+    # True if all text inside the element is bold
+    has_text = False
+    for string in element.find_all(string=True):
+        if not string.strip():
+            continue
+        has_text = True
+        parent = string.parent
+        while parent is not None:
+            if _is_bold_tag(parent):
+                break
+            if parent is element:
+                return False
+            parent = parent.parent
+        if parent is None:
+            return False
+    return has_text
+
+
+def _is_bold_tag(tag) -> bool:
+    if tag.name in ["b", "strong"]:
+        return True
+    style = str(tag.get("style", "")).replace(" ", "").lower()
+    return any(
+        f"font-weight:{weight}" in style for weight in ["bold", "700", "800", "900"]
+    )
+
+
+def _font_size(element) -> float:
+    # largest font size in points found in the style of the element or its children
+    sizes = []
+    for tag in [element] + element.find_all(True):
+        style = str(tag.get("style", "")).lower()
+        for value, unit in re.findall(r"font(?:-size)?:[^;]*?([\d.]+)\s*(pt|px)", style):
+            try:
+                size = float(value)
+            except ValueError:
+                continue
+            sizes.append(size * 0.75 if unit == "px" else size)
+    return round(max(sizes), 1) if sizes else 0.0
+
+
+def _chunk_text_by_section(
+    content: str, chunk_size: int, size_func: Callable[[str], int] = len
+) -> tuple[list[str], list[str]]:
+    """
+    Split a text into chunks aligned to the sections of the document
+
+    A section is kept in one chunk when it fits in chunk_size, larger sections are
+    split at paragraph, table row or sentence boundaries. A section smaller than
+    a quarter of chunk_size is merged with the sections that follow it.
+
+    Args:
+        content (str): The text to split into chunks, with markdown headings
+        chunk_size (int): The maximum size of each chunk
+        size_func (Callable): function that measures the size of a piece of text
+
+    Returns:
+        tuple[list[str], list[str]]: the text chunks and the section path of
+            each chunk, e.g. "MANAGEMENT OF THE FUND > Compensation"
+    """
+    min_size = chunk_size // 4
+    chunks: list[str] = []
+    section_paths: list[tuple[str, ...]] = []
+
+    current_chunk: list[str] = []
+    current_size = 0
+    current_path: tuple[str, ...] = ()
+    pending_headings: list[str] = []
+    pending_path: tuple[str, ...] = ()
+
+    def flush():
+        nonlocal current_size
+        if current_chunk:
+            chunks.append("\n\n".join(current_chunk))
+            section_paths.append(current_path)
+        current_chunk.clear()
+        current_size = 0
+
+    def add(piece: str, path: tuple[str, ...]):
+        nonlocal current_size, current_path
+        # count the separator that joins the piece to the chunk
+        piece_size = size_func("\n\n" + piece) if current_chunk else size_func(piece)
+        if current_chunk and current_size + piece_size > chunk_size:
+            flush()
+            piece_size = size_func(piece)
+
+        if current_chunk:
+            current_path = _common_path(current_path, path)
+        else:
+            current_path = path
+        current_chunk.append(piece)
+        current_size += piece_size
+
+    for path, kind, block in _section_blocks(content):
+        if kind == "heading":
+            # a new section starts, only keep adding to the current chunk
+            # when it is too small
+            if current_size >= min_size:
+                flush()
+            pending_headings.append(block)
+            pending_path = path
+            continue
+
+        # keep the headings together with the content that follows them, the
+        # content is split to leave room for them
+        limit = chunk_size
+        if pending_headings:
+            headings_size = size_func("\n\n".join(pending_headings + [""]))
+            if headings_size > chunk_size - min_size:
+                add("\n\n".join(pending_headings), pending_path)
+                pending_headings = []
+            else:
+                limit = chunk_size - headings_size
+
+        pieces = [block]
+        if size_func(block) > limit:
+            pieces = _split_block(kind, block, limit, size_func)
+
+        for piece in pieces:
+            if pending_headings:
+                piece = "\n\n".join(pending_headings + [piece])
+                pending_headings = []
+            add(piece, path)
+
+    # headings at the end of the text have no content after them, keep them
+    # with the last chunk when they fit, a chunk of headings alone is too short
+    if pending_headings:
+        headings = "\n\n".join(pending_headings)
+        if (
+            not current_chunk
+            and chunks
+            and size_func(chunks[-1] + "\n\n" + headings) <= chunk_size
+        ):
+            chunks[-1] += "\n\n" + headings
+            section_paths[-1] = _common_path(section_paths[-1], pending_path)
+        else:
+            add(headings, pending_path)
+    flush()
+
+    result = [
+        (chunk, " > ".join(path))
+        for chunk, path in zip(chunks, section_paths)
+        if chunk.strip() and len(chunk.strip()) > 100
+    ]
+    return [chunk for chunk, _ in result], [path for _, path in result]
+
+
+def _section_blocks(content: str):
+    """
+    yield (section_path, kind, text) for each heading, paragraph and table,
+    kind is one of "heading", "paragraph" and "table"
+    """
+    lines = content.split("\n")
+
+    path: list[tuple[int, str]] = []
+    text_buffer: list[str] = []
+    table_buffer: list[str] = []
+
+    def section_path() -> tuple[str, ...]:
+        return tuple(title for _, title in path)
+
+    def flush_text():
+        if text_buffer:
+            yield section_path(), "paragraph", "\n".join(text_buffer)
+            text_buffer.clear()
+
+    def flush_table():
+        if table_buffer:
+            yield section_path(), "table", "\n".join(table_buffer)
+            table_buffer.clear()
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            # blank line ends a paragraph, a table continues until a non-table line
+            yield from flush_text()
+            continue
+
+        heading = _markdown_heading(line)
+        if heading is not None:
+            yield from flush_text()
+            yield from flush_table()
+            level, title = heading
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, title))
+            yield section_path(), "heading", line
+            continue
+
+        is_table_row, is_empty_table_row = _check_table_row(line)
+        if is_table_row:
+            yield from flush_text()
+            if not is_empty_table_row:
+                table_buffer.append(line)
+        elif not _is_line_empty(line):
+            yield from flush_table()
+            text_buffer.append(line)
+
+    yield from flush_text()
+    yield from flush_table()
+
+
+def _markdown_heading(line: str) -> tuple[int, str] | None:
+    match = re.match(r"^(#{1,6})\s+(.+)$", line.strip())
+    # "#" is also used as footnote symbol, e.g. "# | footnote text"
+    if match and match.group(2)[0].isalnum():
+        return len(match.group(1)), match.group(2).strip()
+    return None
+
+
+def mark_text_headings(content: str) -> str:
+    """
+    convert the headings in a plain text filing into markdown headings
+
+    a short line in all uppercase is considered a heading, lines that already
+    begin with "#" are escaped so that they are not mistaken as headings
+    """
+    lines = []
+    for line in content.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            lines.append("\\" + stripped)
+        elif _is_plain_heading(stripped):
+            lines.append(f"# {stripped}")
+        else:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _is_plain_heading(line: str) -> bool:
+    # heading in a text filing, a short line in all uppercase
+    return (
+        4 <= len(line) <= 80
+        and line.isupper()
+        and sum(char.isalpha() for char in line) >= 4
+        and not line.endswith((".", ","))
+        and not _check_table_row(line)[0]
+    )
+
+
+def _split_block(
+    kind: str, block: str, chunk_size: int, size_func: Callable[[str], int]
+) -> list[str]:
+    # split a paragraph or table that is larger than chunk_size
+    if kind == "table":
+        rows = block.split("\n")
+        # repeat the table header in each piece
+        header_size = 2 if len(rows) > 2 and re.fullmatch(r"[-|:\s]+", rows[1]) else 1
+        header, units = rows[:header_size], rows[header_size:]
+        separator = "\n"
+    else:
+        nlp = load_nlp()
+        sentence_splitter = sentence_cache(nlp)
+        header = []
+        units = [
+            sentence
+            for line in block.split("\n")
+            for sentence in sentence_splitter.split(line, nlp)
+        ]
+        separator = " "
+
+    pieces = []
+    current: list[str] = []
+    current_size = size_func(separator.join(header))
+    for unit in units:
+        # count the separator that joins the unit to the piece
+        unit_size = size_func(separator + unit)
+        if current and current_size + unit_size > chunk_size:
+            pieces.append(separator.join(header + current))
+            current, current_size = [], size_func(separator.join(header))
+        current.append(unit)
+        current_size += unit_size
+    if current:
+        pieces.append(separator.join(header + current))
+    return pieces
+
+
+def _common_path(path1: tuple[str, ...], path2: tuple[str, ...]) -> tuple[str, ...]:
+    common = []
+    for part1, part2 in zip(path1, path2):
+        if part1 != part2:
+            break
+        common.append(part1)
+    return tuple(common)
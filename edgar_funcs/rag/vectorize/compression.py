@@ -0,0 +1,138 @@
+import hashlib
+import os
+
+import numpy as np
+
+# compression of the texts of chunk artifacts, enabled by CHUNK_COMPRESSION=zstd.
+# CHUNK_ZSTD_DICTIONARY selects a dictionary trained with
+# scripts/train_zstd_dictionary.py, which compresses the boilerplate shared by
+# filings much better than compressing each filing on its own
+CHUNK_COMPRESSION = os.environ.get("CHUNK_COMPRESSION", "")
+CHUNK_ZSTD_DICTIONARY = os.environ.get("CHUNK_ZSTD_DICTIONARY", "")
+ZSTD_LEVEL = 9
+ZSTD_DICTIONARY_SIZE = 112 * 1024
+# chunks compressed together, a block is the unit read and decompressed when only
+# some of the texts are needed
+TEXT_BLOCK_CHUNKS = 16
+# where dictionaries are saved under the storage prefix
+ZSTD_DICTIONARY_PATH = "dictionaries/zstd"
+
+# dictionaries used in this process, by id
+_dictionaries: dict[str, bytes] = {}
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstd compressed chunks require zstandard, "
+            "install it with pip install edgar-funcs[zstd]"
+        ) from e
+    return zstandard
+
+
+def train_dictionary(texts: list[str], size: int = ZSTD_DICTIONARY_SIZE) -> bytes:
+    """
+    train a zstd dictionary on chunk texts from a sample of filings
+    """
+    samples = [text.encode("utf-8") for text in texts if text]
+    return _zstd().train_dictionary(size, samples, level=ZSTD_LEVEL).as_bytes()
+
+
+def dictionary_id(dictionary: bytes) -> str:
+    return hashlib.sha256(dictionary).hexdigest()[:16]
+
+
+def register_dictionary(dictionary: bytes) -> str:
+    """
+    make a dictionary available to the artifacts loaded in this process
+    """
+    dict_id = dictionary_id(dictionary)
+    _dictionaries[dict_id] = dictionary
+    return dict_id
+
+
+def registered_dictionary(dict_id: str) -> bytes | None:
+    return _dictionaries.get(dict_id)
+
+
+class TextBlockCodec:
+    """
+    zstd compression of the texts of an artifact in blocks of block_chunks chunks,
+    each block is a zstd frame that is decompressed on its own
+    """
+
+    def __init__(
+        self,
+        dictionary: bytes | None = None,
+        level: int = ZSTD_LEVEL,
+        block_chunks: int = TEXT_BLOCK_CHUNKS,
+    ):
+        zstd = _zstd()
+        # artifacts compressed with the dictionary can be read in this process
+        self.dictionary_id = register_dictionary(dictionary) if dictionary else None
+        self.block_chunks = block_chunks
+        dict_data = zstd.ZstdCompressionDict(dictionary) if dictionary else None
+        self._compressor = zstd.ZstdCompressor(level=level, dict_data=dict_data)
+        self._decompressor = zstd.ZstdDecompressor(dict_data=dict_data)
+
+    @classmethod
+    def from_header(cls, compression: dict, load_dictionary) -> "TextBlockCodec":
+        """
+        return the codec described in the header of an artifact
+
+        Args:
+            load_dictionary: callable returning the dictionary of an id, or None
+        """
+        if compression["codec"] != "zstd":
+            raise ValueError(f"Unsupported compression {compression['codec']}")
+
+        dictionary = None
+        dict_id = compression.get("dictionary")
+        if dict_id:
+            dictionary = registered_dictionary(dict_id)
+            if dictionary is None and load_dictionary:
+                dictionary = load_dictionary(dict_id)
+            if dictionary is None:
+                raise ValueError(f"zstd dictionary {dict_id} not found")
+        return cls(dictionary, block_chunks=compression["block_chunks"])
+
+    def header(self) -> dict:
+        return {
+            "codec": "zstd",
+            "dictionary": self.dictionary_id,
+            "block_chunks": self.block_chunks,
+        }
+
+    def compress(self, encoded: list[bytes]) -> tuple[bytes, np.ndarray]:
+        """
+        Returns:
+            tuple[bytes, np.ndarray]: the compressed blocks and the offsets of the
+                                      blocks in them, one more than the blocks
+        """
+        blocks = [
+            self._compressor.compress(b"".join(encoded[i : i + self.block_chunks]))
+            for i in range(0, len(encoded), self.block_chunks)
+        ]
+        offsets = np.zeros(len(blocks) + 1, dtype="<u8")
+        np.cumsum([len(block) for block in blocks], out=offsets[1:])
+        return b"".join(blocks), offsets
+
+    def decompress(self, block: bytes) -> bytes:
+        return self._decompressor.decompress(block)
+
+
+def chunk_codec(load_dictionary=None) -> TextBlockCodec | None:
+    """
+    return the codec for saving artifacts configured with CHUNK_COMPRESSION and
+    CHUNK_ZSTD_DICTIONARY, None when they are saved uncompressed
+    """
+    if not CHUNK_COMPRESSION:
+        return None
+    compression = {
+        "codec": CHUNK_COMPRESSION,
+        "dictionary": CHUNK_ZSTD_DICTIONARY or None,
+        "block_chunks": TEXT_BLOCK_CHUNKS,
+    }
+    return TextBlockCodec.from_header(compression, load_dictionary)
@@ -1,6 +1,7 @@
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-import tiktoken
 from litellm import embedding
 from litellm.exceptions import (
     APIConnectionError,
@@ -9,87 +10,201 @@ from litellm.exceptions import (
 )
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
+from ..helper import tiktoken_encoding
+from ..limiter import (
+    MAX_IN_FLIGHT_PER_MODEL,
+    adaptive_limiter,
+    wait_unless_rate_limited,
+)
+from .embedding_cache import embedding_cache
+from .local_embedding import is_local_model, local_embedding
+
 logger = logging.getLogger(__name__)
 
+# number of batches of one batch_embedding call sent concurrently
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
+# upper bound of the embedding requests in flight for a model, shared by all
+# batch_embedding calls in the process. the actual limit is adjusted by the
+# adaptive limiter according to latency and rate limit errors
+EMBEDDING_MAX_IN_FLIGHT = int(
+    os.environ.get("EMBEDDING_MAX_IN_FLIGHT", MAX_IN_FLIGHT_PER_MODEL)
+)
+
 
 def batch_embedding(
     chunks: list[str],
     model: str,
     dimension: int,
     task_type: str = "RETRIEVAL_DOCUMENT",
+    token_counts: list[int] | None = None,
+    concurrency: int | None = None,
 ) -> list[list[float]]:
     """
     Generates embeddings for a list of text chunks using either OpenAI or
-    Gemini embedding model.
+    Gemini embedding model, or a local model when model starts with "local/".
 
     Args:
         chunks (list[str]): A list of text chunks to process
+        token_counts (list[int]): token count of each chunk recorded at chunking
+                                  time, chunks are tokenized again when not given
+        concurrency (int): number of requests sent at the same time, defaults to
+                           the EMBEDDING_CONCURRENCY environment variable.
+                           retries are handled for each request separately
+
+    When EMBEDDING_CACHE_PATH is set, embeddings of chunks seen before are taken
+    from the embedding cache instead of calling the API.
 
     Returns:
         list[list[float]]: A list of embeddings (one embedding per chunk)
     """
-    if model.startswith("vertexai/"):
-        max_tokens_per_request, max_chunks_per_request = 10000, 200
-    else:
-        max_tokens_per_request, max_chunks_per_request = 8191, 99999  # no limit
+    cache = embedding_cache()
+    if cache is None:
+        return _embed_chunks(
+            chunks, model, dimension, task_type, token_counts, concurrency
+        )
 
-    # tiktoken does not support Gemini model
-    # use OpenAI as stand-in.
-    # since token limit is an OpenAI issue anyways.
-    encoding = tiktoken.encoding_for_model("text-embedding-ada-002")
+    # only send the chunks without a cached embedding to the API
+    embeddings = cache.get_many(model, dimension, task_type, chunks)
+    missing = [i for i, vector in enumerate(embeddings) if vector is None]
+    if missing:
+        missing_chunks = [chunks[i] for i in missing]
+        missing_token_counts = None
+        if token_counts is not None and len(token_counts) == len(chunks):
+            missing_token_counts = [token_counts[i] for i in missing]
 
-    embeddings = []
+        new_embeddings = _embed_chunks(
+            missing_chunks,
+            model,
+            dimension,
+            task_type,
+            missing_token_counts,
+            concurrency,
+        )
+        cache.put_many(model, dimension, task_type, missing_chunks, new_embeddings)
+        for i, vector in zip(missing, new_embeddings):
+            embeddings[i] = vector
 
-    # Split chunks into smaller batches based on token limit
-    current_batch: list[str] = []
-    current_tokens = 0
+    logger.debug(f"{len(chunks) - len(missing)} of {len(chunks)} embeddings from cache")
+    return embeddings
 
-    for chunk in chunks:
-        chunk_tokens = len(encoding.encode(chunk))
 
+def _embed_chunks(
+    chunks: list[str],
+    model: str,
+    dimension: int,
+    task_type: str,
+    token_counts: list[int] | None,
+    concurrency: int | None,
+) -> list[list[float]]:
+    max_tokens_per_request, max_chunks_per_request = request_limits(model)
+
+    encoding = tiktoken_encoding()
+    if token_counts is None or len(token_counts) != len(chunks):
+        token_counts = [len(tokens) for tokens in encoding.encode_ordinary_batch(chunks)]
+
+    texts, text_tokens = [], []
+    for chunk, chunk_tokens in zip(chunks, token_counts):
         if chunk_tokens > max_tokens_per_request:
             # Truncate the chunk to fit within the token limit
-            chunk = _truncate_chunk(chunk, encoding, max_tokens_per_request)
-            chunk_tokens = len(encoding.encode(chunk))
-
-        if (
-            len(current_batch) >= max_chunks_per_request
-            or (current_tokens + chunk_tokens) > max_tokens_per_request
-        ):
-            # Process the current batch before adding the new chunk
-            result = _call_embedding_api(
-                content=current_batch,
-                model=model,
-                task_type=task_type,
-                dimension=dimension,
-            )
-            embeddings.extend(result)
-            current_batch = []
-            current_tokens = 0
-
-        # Add the chunk to the current batch
-        current_batch.append(chunk)
-        current_tokens += chunk_tokens
-
-    # Process the final batch if it exists
-    if current_batch:
-        result = _call_embedding_api(
-            content=current_batch,
+            chunk, chunk_tokens = _truncate_chunk(chunk, encoding, max_tokens_per_request)
+        texts.append(chunk)
+        text_tokens.append(chunk_tokens)
+
+    batches = _plan_batches(text_tokens, max_tokens_per_request, max_chunks_per_request)
+    utilization = _plan_utilization(batches, text_tokens, max_tokens_per_request)
+    logger.debug(
+        f"{len(chunks)} chunks packed into {len(batches)} requests, {utilization:.0%} of token capacity used"  # noqa E501
+    )
+
+    def embed_batch(batch: list[int]) -> list[list[float]]:
+        return _call_embedding_api(
+            content=[texts[i] for i in batch],
             model=model,
             task_type=task_type,
             dimension=dimension,
         )
-        embeddings.extend(result)
+
+    if concurrency is None:
+        concurrency = EMBEDDING_CONCURRENCY
+
+    if concurrency > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as executor:
+            # map returns the results in the order of the batches
+            results = list(executor.map(embed_batch, batches))
+    else:
+        results = [embed_batch(batch) for batch in batches]
+
+    # put the embeddings back in the order of the chunks
+    embeddings: list[list[float]] = [[] for _ in chunks]
+    for batch, result in zip(batches, results):
+        for i, vector in zip(batch, result):
+            embeddings[i] = vector
 
     return embeddings
 
 
+def request_limits(model: str) -> tuple[int, int]:
+    """
+    return the max number of tokens and chunks in one embedding request
+    """
+    if model.startswith("vertex_ai/"):
+        return 10000, 200
+    else:
+        return 8191, 99999  # no limit
+
+
+def _plan_batches(
+    token_counts: list[int], max_tokens: int, max_chunks: int
+) -> list[list[int]]:
+    """
+    Pack chunks into as few requests as possible, within the token and
+    chunk limits of one request, using first-fit-decreasing.
+
+    Returns:
+        list[list[int]]: indices of the chunks in each batch, in ascending order
+    """
+    batches: list[list[int]] = []
+    batch_tokens: list[int] = []
+
+    for i in sorted(range(len(token_counts)), key=lambda i: -token_counts[i]):
+        for n, batch in enumerate(batches):
+            if (
+                len(batch) < max_chunks
+                and batch_tokens[n] + token_counts[i] <= max_tokens
+            ):
+                batch.append(i)
+                batch_tokens[n] += token_counts[i]
+                break
+        else:
+            batches.append([i])
+            batch_tokens.append(token_counts[i])
+
+    for batch in batches:
+        batch.sort()
+    batches.sort()
+    return batches
+
+
+def _plan_utilization(
+    batches: list[list[int]], token_counts: list[int], max_tokens: int
+) -> float:
+    """
+    return the share of the token capacity of the requests used by the chunks
+    """
+    if not batches:
+        return 0.0
+    return sum(token_counts) / (len(batches) * max_tokens)
+
+
 def _call_embedding_api(
     content: list[str],
     model: str,
     task_type: str,
     dimension: int,
 ) -> list[list[float]]:
+    if is_local_model(model):
+        return local_embedding(content, model=model, dimension=dimension)
+
     return _call_litellm_embedding_api(
         content,
         model=model,
@@ -100,7 +215,9 @@ def _call_embedding_api(
 
 @retry(
     stop=stop_after_attempt(7),
-    wait=wait_exponential(multiplier=1, min=1, max=120),
+    wait=wait_unless_rate_limited(
+        wait_exponential(multiplier=1, min=1, max=120), (RateLimitError,)
+    ),
     retry=retry_if_exception_type(
         (RateLimitError, APIConnectionError, InternalServerError)
     ),
@@ -110,11 +227,18 @@ def _call_litellm_embedding_api(
 ) -> list[list[float]]:
     try:
         kwargs = {}
-        if model.startswith("vertexai/"):
+        if model.startswith("vertex_ai/"):
             kwargs["task_type"] = task_type
             kwargs["dimensions"] = dimensionality
 
-        response = embedding(model=model, input=content, **kwargs)
+        # wait for a slot of the model, rate limit errors lower its limit
+        with adaptive_limiter().slot(model, EMBEDDING_MAX_IN_FLIGHT) as call:
+            try:
+                response = embedding(model=model, input=content, **kwargs)
+            except RateLimitError as e:
+                call.observe(e, rate_limited=True)
+                raise
+            call.observe(response)
         return [item["embedding"] for item in response.data]
     except (RateLimitError, APIConnectionError, InternalServerError) as e:
         logger.info(f"retrying {model} embedding API call due to {type(e)}: {str(e)}")
@@ -126,7 +250,7 @@ def _call_litellm_embedding_api(
         raise
 
 
-def _truncate_chunk(chunk: str, encoding, max_tokens: int) -> str:
+def _truncate_chunk(chunk: str, encoding, max_tokens: int) -> tuple[str, int]:
     """
     Truncates a chunk to fit within the token limit.
 
@@ -136,9 +260,9 @@ def _truncate_chunk(chunk: str, encoding, max_tokens: int) -> str:
         max_tokens (int): The maximum number of tokens allowed.
 
     Returns:
-        str: The truncated text chunk.
+        tuple[str, int]: The truncated text chunk and its number of tokens.
     """
-    tokens = encoding.encode(chunk)
+    tokens = encoding.encode_ordinary(chunk)
     if len(tokens) > max_tokens:
         tokens = tokens[: max_tokens - 500]  # leave some buffer
-    return encoding.decode(tokens)
+    return encoding.decode(tokens), len(tokens)
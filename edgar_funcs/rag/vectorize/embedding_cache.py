@@ -0,0 +1,225 @@
+import atexit
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+
+from .storage import storage, sync_location
+
+logger = logging.getLogger(__name__)
+
+# size limit of the cache database, least recently used embeddings are evicted
+EMBEDDING_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    dimension INTEGER NOT NULL,
+    task_type TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, dimension, task_type, text_hash)
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+"""
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by model, dimension, task type and the sha256 of the text,
+    stored in a SQLite database.
+
+    The same paragraphs show up in many filings of a fund family, in amended
+    filings and in filings chunked again with another chunk_algo_version. Their
+    embeddings are looked up here before calling the embedding API.
+
+    When sync_path is a gs:// or s3:// path, the database is downloaded from it
+    when the local file does not exist, and can be uploaded back with upload().
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+        sync_path: str = "",
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sync_path = sync_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(Path(path).parent, exist_ok=True)
+        if sync_path and not Path(path).exists():
+            self.download()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def get_many(
+        self, model: str, dimension: int, task_type: str, texts: list[str]
+    ) -> list[list[float] | None]:
+        """
+        return the cached embedding of each text, None for texts not in the cache
+        """
+        keys = [_text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            # query in slices to stay under the SQLite variable limit
+            for i in range(0, len(keys), 500):
+                key_slice = keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"""SELECT text_hash, vector FROM embeddings
+                    WHERE model = ? AND dimension = ? AND task_type = ?
+                    AND text_hash IN ({",".join("?" * len(key_slice))})""",
+                    [model, dimension, task_type, *key_slice],
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    """UPDATE embeddings SET last_used = ?
+                    WHERE model = ? AND dimension = ? AND task_type = ?
+                    AND text_hash = ?""",
+                    [(now, model, dimension, task_type, key) for key in found],
+                )
+                self._conn.commit()
+
+            n_hits = sum(key in found for key in keys)
+            self.hits += n_hits
+            self.misses += len(keys) - n_hits
+
+        return [array("d", found[key]).tolist() if key in found else None for key in keys]
+
+    def put_many(
+        self,
+        model: str,
+        dimension: int,
+        task_type: str,
+        texts: list[str],
+        embeddings: list[list[float]],
+    ) -> None:
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            vector = array("d", embedding).tobytes()
+            key = _text_hash(text)
+            rows.append((model, dimension, task_type, key, vector, len(vector), now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            self._evict()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._size()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "entries": entries,
+                "bytes": self._size(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate(),
+                "evictions": self.evictions,
+            }
+
+    def download(self) -> None:
+        base_path, name = sync_location(self.sync_path)
+        content = storage(base_path).get(name)
+        if content is not None:
+            Path(self.path).write_bytes(content)
+            logger.debug(f"downloaded embedding cache from {self.sync_path}")
+
+    def upload(self) -> None:
+        if not self.sync_path:
+            return
+        with self._lock:
+            self._conn.commit()
+            base_path, name = sync_location(self.sync_path)
+            storage(base_path).put(name, Path(self.path).read_bytes())
+        logger.debug(f"uploaded embedding cache to {self.sync_path}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _size(self) -> int:
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings")
+        return row.fetchone()[0]
+
+    def _evict(self) -> None:
+        # drop least recently used embeddings until the cache is 90% of max_bytes
+        excess = self._size() - self.max_bytes
+        if excess <= 0:
+            return
+
+        excess += self.max_bytes // 10
+        rowids = []
+        for rowid, size in self._conn.execute(
+            "SELECT rowid, size FROM embeddings ORDER BY last_used, rowid"
+        ):
+            rowids.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+
+        self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", rowids)
+        self._conn.commit()
+        self.evictions += len(rowids)
+        logger.debug(f"evicted {len(rowids)} embeddings from cache")
+
+
+_embedding_cache: EmbeddingCache | None = None
+_embedding_cache_lock = threading.Lock()
+
+
+def embedding_cache() -> EmbeddingCache | None:
+    """
+    return the embedding cache shared by all batch_embedding calls in this process,
+    or None when EMBEDDING_CACHE_PATH is not set
+
+    EMBEDDING_CACHE_MAX_MB limits the size of the cache. when EMBEDDING_CACHE_SYNC
+    is set to a gs:// or s3:// path, the cache is downloaded from it on first use
+    and uploaded back when the process exits
+    """
+    global _embedding_cache
+    if _embedding_cache is not None:
+        return _embedding_cache
+
+    cache_path = os.environ.get("EMBEDDING_CACHE_PATH", "")
+    if not cache_path:
+        return None
+
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            max_mb = os.environ.get("EMBEDDING_CACHE_MAX_MB", "")
+            max_bytes = int(max_mb) * 1024 * 1024 if max_mb else EMBEDDING_CACHE_MAX_BYTES
+            sync_path = os.environ.get("EMBEDDING_CACHE_SYNC", "")
+            _embedding_cache = EmbeddingCache(cache_path, max_bytes, sync_path)
+            if sync_path:
+                atexit.register(_embedding_cache.upload)
+
+    return _embedding_cache
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,120 @@
+import math
+import sys
+from collections import Counter
+from collections.abc import Sequence
+from functools import cached_property
+
+import numpy as np
+
+# BM25 parameters, the defaults of rank_bm25.BM25Okapi
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+
+def preprocess_text(text: str) -> list[str]:
+    """
+    Preprocess text for BM25 tokenization, with special handling for dollar amounts.
+    This helps match dollar ranges regardless of formatting.
+    """
+    # Basic lowercase and split
+    tokens = text.lower().split()
+
+    # Process tokens to handle dollar amounts
+    processed_tokens = []
+    for token in tokens:
+        # Keep original token
+        processed_tokens.append(token)
+
+        # Handle dollar signs and commas in numbers
+        if "$" in token or "," in token:
+            # Remove $ and commas from numbers
+            stripped = token.replace("$", "").replace(",", "")
+            if stripped.isdigit() or (
+                stripped.replace("-", "").isdigit() and "-" in stripped
+            ):
+                processed_tokens.append(stripped)
+
+    return processed_tokens
+
+
+class KeywordIndex:
+    """
+    BM25 index of the texts of chunks, giving the scores of rank_bm25.BM25Okapi.
+
+    The texts are tokenized once, the postings of each term, i.e. the chunks it
+    appears in, are kept with the BM25 weight of the term in each chunk, so
+    scoring a query only adds up the postings of its terms.
+    """
+
+    def __init__(
+        self,
+        texts: Sequence[str],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        epsilon: float = BM25_EPSILON,
+    ):
+        self.n_chunks = len(texts)
+        self.term_ids: dict[str, int] = {}
+        term_ids, chunk_nums, term_freqs = [], [], []
+        lengths = np.zeros(self.n_chunks)
+        for chunk_num, text in enumerate(texts):
+            tokens = preprocess_text(text)
+            lengths[chunk_num] = len(tokens)
+            for term, freq in Counter(tokens).items():
+                term_ids.append(self.term_ids.setdefault(term, len(self.term_ids)))
+                chunk_nums.append(chunk_num)
+                term_freqs.append(freq)
+
+        # postings grouped by term, those of term t are [offsets[t]:offsets[t + 1]]
+        n_terms = len(self.term_ids)
+        order = np.argsort(np.array(term_ids, dtype=np.int64), kind="stable")
+        self.offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=n_terms), out=self.offsets[1:])
+        self.chunk_nums = np.array(chunk_nums, dtype=np.int64)[order]
+        freqs = np.array(term_freqs, dtype=np.float64)[order]
+
+        # terms in more than half of the chunks get a fraction of the average idf,
+        # summed one by one as BM25Okapi does for the same scores
+        n_docs = np.diff(self.offsets)
+        n = self.n_chunks
+        idf = np.array(
+            [math.log(n - d + 0.5) - math.log(d + 0.5) for d in n_docs.tolist()]
+        )
+        if len(idf):
+            idf[idf < 0] = epsilon * (np.cumsum(idf)[-1] / len(idf))
+
+        avg_length = lengths.sum() / self.n_chunks if self.n_chunks else 0
+        chunk_norms = k1 * (1 - b + b * lengths / (avg_length or 1))
+        self.weights = np.repeat(idf, n_docs) * (
+            freqs * (k1 + 1) / (freqs + chunk_norms[self.chunk_nums])
+        )
+
+    @cached_property
+    def nbytes(self) -> int:
+        # memory of the term dictionary and the postings
+        terms = sys.getsizeof(self.term_ids) + sum(
+            sys.getsizeof(term) + sys.getsizeof(term_id)
+            for term, term_id in self.term_ids.items()
+        )
+        return terms + self.offsets.nbytes + self.chunk_nums.nbytes + self.weights.nbytes
+
+    def scores(self, tokens: list[str]) -> np.ndarray:
+        """
+        return the BM25 score of each chunk for the tokens of a query
+        """
+        scores = np.zeros(self.n_chunks)
+        for token in tokens:
+            term_id = self.term_ids.get(token)
+            if term_id is not None:
+                start, end = self.offsets[term_id], self.offsets[term_id + 1]
+                # a term has one posting per chunk, no chunk is added twice
+                scores[self.chunk_nums[start:end]] += self.weights[start:end]
+        return scores
+
+    def top_chunks(self, keywords: list[str], top_k: int) -> list[int]:
+        """
+        return the top_k chunks by BM25 score for the keywords, ties in chunk order
+        """
+        scores = self.scores(preprocess_text(" ".join(keywords)))
+        return [int(i) for i in np.argsort(-scores, kind="stable")[:top_k]]
@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import re
+from functools import lru_cache
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MODEL_PREFIX = "local/"
+HASHING_MODEL = "hashing"
+
+_WORD_REGEX = re.compile(r"[a-z0-9$][a-z0-9$,.\-]*[a-z0-9]|[a-z0-9]")
+
+
+def is_local_model(model: str) -> bool:
+    return model.startswith(LOCAL_MODEL_PREFIX)
+
+
+def model_path_name(model: str) -> str:
+    """
+    return the name of a model in storage paths and keys, without the provider
+    prefix. local models keep their full name with "/" replaced by "--", e.g.
+    sentence-transformers--all-MiniLM-L6-v2 for
+    local/sentence-transformers/all-MiniLM-L6-v2, so models of the same
+    organization do not share a name
+    """
+    if is_local_model(model):
+        return model[len(LOCAL_MODEL_PREFIX) :].replace("/", "--")
+    return model.split("/")[1] if "/" in model else model
+
+
+def local_embedding(content: list[str], model: str, dimension: int) -> list[list[float]]:
+    """
+    Generate embeddings without calling a remote API
+
+    Args:
+        content (list[str]): texts to embed
+        model (str): "local/hashing" for a deterministic hashing vectorizer, or
+                     "local/<name>" for a sentence-transformers model, which requires
+                     the optional sentence-transformers package
+        dimension (int): dimension of the embeddings
+
+    Returns:
+        list[list[float]]: normalized embeddings, one per text
+    """
+    name = model[len(LOCAL_MODEL_PREFIX) :]
+    if name == HASHING_MODEL:
+        return [_hashing_vector(text, dimension).tolist() for text in content]
+
+    encoder = _sentence_transformer(name)
+    vectors = encoder.encode(content, normalize_embeddings=True, convert_to_numpy=True)
+    if vectors.shape[1] < dimension:
+        raise ValueError(
+            f"{name} embeddings have {vectors.shape[1]} dimensions, not {dimension}"
+        )
+    if vectors.shape[1] > dimension:
+        vectors = vectors[:, :dimension]
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(float).tolist()
+
+
+def _hashing_vector(text: str, dimension: int) -> np.ndarray:
+    # hash words and word pairs into the vector, with a hashed sign so that
+    # collisions cancel out rather than pile up
+    words = _WORD_REGEX.findall(text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    vector = np.zeros(dimension)
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        sign = 1.0 if value & 1 else -1.0
+        vector[(value >> 1) % dimension] += sign
+
+    # dampen frequent words, then normalize to unit length
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@lru_cache(maxsize=4)
+def _sentence_transformer(name: str):
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError(
+            f"local embedding model {name} requires the sentence-transformers package"
+        ) from e
+
+    logger.debug(f"loading sentence-transformers model {name}")
+    return SentenceTransformer(name, device="cpu")
@@ -0,0 +1,260 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .local_embedding import model_path_name
+from .storage import storage, sync_location
+
+logger = logging.getLogger(__name__)
+
+# min seconds between uploads of the manifest after saves, 0 uploads after each
+CHUNK_MANIFEST_SYNC_INTERVAL = float(os.environ.get("CHUNK_MANIFEST_SYNC_INTERVAL", "0"))
+# uploads that lose the race with another process are retried after merging again
+MANIFEST_UPLOAD_ATTEMPTS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_algo_version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    dimension INTEGER NOT NULL,
+    cik TEXT NOT NULL,
+    accession_number TEXT NOT NULL,
+    n_chunks INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    date_filed TEXT,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (chunk_algo_version, model, dimension, cik, accession_number)
+);
+CREATE INDEX IF NOT EXISTS chunks_accession_number ON chunks (accession_number);
+"""
+
+
+class ChunkManifest:
+    """
+    Index of the saved chunks, one row per filing, chunk version, model and
+    dimension, stored in a SQLite database.
+
+    Every save records the filing, so whether filings are chunked and how many
+    are, is answered without loading chunks or listing the storage.
+
+    When sync_path is a gs:// or s3:// path, the database is downloaded from it
+    when the local file does not exist, and upload() merges the rows saved there
+    by other processes before uploading it back. flush() uploads the rows
+    recorded since the last upload, at most every sync_interval seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sync_path: str = "",
+        sync_interval: float = CHUNK_MANIFEST_SYNC_INTERVAL,
+    ):
+        self.path = path
+        self.sync_path = sync_path
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        # uploads run one at a time, records go on while a manifest is uploaded
+        self._upload_lock = threading.Lock()
+        self._unsynced = False
+        self._last_upload = 0.0
+
+        os.makedirs(Path(path).parent, exist_ok=True)
+        if sync_path and not Path(path).exists():
+            self.download()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def record(
+        self, metadata: Mapping, n_chunks: int, size: int, created_at: str | None = None
+    ) -> None:
+        """
+        record the chunks of a filing saved with metadata, replacing a previous save
+        """
+        row = (
+            metadata["chunk_algo_version"],
+            _model_name(metadata["model"]),
+            metadata["dimension"],
+            metadata["cik"],
+            metadata["accession_number"],
+            n_chunks,
+            size,
+            metadata.get("date_filed"),
+            created_at or datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row
+            )
+            self._conn.commit()
+            self._unsynced = True
+
+    def chunked(
+        self,
+        accession_numbers: list[str],
+        model: str,
+        dimension: int,
+        chunk_algo_version: str,
+    ) -> set[str]:
+        """
+        return the accession numbers that have chunks for the model and dimension
+        """
+        found = set()
+        with self._lock:
+            # query in slices to stay under the SQLite variable limit
+            for i in range(0, len(accession_numbers), 500):
+                number_slice = accession_numbers[i : i + 500]
+                rows = self._conn.execute(
+                    f"""SELECT accession_number FROM chunks
+                    WHERE chunk_algo_version = ? AND model = ? AND dimension = ?
+                    AND accession_number IN ({",".join("?" * len(number_slice))})""",
+                    [chunk_algo_version, _model_name(model), dimension, *number_slice],
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def stats(self) -> list[dict]:
+        """
+        return the number of filings, CIKs, chunks and bytes saved, and the range
+        of filing dates, for each chunk version, model and dimension
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                """SELECT chunk_algo_version, model, dimension,
+                COUNT(*) AS filings, COUNT(DISTINCT cik) AS ciks,
+                SUM(n_chunks) AS chunks, SUM(size) AS bytes,
+                MIN(date_filed) AS first_filed, MAX(date_filed) AS last_filed,
+                MAX(created_at) AS last_created
+                FROM chunks GROUP BY chunk_algo_version, model, dimension
+                ORDER BY chunk_algo_version, model, dimension"""
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def download(self) -> None:
+        base_path, name = sync_location(self.sync_path)
+        content = storage(base_path).get(name)
+        if content is not None:
+            Path(self.path).write_bytes(content)
+            logger.debug(f"downloaded chunk manifest from {self.sync_path}")
+
+    def pull(self) -> None:
+        """
+        merge the rows uploaded by other processes since the manifest was downloaded
+        """
+        if not self.sync_path:
+            return
+        base_path, name = sync_location(self.sync_path)
+        remote = storage(base_path).get(name)
+        if remote is not None:
+            with self._lock:
+                self._merge(remote)
+
+    def flush(self, force: bool = False) -> None:
+        """
+        upload the rows recorded since the last upload, unless the last upload
+        was less than sync_interval seconds ago. saves call it after recording a
+        filing, so the rows reach the bucket even if the process is killed
+        """
+        if not self.sync_path or not self._unsynced:
+            return
+        if force or time.monotonic() - self._last_upload >= self.sync_interval:
+            self.upload()
+
+    def upload(self) -> bool:
+        """
+        merge the rows uploaded by other processes and upload the manifest, only
+        if no other process uploaded it in the meantime, otherwise merge again
+
+        Returns:
+            bool: False when every attempt lost the race with other uploads
+        """
+        if not self.sync_path:
+            return True
+        base_path, name = sync_location(self.sync_path)
+        sync_storage = storage(base_path)
+        with self._upload_lock:
+            for _ in range(MANIFEST_UPLOAD_ATTEMPTS):
+                remote, generation = sync_storage.get_with_generation(name)
+                with self._lock:
+                    if remote is not None:
+                        self._merge(remote)
+                    self._conn.commit()
+                    content = Path(self.path).read_bytes()
+                    self._unsynced = False
+                # the first upload creates the manifest, later ones replace the
+                # generation merged above
+                if sync_storage.put(
+                    name,
+                    content,
+                    overwrite=False,
+                    if_generation_match=generation,
+                ):
+                    self._last_upload = time.monotonic()
+                    logger.debug(f"uploaded chunk manifest to {self.sync_path}")
+                    return True
+
+            self._unsynced = True
+            logger.warning(
+                f"chunk manifest not uploaded to {self.sync_path}, it was replaced "
+                f"by other processes {MANIFEST_UPLOAD_ATTEMPTS} times"
+            )
+            return False
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _merge(self, content: bytes) -> None:
+        # add the rows of another copy of the manifest, the most recent save of
+        # a filing wins
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            other_path = Path(tmp_dir) / "manifest.db"
+            other_path.write_bytes(content)
+            self._conn.execute("ATTACH DATABASE ? AS other", (str(other_path),))
+            try:
+                self._conn.execute(
+                    """INSERT OR REPLACE INTO chunks SELECT * FROM other.chunks o
+                    WHERE NOT EXISTS (SELECT 1 FROM chunks c
+                        WHERE c.chunk_algo_version = o.chunk_algo_version
+                        AND c.model = o.model AND c.dimension = o.dimension
+                        AND c.cik = o.cik AND c.accession_number = o.accession_number
+                        AND c.created_at >= o.created_at)"""
+                )
+                self._conn.commit()
+            finally:
+                self._conn.execute("DETACH DATABASE other")
+
+
+_chunk_manifest: ChunkManifest | None = None
+
+
+def chunk_manifest() -> ChunkManifest | None:
+    """
+    return the chunk manifest updated by all saves in this process, or None when
+    CHUNK_MANIFEST_PATH is not set
+
+    when CHUNK_MANIFEST_SYNC is set to a gs:// or s3:// path, the manifest is
+    downloaded from it on first use and uploaded back after saves, see flush()
+    """
+    global _chunk_manifest
+    if _chunk_manifest is None:
+        manifest_path = os.environ.get("CHUNK_MANIFEST_PATH", "")
+        if not manifest_path:
+            return None
+
+        sync_path = os.environ.get("CHUNK_MANIFEST_SYNC", "")
+        _chunk_manifest = ChunkManifest(manifest_path, sync_path)
+
+    return _chunk_manifest
+
+
+def _model_name(model: str) -> str:
+    # models are recorded without their provider prefix, as in the chunks path
+    return model_path_name(model)
@@ -0,0 +1,36 @@
+import numpy as np
+
+from .local_embedding import model_path_name
+
+# models trained with Matryoshka representation learning, the leading dimensions of
+# their embeddings are an embedding on their own. embeddings stored at one of these
+# dimensions can serve any smaller dimension by truncating and renormalizing them
+MATRYOSHKA_DIMENSIONS = {
+    "text-embedding-3-small": [1536],
+    "text-embedding-3-large": [3072, 1536],
+    "text-embedding-004": [768],
+    "text-embedding-005": [768],
+    "gemini-embedding-001": [3072, 1536, 768],
+}
+
+
+def source_dimensions(model: str, dimension: int) -> list[int]:
+    """
+    return the stored dimensions an embedding of the requested dimension can be
+    derived from, smallest first since those are the cheapest to load
+    """
+    model_name = model_path_name(model)
+    return sorted(d for d in MATRYOSHKA_DIMENSIONS.get(model_name, []) if d > dimension)
+
+
+def truncate_embeddings(vectors: np.ndarray, dimension: int) -> np.ndarray:
+    """
+    keep the first dimension components of each vector and scale it back to unit length
+    """
+    if dimension > vectors.shape[1]:
+        raise ValueError(f"cannot truncate {vectors.shape[1]} dimensions to {dimension}")
+
+    truncated = vectors[:, :dimension]
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return truncated / norms
@@ -0,0 +1,179 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from .artifact import ARTIFACT_ALIGNMENT, RangeReader
+from .storage import Storage
+
+# Packs keep the artifacts of all filings of a CIK in one file, so the filings of
+# a CIK take one object in storage instead of one per filing
+#
+#   artifact of filing 1 | artifact of filing 2 | ... | index (JSON) | footer
+#
+# each artifact is a complete chunks artifact starting at a multiple of
+# ARTIFACT_ALIGNMENT. the index maps accession numbers to the (offset, length) of
+# their artifact, the footer holds the offset and length of the index. saves
+# append, new filings are written after the last artifact followed by a new
+# index, artifacts of filings added again are replaced in the index only, and
+# scripts/compact_chunks.py rewrites packs with only the artifacts in their index.
+PACK_MAGIC = b"EDGARPAK"
+PACK_SUFFIX = ".chunkpack"
+# bytes read from the end of a pack at once, enough for the index of most packs
+PACK_TAIL_READ_SIZE = 64 * 1024
+# use packs in TextChunksWithEmbedding.load, enabled by CHUNK_PACKS=1. saves then
+# also replace the filing in the pack of its CIK, which downloads and uploads the
+# whole pack on each save
+USE_CHUNK_PACKS = os.environ.get("CHUNK_PACKS", "") == "1"
+# seconds a process keeps using the index of a pack before reading it again
+PACK_INDEX_TTL = 300
+# max number of pack indexes kept in a process
+PACK_INDEX_CACHE_SIZE = 1024
+# writes of a pack that lose the race with another process are retried after
+# reading the pack again
+PACK_UPDATE_ATTEMPTS = 5
+
+_FOOTER = struct.Struct("<QQ8s")
+
+
+class PackEntryReader:
+    """
+    reads the artifact of one filing in a pack, offsets are relative to the artifact
+    """
+
+    def __init__(self, reader: RangeReader, offset: int):
+        self._reader = reader
+        self._offset = offset
+
+    @property
+    def bytes_read(self) -> int:
+        return self._reader.bytes_read
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self._reader.read(self._offset + offset, length)
+
+    def read_array(self, offset: int, dtype: str, count: int) -> np.ndarray:
+        return self._reader.read_array(self._offset + offset, dtype, count)
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ARTIFACT_ALIGNMENT) * ARTIFACT_ALIGNMENT
+
+
+def append_to_pack(
+    pack: bytes | None, artifacts: dict[str, bytes], compact: bool = False
+) -> bytes:
+    """
+    Add artifacts keyed by accession number to a pack, or to a new one when pack
+    is None, and return the content of the pack
+
+    With compact=True the pack is rewritten with only the artifacts in its index,
+    dropping the bytes of artifacts replaced since it was written.
+    """
+    index, content = {}, bytearray()
+    if pack:
+        index, index_offset = decode_pack_index(pack)
+        if compact:
+            live = {
+                accession_number: pack[offset : offset + length]
+                for accession_number, (offset, length) in sorted(
+                    index.items(), key=lambda entry: entry[1][0]
+                )
+                if accession_number not in artifacts
+            }
+            index, artifacts = {}, {**live, **artifacts}
+        else:
+            content = bytearray(pack[:index_offset])
+
+    for accession_number, artifact in artifacts.items():
+        offset = _aligned(len(content))
+        content += bytes(offset - len(content)) + artifact
+        index[accession_number] = [offset, len(artifact)]
+
+    index_offset = len(content)
+    index_bytes = json.dumps(index).encode("utf-8")
+    content += index_bytes
+    content += _FOOTER.pack(index_offset, len(index_bytes), PACK_MAGIC)
+    return bytes(content)
+
+
+def update_pack(
+    chunks_storage: Storage,
+    path: str,
+    artifacts: dict[str, bytes],
+    create: bool = True,
+    compact: bool = False,
+) -> bool:
+    """
+    Add artifacts keyed by accession number to the pack at path, with create=False
+    only when the pack exists, with compact=True the pack is rewritten, see
+    append_to_pack. The pack is only replaced if no other process wrote it since
+    it was read, otherwise it is read again.
+
+    Each update downloads and uploads the whole pack.
+
+    Returns:
+        bool: False when the pack does not exist and create is False
+    """
+    for _ in range(PACK_UPDATE_ATTEMPTS):
+        pack, generation = chunks_storage.get_with_generation(path)
+        if pack is None and not create:
+            return False
+        if pack and compact and not artifacts and not unused_bytes(pack):
+            return True
+        content = append_to_pack(pack, artifacts, compact)
+        # a pack that did not exist is only created if it still does not
+        if chunks_storage.put(
+            path, content, overwrite=False, if_generation_match=generation
+        ):
+            return True
+
+    raise RuntimeError(
+        f"{path} was written by other processes {PACK_UPDATE_ATTEMPTS} times while "
+        "adding filings to it"
+    )
+
+
+def unused_bytes(pack: bytes) -> int:
+    """
+    return the bytes of a pack taken by artifacts no longer in its index
+    """
+    index, index_offset = decode_pack_index(pack)
+    used = 0
+    for offset, length in sorted(index.values()):
+        used = _aligned(used) + length
+    return index_offset - used
+
+
+def decode_pack_index(pack: bytes) -> tuple[dict[str, list[int]], int]:
+    """
+    return the index of a pack in memory and the offset where the index starts
+    """
+    index_offset, index_len = _footer(pack[-_FOOTER.size :])
+    return json.loads(pack[index_offset : index_offset + index_len]), index_offset
+
+
+def read_pack_index(
+    reader: RangeReader, size: int, tail_size: int = PACK_TAIL_READ_SIZE
+) -> dict[str, list[int]]:
+    """
+    read the index of a pack of size bytes, usually with a single read of its end
+    """
+    tail_start = max(0, size - tail_size)
+    tail = reader.read(tail_start, size - tail_start)
+    index_offset, index_len = _footer(tail[-_FOOTER.size :])
+    if index_offset < tail_start:
+        tail = reader.read(index_offset, size - index_offset)
+        tail_start = index_offset
+    start = index_offset - tail_start
+    return json.loads(tail[start : start + index_len])
+
+
+def _footer(footer: bytes) -> tuple[int, int]:
+    if len(footer) < _FOOTER.size:
+        raise ValueError("not a chunks pack")
+    index_offset, index_len, magic = _FOOTER.unpack(footer)
+    if magic != PACK_MAGIC:
+        raise ValueError("not a chunks pack")
+    return index_offset, index_len
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+
+# float64 keeps the values returned by the embedding API as is, the others trade
+# precision for memory and storage: float32 halves the size, float16 quarters it,
+# int8 stores 1 byte per dimension plus a float32 scale per vector
+EMBEDDING_DTYPES = ["float64", "float32", "float16", "int8"]
+DEFAULT_EMBEDDING_DTYPE = os.environ.get("EMBEDDING_DTYPE", "float32")
+# store embeddings scaled to unit length with the norm of each vector, so cosine
+# similarity is a dot product of the stored vectors
+NORMALIZE_EMBEDDINGS = os.environ.get("NORMALIZE_EMBEDDINGS", "") == "1"
+
+
+def quantize(
+    embeddings, dtype: str = DEFAULT_EMBEDDING_DTYPE
+) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Convert embeddings to a contiguous array of the storage dtype
+
+    Args:
+        embeddings: list of embeddings or a 2d array
+        dtype (str): one of EMBEDDING_DTYPES
+
+    Returns:
+        tuple[np.ndarray, np.ndarray | None]: the vectors and, for int8, the scale
+                                              of each vector, None otherwise
+    """
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype {dtype}")
+
+    vectors = np.asarray(embeddings, dtype=np.float64)
+    if vectors.size == 0:
+        return np.zeros((0, 0), dtype=dtype), None
+
+    if dtype != "int8":
+        return np.ascontiguousarray(vectors, dtype=dtype), None
+
+    # symmetric per vector quantization, the largest component maps to 127
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(quantized), scales.astype(np.float32)
+
+
+def normalize_vectors(vectors) -> tuple[np.ndarray, np.ndarray]:
+    """
+    scale vectors to unit length, zero vectors are kept as is
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the unit vectors and the norm of each vector
+    """
+    vectors = np.asarray(vectors)
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    return vectors / np.where(norms == 0, 1, norms)[:, None], norms
+
+
+def dequantize(vectors: np.ndarray, scales: np.ndarray | None = None) -> np.ndarray:
+    """
+    return the vectors as floats, float64 and float32 vectors are returned as is
+    """
+    if vectors.dtype == np.int8:
+        if scales is None:
+            raise ValueError("int8 embeddings require scales")
+        return vectors.astype(np.float32) * scales[:, None]
+    if vectors.dtype == np.float16:
+        return vectors.astype(np.float32)
+    return vectors
+
+
+def similarity_vectors(vectors) -> np.ndarray:
+    """
+    return vectors in a float dtype suitable for cosine similarity
+
+    cosine similarity does not depend on the length of the vectors, so int8
+    vectors are used without their scales
+    """
+    vectors = np.asarray(vectors)
+    if vectors.dtype in (np.int8, np.float16):
+        return vectors.astype(np.float32)
+    if vectors.dtype != np.float32:
+        return vectors.astype(np.float64, copy=False)
+    return vectors
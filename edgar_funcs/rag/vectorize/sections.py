@@ -0,0 +1,178 @@
+import re
+from typing import TypedDict
+
+# a heading opens a section that runs until the next heading,
+# but never spans more chunks than this
+MAX_SECTION_CHUNKS = 4
+MAX_HEADING_LENGTH = 80
+MAX_HEADING_WORDS = 10
+
+# phrases that are recorded with the chunks they appear in, lower case
+SECTION_KEYWORDS = [
+    "aggregate compensation",
+    "total compensation",
+    "pension or retirement benefits",
+    "dollar range",
+    "beneficial ownership",
+    "beneficially owned",
+    "portfolio manager",
+]
+
+# numbering in front of a heading, e.g. "(c)", "IV." or "2."
+_ENUMERATOR_REGEX = re.compile(r"^\s*\(?([a-z]{1,4}|\d{1,3})[.)]\s+", re.IGNORECASE)
+_MINOR_WORDS = {"a", "an", "and", "as", "at", "by", "for", "from", "in", "of", "on"}
+_MINOR_WORDS |= {"or", "the", "to", "with", "per", "other", "than"}
+
+
+class SectionIndex(TypedDict):
+    headings: dict[str, list[list[int]]]
+    keywords: dict[str, list[int]]
+
+
+def build_section_index(
+    chunks: list[str],
+    section_paths: list[str] | None = None,
+) -> SectionIndex:
+    """
+    Map the headings and keywords found in a document to the chunks they cover
+
+    Args:
+        chunks (list[str]): chunks of the document, in document order
+        section_paths (list[str]): section path of each chunk, recorded by the
+                                   "section" chunking method, if available
+
+    Returns:
+        SectionIndex: "headings" maps each normalized heading to a list of
+                      [first, last] chunk ranges, "keywords" maps each phrase in
+                      SECTION_KEYWORDS to the chunks that contain it
+    """
+    heading_chunks = [
+        [normalize_heading(line) for line in chunk.split("\n") if _is_heading(line)]
+        for chunk in chunks
+    ]
+    starts = [i for i, headings in enumerate(heading_chunks) if headings]
+
+    ranges: dict[str, list[tuple[int, int]]] = {}
+    for n, start in enumerate(starts):
+        if n + 1 < len(starts):
+            # the chunk with the next heading belongs to this section too,
+            # unless the chunk begins with that heading
+            end = starts[n + 1]
+            if _is_heading(_first_line(chunks[end])):
+                end -= 1
+        else:
+            end = len(chunks) - 1
+        end = min(max(start, end), start + MAX_SECTION_CHUNKS - 1)
+        for heading in heading_chunks[start]:
+            ranges.setdefault(heading, []).append((start, end))
+
+    if section_paths:
+        # the section path of a chunk covers the whole chunk
+        for i, path in enumerate(section_paths):
+            for heading in path.split(" > ") if path else []:
+                ranges.setdefault(normalize_heading(heading), []).append((i, i))
+
+    headings = {
+        heading: _merge_ranges(heading_ranges)
+        for heading, heading_ranges in ranges.items()
+        if heading
+    }
+
+    return {"headings": headings, "keywords": _keyword_chunks(chunks)}
+
+
+def lookup_section(
+    section_index: SectionIndex | None,
+    heading_patterns: list[str],
+    keywords: list[str] | None = None,
+    max_chunks: int = 2 * MAX_SECTION_CHUNKS,
+) -> list[int]:
+    """
+    Find the chunks of the sections whose heading matches any of the patterns
+
+    A section only counts if at least one of its chunks contains one of the
+    keywords. When nothing matches, or the matched sections cover more than
+    max_chunks chunks, the hit is not considered confident and an empty list
+    is returned, so that the caller can fall back to searching all chunks.
+
+    Args:
+        section_index (SectionIndex): index built by build_section_index
+        heading_patterns (list[str]): regular expressions matched against the
+                                      normalized headings
+        keywords (list[str]): phrases from SECTION_KEYWORDS
+
+    Returns:
+        list[int]: sorted chunk numbers of the matched sections
+    """
+    if not section_index:
+        return []
+
+    keyword_chunks = set()
+    for keyword in keywords or []:
+        keyword_chunks.update(section_index["keywords"].get(keyword, []))
+
+    candidates = set()
+    for heading, ranges in section_index["headings"].items():
+        if not any(re.search(pattern, heading) for pattern in heading_patterns):
+            continue
+        for start, end in ranges:
+            chunk_nums = set(range(start, end + 1))
+            if keywords and not chunk_nums & keyword_chunks:
+                continue
+            candidates.update(chunk_nums)
+
+    if len(candidates) > max_chunks:
+        return []
+
+    return sorted(candidates)
+
+
+def normalize_heading(text: str) -> str:
+    """
+    lower case the heading, drop footnote markers, numbering and punctuation
+    """
+    text = _ENUMERATOR_REGEX.sub("", text).lower()
+    text = re.sub(r"[^a-z]+", " ", text)
+    return " ".join(text.split())
+
+
+def _is_heading(line: str) -> bool:
+    text = _ENUMERATOR_REGEX.sub("", line.strip().lstrip("#").strip())
+    if not text or len(text) > MAX_HEADING_LENGTH or not text[0].isalpha():
+        return False
+    if "|" in text or text[-1] in ".,;" or "...." in text:
+        return False
+
+    words = re.findall(r"[A-Za-z][A-Za-z'\-]*", text)
+    if not words or len(words) > MAX_HEADING_WORDS:
+        return False
+    if line.lstrip().startswith("#"):
+        return True
+    if text.isupper():
+        return True
+    return all(word[0].isupper() or word.lower() in _MINOR_WORDS for word in words)
+
+
+def _keyword_chunks(chunks: list[str]) -> dict[str, list[int]]:
+    keywords: dict[str, list[int]] = {}
+    for i, chunk in enumerate(chunks):
+        text = chunk.lower()
+        for keyword in SECTION_KEYWORDS:
+            if keyword in text:
+                keywords.setdefault(keyword, []).append(i)
+    return keywords
+
+
+def _first_line(text: str) -> str:
+    return next((line for line in text.split("\n") if line.strip()), "")
+
+
+def _merge_ranges(ranges: list[tuple[int, int]]) -> list[list[int]]:
+    # merge overlapping or adjacent ranges
+    merged: list[list[int]] = []
+    for start, end in sorted(ranges):
+        if merged and merged[-1][1] >= start - 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
@@ -0,0 +1,425 @@
+import hashlib
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from ..helper import gcs_client
+from .artifact import GCSRangeReader, LocalRangeReader, RangeReader, S3RangeReader
+
+# chunks, packs, dictionaries and locks are kept under a storage prefix, the
+# backend is picked by its scheme:
+#   gs://bucket/prefix    Google Cloud Storage
+#   s3://bucket/prefix    S3 or a compatible store, e.g. MinIO with S3_ENDPOINT_URL
+#   /path or path         local directory, relative paths are under edgar_funcs/rag
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "")
+# max number of calls in flight in the batch operations of a storage
+STORAGE_CONCURRENCY = int(os.environ.get("STORAGE_CONCURRENCY", "32"))
+
+
+class Storage(ABC):
+    """
+    Objects under a storage prefix, paths are relative to the prefix.
+
+    The batch operations run up to concurrency calls at once in threads, the
+    clients of all backends can be shared by threads.
+    """
+
+    # locks are only kept in remote storage, local runs do not need them
+    remote = True
+
+    def __init__(self, concurrency: int = STORAGE_CONCURRENCY):
+        self.concurrency = concurrency
+
+    @abstractmethod
+    def get(self, path: str) -> bytes | None:
+        """
+        return the content of the object at path, None if it does not exist
+        """
+
+    @abstractmethod
+    def get_with_generation(self, path: str) -> tuple[bytes | None, str | None]:
+        """
+        return the content of the object at path and its generation, which
+        changes on every write, None and None if it does not exist
+        """
+
+    @abstractmethod
+    def put(
+        self,
+        path: str,
+        content: bytes,
+        overwrite: bool = True,
+        if_generation_match: str | None = None,
+    ) -> bool:
+        """
+        write content to path, with overwrite=False an existing object is kept,
+        with if_generation_match the object is only replaced if it is still at
+        that generation, as returned by get_with_generation
+
+        Returns:
+            bool: False when the object was not written
+        """
+
+    @abstractmethod
+    def exists(self, path: str) -> bool:
+        """
+        return True if an object exists at path
+        """
+
+    @abstractmethod
+    def delete(self, path: str) -> None:
+        """
+        delete the object at path, if it exists
+        """
+
+    @abstractmethod
+    def list_files(self, path: str) -> list[str]:
+        """
+        return the paths of all objects under the directory path
+        """
+
+    @abstractmethod
+    def range_reader(self, path: str) -> RangeReader | None:
+        """
+        return a reader of byte ranges of the object at path, None if it does not
+        exist. reads return the content of the object when the reader was created
+        """
+
+    def get_many(self, paths: list[str]) -> dict[str, bytes | None]:
+        return dict(zip(paths, self._map(self.get, paths)))
+
+    def put_many(self, contents: dict[str, bytes], overwrite: bool = True) -> dict:
+        """
+        write the content of each path
+
+        Returns:
+            dict: path to False when the object existed and was not overwritten
+        """
+        paths = list(contents)
+        results = self._map(lambda path: self.put(path, contents[path], overwrite), paths)
+        return dict(zip(paths, results))
+
+    def exists_many(self, paths: list[str]) -> dict[str, bool]:
+        return dict(zip(paths, self._map(self.exists, paths)))
+
+    def delete_many(self, paths: list[str]) -> None:
+        self._map(self.delete, paths)
+
+    def _map(self, func, items: list) -> list:
+        if len(items) <= 1 or self.concurrency <= 1:
+            return [func(item) for item in items]
+        workers = min(self.concurrency, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, items))
+
+
+class LocalStorage(Storage):
+    """
+    files under a local directory
+    """
+
+    remote = False
+
+    def __init__(self, root: str, concurrency: int = STORAGE_CONCURRENCY):
+        super().__init__(concurrency)
+        self.root = Path(root)
+
+    def get(self, path: str) -> bytes | None:
+        try:
+            return (self.root / path).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def get_with_generation(self, path: str) -> tuple[bytes | None, str | None]:
+        content = self.get(path)
+        if content is None:
+            return None, None
+        return content, _content_generation(content)
+
+    def put(
+        self,
+        path: str,
+        content: bytes,
+        overwrite: bool = True,
+        if_generation_match: str | None = None,
+    ) -> bool:
+        # replace the file instead of truncating it since loaded chunks may
+        # still be memory mapping the previous one
+        output_path = self.root / path
+        os.makedirs(output_path.parent, exist_ok=True)
+        tmp_path = output_path.with_name(
+            f"{output_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        if if_generation_match is not None:
+            # the check and the replace are atomic within this process only
+            with _local_put_lock:
+                current = self.get(path)
+                if current is not None and (
+                    _content_generation(current) == if_generation_match
+                ):
+                    os.replace(tmp_path, output_path)
+                    return True
+            os.remove(tmp_path)
+            return False
+        if overwrite:
+            os.replace(tmp_path, output_path)
+            return True
+
+        try:
+            # linking fails when another process created the file first
+            os.link(tmp_path, output_path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def exists(self, path: str) -> bool:
+        return (self.root / path).exists()
+
+    def delete(self, path: str) -> None:
+        try:
+            os.remove(self.root / path)
+        except FileNotFoundError:
+            pass
+
+    def list_files(self, path: str) -> list[str]:
+        files = sorted(p for p in (self.root / path).rglob("*") if p.is_file())
+        return [str(p.relative_to(self.root)) for p in files]
+
+    def range_reader(self, path: str) -> RangeReader | None:
+        try:
+            return LocalRangeReader(self.root / path)
+        except FileNotFoundError:
+            return None
+
+
+class GCSStorage(Storage):
+    """
+    blobs under a prefix of a GCS bucket
+    """
+
+    def __init__(
+        self, bucket_name: str, prefix: str = "", concurrency: int = STORAGE_CONCURRENCY
+    ):
+        super().__init__(concurrency)
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def get(self, path: str) -> bytes | None:
+        try:
+            return self._bucket().blob(self._name(path)).download_as_bytes()
+        except NotFound:
+            return None
+
+    def get_with_generation(self, path: str) -> tuple[bytes | None, str | None]:
+        blob = self._bucket().blob(self._name(path))
+        try:
+            # the download sets the generation of the blob it returned
+            content = blob.download_as_bytes()
+        except NotFound:
+            return None, None
+        return content, str(blob.generation)
+
+    def put(
+        self,
+        path: str,
+        content: bytes,
+        overwrite: bool = True,
+        if_generation_match: str | None = None,
+    ) -> bool:
+        # generation 0 only matches a blob that does not exist
+        if if_generation_match is not None:
+            generation = int(if_generation_match)
+        else:
+            generation = None if overwrite else 0
+        blob = self._bucket().blob(self._name(path))
+        try:
+            blob.upload_from_string(content, if_generation_match=generation)
+        except PreconditionFailed:
+            return False
+        return True
+
+    def exists(self, path: str) -> bool:
+        return self._bucket().blob(self._name(path)).exists()
+
+    def delete(self, path: str) -> None:
+        try:
+            self._bucket().blob(self._name(path)).delete()
+        except NotFound:
+            pass
+
+    def list_files(self, path: str) -> list[str]:
+        base = f"{self.prefix}/" if self.prefix else ""
+        blobs = gcs_client().list_blobs(self.bucket_name, prefix=self._name(path))
+        return [blob.name.removeprefix(base) for blob in blobs]
+
+    def range_reader(self, path: str) -> RangeReader | None:
+        # get_blob fetches the size and generation the reads are pinned to
+        blob = self._bucket().get_blob(self._name(path))
+        return GCSRangeReader(blob) if blob is not None else None
+
+    def _bucket(self):
+        return gcs_client().bucket(self.bucket_name)
+
+    def _name(self, path: str) -> str:
+        return f"{self.prefix}/{path}" if self.prefix else path
+
+
+class S3Storage(Storage):
+    """
+    objects under a prefix of an S3 bucket, or of a compatible store when
+    endpoint_url is set
+    """
+
+    def __init__(
+        self,
+        bucket_name: str,
+        prefix: str = "",
+        endpoint_url: str = S3_ENDPOINT_URL,
+        concurrency: int = STORAGE_CONCURRENCY,
+    ):
+        super().__init__(concurrency)
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+
+    def get(self, path: str) -> bytes | None:
+        client = self._client()
+        try:
+            response = client.get_object(Bucket=self.bucket_name, Key=self._key(path))
+        except client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def get_with_generation(self, path: str) -> tuple[bytes | None, str | None]:
+        # the ETag of an object changes whenever it is written
+        client = self._client()
+        try:
+            response = client.get_object(Bucket=self.bucket_name, Key=self._key(path))
+        except client.exceptions.NoSuchKey:
+            return None, None
+        return response["Body"].read(), response["ETag"]
+
+    def put(
+        self,
+        path: str,
+        content: bytes,
+        overwrite: bool = True,
+        if_generation_match: str | None = None,
+    ) -> bool:
+        client = self._client()
+        # If-None-Match only writes an object that does not exist, If-Match only
+        # replaces the object with that ETag
+        if if_generation_match is not None:
+            condition = {"IfMatch": if_generation_match}
+        else:
+            condition = {} if overwrite else {"IfNoneMatch": "*"}
+        try:
+            client.put_object(
+                Bucket=self.bucket_name, Key=self._key(path), Body=content, **condition
+            )
+        except client.exceptions.ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return False
+            raise
+        return True
+
+    def exists(self, path: str) -> bool:
+        return self._head(path) is not None
+
+    def delete(self, path: str) -> None:
+        self._client().delete_object(Bucket=self.bucket_name, Key=self._key(path))
+
+    def list_files(self, path: str) -> list[str]:
+        base = f"{self.prefix}/" if self.prefix else ""
+        paginator = self._client().get_paginator("list_objects_v2")
+        pages = paginator.paginate(Bucket=self.bucket_name, Prefix=self._key(path))
+        return [
+            item["Key"].removeprefix(base)
+            for page in pages
+            for item in page.get("Contents", [])
+        ]
+
+    def range_reader(self, path: str) -> RangeReader | None:
+        head = self._head(path)
+        if head is None:
+            return None
+        return S3RangeReader(
+            self._client(),
+            self.bucket_name,
+            self._key(path),
+            size=head["ContentLength"],
+            etag=head["ETag"],
+        )
+
+    def _head(self, path: str) -> dict | None:
+        client = self._client()
+        try:
+            return client.head_object(Bucket=self.bucket_name, Key=self._key(path))
+        except client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+
+    def _client(self):
+        return s3_client(self.endpoint_url)
+
+    def _key(self, path: str) -> str:
+        return f"{self.prefix}/{path}" if self.prefix else path
+
+
+# conditional puts of local files check and replace the file under this lock
+_local_put_lock = threading.Lock()
+
+
+def _content_generation(content: bytes) -> str:
+    # the generation of a local file is the digest of its content, like the ETag
+    # of an S3 object
+    return hashlib.md5(content).hexdigest()
+
+
+@lru_cache(maxsize=4)
+def s3_client(endpoint_url: str = ""):
+    try:
+        import boto3
+    except ImportError as e:
+        raise ImportError(
+            "s3:// storage requires boto3, install it with pip install edgar-funcs[s3]"
+        ) from e
+    return boto3.client("s3", endpoint_url=endpoint_url or None)
+
+
+@lru_cache(maxsize=16)
+def storage(storage_base_path: str) -> Storage:
+    """
+    return the storage of a storage prefix, e.g. the STORAGE_PREFIX environment
+    variable
+    """
+    for scheme, storage_class in (("gs://", GCSStorage), ("s3://", S3Storage)):
+        if storage_base_path.startswith(scheme):
+            bucket_name, _, prefix = storage_base_path[len(scheme) :].partition("/")
+            return storage_class(bucket_name, prefix.rstrip("/"))
+
+    if storage_base_path.startswith("/"):
+        return LocalStorage(storage_base_path)
+    return LocalStorage(str(Path(__file__).parent.parent / storage_base_path))
+
+
+def sync_location(path: str) -> tuple[str, str]:
+    """
+    split the gs:// or s3:// path of a file synced to storage, e.g.
+    gs://bucket/dir/cache.db, into its storage prefix and name
+    """
+    if not path.startswith(("gs://", "s3://")):
+        raise ValueError(f"{path} is not a gs:// or s3:// path")
+    base_path, _, name = path.rpartition("/")
+    return base_path, name
@@ -13,8 +13,7 @@ from google.cloud import logging as cloud_logging
 from google.cloud import pubsub_v1
 from google.oauth2 import service_account
 
-from edgar_funcs.rag.helper import gcs_client
-from edgar_funcs.rag.vectorize import _storage_prefix
+from edgar_funcs.rag.vectorize.storage import Storage, storage
 
 logger = logging.getLogger(__name__)
 
@@ -118,14 +117,15 @@ def publish_message(message: dict, topic_name: str):
 
 
 def write_lock(blob_path: str, validity: int = 900) -> bool:
-    lock_blob = _get_lock_blob(blob_path)
-    if not lock_blob:
+    lock_storage = _lock_storage()
+    if not lock_storage:
         return False
 
     ts_zero = "1971-01-01T00:00:00.000+00:00"
-    if lock_blob.exists():
+    lock_content = lock_storage.get(blob_path)
+    if lock_content is not None:
         try:
-            content = json.loads(lock_blob.download_as_text())
+            content = json.loads(lock_content)
             expires_at = content.get("expires_at", ts_zero)
         except json.JSONDecodeError:
             # lock file exists but content is not valid JSON
@@ -137,23 +137,22 @@ def write_lock(blob_path: str, validity: int = 900) -> bool:
             return False
 
     content = {"expires_at": _expires_after(validity)}
-    lock_blob.upload_from_string(json.dumps(content))
+    lock_storage.put(blob_path, json.dumps(content).encode("utf-8"))
     logger.debug(f"created lock {blob_path}")
     return True
 
 
 def delete_lock(blob_path: str):
-    lock_blob = _get_lock_blob(blob_path)
-    if lock_blob:
-        lock_blob.delete()
+    lock_storage = _lock_storage()
+    if lock_storage:
+        lock_storage.delete(blob_path)
         logger.debug(f"deleted lock {blob_path}")
 
 
-def _get_lock_blob(path: str):
-    bucket_name, prefix = _storage_prefix(os.environ.get("STORAGE_PREFIX", ""))
-    if bucket_name:
-        bucket = gcs_client().bucket(bucket_name)
-        return bucket.blob(f"{prefix}/{path}")
+def _lock_storage() -> Storage | None:
+    # locks are only used with remote storage
+    lock_storage = storage(os.environ.get("STORAGE_PREFIX", ""))
+    return lock_storage if lock_storage.remote else None
 
 
 def _expires_after(seconds: int) -> str:
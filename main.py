@@ -8,12 +8,15 @@ from flask import Flask, jsonify, request
 
 from edgar_funcs.edgar import SECFiling
 from edgar_funcs.rag.extract.fundmgr import extract_fundmgr_ownership_from_filing
+from edgar_funcs.rag.extract.query_bank import parse_query_models, query_bank
 from edgar_funcs.rag.extract.trustee import extract_trustee_comp_from_filing
 from edgar_funcs.rag.vectorize import (
     TextChunksWithEmbedding,
     _blob_path,
     chunk_filing,
 )
+from edgar_funcs.rag.vectorize.artifact_cache import cache_chunks, load_chunks
+from edgar_funcs.rag.vectorize.chunking import chunking_method
 from func_helpers import (
     decode_request,
     delete_lock,
@@ -27,6 +30,10 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# load the query vectors of the embedding models in use before the first request,
+# QUERY_BANK_MODELS is a comma separated list of model:dimension
+query_bank().preload(parse_query_models(os.environ.get("QUERY_BANK_MODELS", "")))
+
 
 @app.route("/process", methods=["POST"])
 def req_processor():
@@ -54,7 +61,7 @@ def req_processor():
 
         # step 2: perform extraction using LLM
         data["date_filed"] = chunks.metadata.get("date_filed", "1971-01-01")
-        result = _perform_extraction(data)
+        result = _perform_extraction(data, chunks)
 
         # step 3: save the extraction result
         _publish_result(result)
@@ -81,7 +88,7 @@ def _retrieve_chunks_for_filing(
     **_,  # ignore any other parameters
 ) -> TextChunksWithEmbedding | None:
     try:
-        existing_chunks = TextChunksWithEmbedding.load(
+        existing_chunks = load_chunks(
             cik=cik,
             accession_number=accession_number,
             model=embedding_model,
@@ -111,10 +118,14 @@ def _retrieve_chunks_for_filing(
     start_t = datetime.now()
     filing = SECFiling(cik=cik, accession_number=accession_number)
     metadata["date_filed"] = filing.date_filed
-    text_chunks = chunk_filing(filing)
+    method, size_unit = chunking_method(chunk_algo_version)
+    text_chunks = chunk_filing(
+        filing, method=method, size_unit=size_unit, metadata=metadata
+    )
     new_chunks = TextChunksWithEmbedding(text_chunks, metadata=metadata)
     new_chunks.get_embeddings(model=embedding_model, dimension=embedding_dimension)
     new_chunks.save()
+    cache_chunks(new_chunks)
     elapsed_t = datetime.now() - start_t
     logger.info(
         f"created new {len(new_chunks.texts)} chunks for {cik}/{accession_number} took {elapsed_t.total_seconds():.2f} seconds"  # noqa E501
@@ -123,7 +134,9 @@ def _retrieve_chunks_for_filing(
     return new_chunks
 
 
-def _perform_extraction(data: dict) -> dict[str, Any]:
+def _perform_extraction(
+    data: dict, chunks: TextChunksWithEmbedding | None = None
+) -> dict[str, Any]:
     action = data.get("action")
     cik = data.get("cik", "0")
     accession_number = data.get("accession_number", "0000000000-00-000000")
@@ -142,7 +155,7 @@ def _perform_extraction(data: dict) -> dict[str, Any]:
 
     # step 2: perform extraction if action is trustee or fundmgr
     if action == "trustee":
-        result = extract_trustee_comp_from_filing(**data)
+        result = extract_trustee_comp_from_filing(**data, chunks=chunks)
         if result:
             try:
                 n_trustee = result["n_trustee"]
@@ -154,7 +167,7 @@ def _perform_extraction(data: dict) -> dict[str, Any]:
             extraction_result["response"] = result["response"]
 
     elif action == "fundmgr":
-        result = extract_fundmgr_ownership_from_filing(**data)
+        result = extract_fundmgr_ownership_from_filing(**data, chunks=chunks)
         if result:
             try:
                 n_manager = len(result["ownership_info"]["managers"])
@@ -167,13 +180,14 @@ def _perform_extraction(data: dict) -> dict[str, Any]:
 
     else:
         # action is "chunk", just load the chunks to verify it exists
-        chunks = TextChunksWithEmbedding.load(
-            cik=cik,
-            accession_number=accession_number,
-            model=data.get("embedding_model", "_dummy_"),
-            dimension=data.get("embedding_dimension", "0"),
-            chunk_algo_version=data.get("chunk_algo_version", "0"),
-        )
+        if chunks is None:
+            chunks = load_chunks(
+                cik=cik,
+                accession_number=accession_number,
+                model=data.get("embedding_model", "_dummy_"),
+                dimension=data.get("embedding_dimension", "0"),
+                chunk_algo_version=data.get("chunk_algo_version", "0"),
+            )
         extraction_result["selected_chunks"] = []
         extraction_result["selected_text"] = ""
         extraction_result["response"] = "" if chunks else "no chunks found"
@@ -0,0 +1,108 @@
+import argparse
+import csv
+import logging
+import tempfile
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from edgar_funcs.edgar import SECFiling
+from edgar_funcs.rag.vectorize import TextChunksWithEmbedding, chunk_filings
+from edgar_funcs.rag.vectorize.batch_job import (
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+    run_embedding_job,
+)
+from edgar_funcs.rag.vectorize.chunking import (
+    CHUNK_ALGORITHM_VERSIONS,
+    chunk_algorithm_versions,
+    chunking_method,
+)
+from edgar_funcs.rag.vectorize.manifest import chunk_manifest
+
+load_dotenv()
+
+
+def batch_embed(
+    filings_csv: str,
+    model: str,
+    dimension: int,
+    chunk_algo_version: str,
+    workers: int,
+    backend_name: str,
+):
+    """
+    chunk the filings listed in a csv file with cik and accession_number columns,
+    embed them with one batch job and save the chunks with embeddings
+    """
+    with open(filings_csv, "r") as f:
+        rows = list(csv.DictReader(f))
+    filings = [
+        SECFiling(cik=row["cik"], accession_number=row["accession_number"])
+        for row in rows
+    ]
+
+    method, size_unit = chunking_method(chunk_algo_version)
+    chunked = chunk_filings(filings, workers=workers, method=method, size_unit=size_unit)
+
+    text_chunks = [
+        TextChunksWithEmbedding(
+            texts=result["chunks"],
+            metadata={
+                **result["metadata"],
+                "cik": filing.cik,
+                "accession_number": filing.accession_number,
+                "date_filed": filing.date_filed,
+                "chunk_algo_version": chunk_algo_version,
+            },
+        )
+        for filing, result in zip(filings, chunked)
+        if result["chunks"]
+    ]
+
+    work_dir = tempfile.mkdtemp(prefix="batch_embed_")
+    if backend_name == "local":
+        backend = LocalBatchBackend(work_dir)
+    else:
+        backend = OpenAIBatchBackend()
+    run_embedding_job(
+        text_chunks,
+        model=model,
+        dimension=dimension,
+        backend=backend,
+        job_path=str(Path(work_dir) / "job.jsonl"),
+    )
+
+    for chunks in text_chunks:
+        chunks.save()
+        print(f"saved {chunks.metadata['cik']}/{chunks.metadata['accession_number']}")
+
+    # saves upload the manifest at most every CHUNK_MANIFEST_SYNC_INTERVAL seconds
+    manifest = chunk_manifest()
+    if manifest:
+        manifest.flush(force=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Embed filings with a batch job")
+    parser.add_argument("filings_csv", help="csv file with cik,accession_number columns")
+    parser.add_argument("--embedding-model", default="text-embedding-3-small")
+    parser.add_argument("--embedding-dimension", type=int, default=1536)
+    parser.add_argument(
+        "--chunk-algo-version",
+        choices=chunk_algorithm_versions(),
+        default=CHUNK_ALGORITHM_VERSIONS["spacy"],
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--backend", choices=["openai", "local"], default="openai")
+    args = parser.parse_args()
+
+    batch_embed(
+        args.filings_csv,
+        model=args.embedding_model,
+        dimension=args.embedding_dimension,
+        chunk_algo_version=args.chunk_algo_version,
+        workers=args.workers,
+        backend_name=args.backend,
+    )
@@ -0,0 +1,85 @@
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from edgar_funcs.rag.vectorize.artifact import decode_artifact, encode_artifact
+from edgar_funcs.rag.vectorize.compression import TextBlockCodec, train_dictionary
+from edgar_funcs.rag.vectorize.storage import storage
+from scripts.train_zstd_dictionary import sample_artifacts
+
+load_dotenv()
+
+
+def benchmark(artifacts: list[bytes], codec: TextBlockCodec | None) -> dict:
+    """
+    compress the texts of the artifacts with codec and time loading all texts back
+    """
+    size, texts_size, stored_texts_size, seconds = 0, 0, 0, 0.0
+    for artifact in artifacts:
+        texts, embeddings, scales, norms, metadata = decode_artifact(artifact)
+        encoded = encode_artifact(
+            list(texts), embeddings, scales, metadata, codec, norms=norms
+        )
+        size += len(encoded)
+        texts_size += texts.nbytes
+        stored_texts_size += len(encoded) - len(artifact) + texts.nbytes
+
+        start = time.perf_counter()
+        list(decode_artifact(encoded)[0])
+        seconds += time.perf_counter() - start
+
+    return {
+        "size": size,
+        "texts_ratio": texts_size / stored_texts_size,
+        "throughput": texts_size / seconds / 1e6 if seconds else 0.0,
+        "load_ms": seconds * 1000 / len(artifacts),
+    }
+
+
+def main(storage_base_path: str, path: str, n_filings: int, dictionary: str) -> None:
+    artifacts = sample_artifacts(storage_base_path, path, n_filings)
+    if not artifacts:
+        raise ValueError(f"no chunks found under {path}")
+
+    if dictionary:
+        dict_bytes = storage(storage_base_path).get(dictionary)
+    else:
+        # trained on the filings benchmarked, a dictionary trained on other
+        # filings compresses a little less
+        texts = [text for artifact in artifacts for text in decode_artifact(artifact)[0]]
+        dict_bytes = train_dictionary(texts)
+
+    results = {
+        "uncompressed": benchmark(artifacts, None),
+        "zstd": benchmark(artifacts, TextBlockCodec()),
+        "zstd+dictionary": benchmark(artifacts, TextBlockCodec(dict_bytes)),
+    }
+    base = results["uncompressed"]["size"]
+    print(f"{len(artifacts)} filings, {base / 1e6:.1f} MB uncompressed")
+    print(f"{'':16} {'MB':>8} {'ratio':>6} {'texts':>6} {'MB/s':>8} {'load ms':>8}")
+    for name, r in results.items():
+        print(
+            f"{name:16} {r['size'] / 1e6:8.2f} {base / r['size']:6.2f} "
+            f"{r['texts_ratio']:6.2f} {r['throughput']:8.0f} {r['load_ms']:8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the size and load time of compressed chunk artifacts"
+    )
+    parser.add_argument(
+        "path", help="path under the storage prefix, e.g. chunks/4/text-embedding-005_768"
+    )
+    parser.add_argument("--storage-prefix", default=os.environ.get("STORAGE_PREFIX", ""))
+    parser.add_argument("--filings", type=int, default=50)
+    parser.add_argument(
+        "--dictionary",
+        default="",
+        help="path of a dictionary under the storage prefix, trained on the sample if not given",  # noqa E501
+    )
+    args = parser.parse_args()
+
+    main(args.storage_prefix, args.path, args.filings, args.dictionary)
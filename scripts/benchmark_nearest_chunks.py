@@ -0,0 +1,79 @@
+import argparse
+import time
+
+import numpy as np
+from scipy.spatial.distance import cosine
+
+from edgar_funcs.rag.extract.algo import _cosine_distances, nearest_chunks
+
+
+def nearest_chunks_loop(queries, contents, top_k: int) -> list[dict]:
+    # one scipy cosine distance per query and chunk, all of them sorted
+    distances = [
+        {"query_idx": q, "chunk_num": c, "distance": cosine(queries[q], contents[c])}
+        for c in range(len(contents))
+        for q in range(len(queries))
+    ]
+    distances.sort(key=lambda x: x["distance"])
+    return distances[:top_k]
+
+
+def nearest_chunks_sorted(queries, contents, top_k: int) -> list[dict]:
+    # distance matrix in one product, then a record per pair and a full sort
+    chunk_distances = _cosine_distances(queries, contents)
+    distances = [
+        {"query_idx": q, "chunk_num": c, "distance": float(chunk_distances[q, c])}
+        for c in range(len(contents))
+        for q in range(len(queries))
+    ]
+    distances.sort(key=lambda x: x["distance"])
+    return distances[:top_k]
+
+
+def _time(func, repeat: int) -> float:
+    # best of repeat runs, in milliseconds
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main(chunk_counts: list[int], n_queries: int, dimension: int, top_k: int) -> None:
+    rng = np.random.default_rng(0)
+    queries = rng.normal(size=(n_queries, dimension)).astype(np.float32)
+    print(f"{n_queries} queries, {dimension} dimensions, top {top_k}, best of 3 in ms")
+    print(f"{'chunks':>8} {'loop':>10} {'sorted':>10} {'top-k':>10} {'speedup':>8}")
+    for n_chunks in chunk_counts:
+        contents = rng.normal(size=(n_chunks, dimension)).astype(np.float32)
+        # the scipy loop takes minutes beyond a few thousand chunks
+        loop = (
+            _time(lambda: nearest_chunks_loop(queries, contents, top_k), 1)
+            if n_chunks <= 5000
+            else float("nan")
+        )
+        full_sort = _time(lambda: nearest_chunks_sorted(queries, contents, top_k), 3)
+        top = _time(lambda: nearest_chunks(queries, contents, top_k), 3)
+        print(
+            f"{n_chunks:>8} {loop:>10.2f} {full_sort:>10.2f} {top:>10.2f} "
+            f"{full_sort / top:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the speed of nearest_chunks with a sort of all distances"
+    )
+    parser.add_argument("--chunks", default="100,1000,5000,20000,100000")
+    parser.add_argument("--queries", type=int, default=4)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--top-k", type=int, default=20)
+    args = parser.parse_args()
+
+    main(
+        [int(n) for n in args.chunks.split(",")],
+        args.queries,
+        args.dimension,
+        args.top_k,
+    )
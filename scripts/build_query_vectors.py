@@ -0,0 +1,58 @@
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+# importing the extraction modules registers their query sets
+import edgar_funcs.rag.extract.fundmgr  # noqa: F401
+import edgar_funcs.rag.extract.trustee  # noqa: F401
+from edgar_funcs.rag.extract.query_bank import (
+    QUERY_CHUNK_ALGO_VERSION,
+    QUERY_CIK,
+    QUERY_VECTORS_PATH,
+    parse_query_models,
+    query_bank,
+)
+from edgar_funcs.rag.vectorize import TextChunksWithEmbedding
+
+load_dotenv()
+
+
+def build_query_vectors(models: list[tuple[str, int]], embedding_dtype: str) -> None:
+    """
+    save the vectors of all query sets for each model into the package data,
+    the vectors come from the storage or are embedded if they are not saved yet
+    """
+    bank = query_bank()
+    for model, dimension in models:
+        for name in bank.names():
+            queries = bank.get(name, model, dimension)
+            packaged = TextChunksWithEmbedding(
+                texts=list(queries.texts),
+                embeddings=queries.vectors(),
+                metadata={
+                    "cik": QUERY_CIK,
+                    "accession_number": name,
+                    "chunk_algo_version": QUERY_CHUNK_ALGO_VERSION,
+                    "model": model,
+                    "dimension": dimension,
+                },
+                embedding_dtype=embedding_dtype,
+            )
+            packaged.save(QUERY_VECTORS_PATH)
+            print(f"saved {name} for {model} {dimension}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Save query vectors as package data of edgar_funcs"
+    )
+    parser.add_argument(
+        "models",
+        help="comma separated model:dimension, e.g. text-embedding-3-small:1536",
+    )
+    parser.add_argument("--embedding-dtype", default="float32")
+    args = parser.parse_args()
+
+    build_query_vectors(parse_query_models(args.models), args.embedding_dtype)
@@ -0,0 +1,128 @@
+import argparse
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from edgar_funcs.rag.vectorize import _blob_path, _legacy_chunks
+from edgar_funcs.rag.vectorize.artifact import ARTIFACT_SUFFIX, read_artifact_header
+from edgar_funcs.rag.vectorize.manifest import ChunkManifest, chunk_manifest
+from edgar_funcs.rag.vectorize.pack import PACK_SUFFIX, PackEntryReader, read_pack_index
+from edgar_funcs.rag.vectorize.storage import STORAGE_CONCURRENCY, storage
+
+load_dotenv()
+
+
+def _path_metadata(file_path: str) -> dict | None:
+    # the key of the filings in a file, from its path, either
+    # chunks/<chunk_algo_version>/<model>_<dimension>/<cik>/<accession_number>.chunks
+    # or chunks/<chunk_algo_version>/<model>_<dimension>/<cik>.chunkpack for packs
+    parts = file_path.split("/")
+    if file_path.endswith(PACK_SUFFIX) and len(parts) == 4:
+        parts = [*parts[:3], parts[3].removesuffix(PACK_SUFFIX), ""]
+    elif not file_path.endswith((ARTIFACT_SUFFIX, ".pickle")) or len(parts) != 5:
+        return None
+
+    _, chunk_algo_version, model_dimension, cik, name = parts
+    model, _, dimension = model_dimension.rpartition("_")
+    return {
+        "chunk_algo_version": chunk_algo_version,
+        "model": model,
+        "dimension": int(dimension),
+        "cik": cik,
+        "accession_number": name.rsplit(".", 1)[0],
+    }
+
+
+def _file_rows(storage_base_path: str, file_path: str) -> list[tuple[dict, int, int]]:
+    # return metadata, chunk count and size of the filings saved in a file
+    chunks_storage = storage(storage_base_path)
+    if file_path.endswith(ARTIFACT_SUFFIX):
+        reader = chunks_storage.range_reader(file_path)
+        header = read_artifact_header(reader)
+        metadata = {**header["metadata"], **_path_metadata(file_path)}
+        return [(metadata, header["count"], reader.size)]
+
+    if file_path.endswith(PACK_SUFFIX):
+        reader = chunks_storage.range_reader(file_path)
+        rows = []
+        for accession_number, (offset, length) in read_pack_index(
+            reader, reader.size
+        ).items():
+            header = read_artifact_header(PackEntryReader(reader, offset))
+            metadata = {**header["metadata"], **_path_metadata(file_path)}
+            metadata["accession_number"] = accession_number
+            rows.append((metadata, header["count"], length))
+        return rows
+
+    # legacy pickles are downloaded in full
+    content = chunks_storage.get(file_path)
+    chunks = _legacy_chunks(pickle.loads(content)) if content else None
+    if chunks is None:
+        return []
+    metadata = {**chunks.metadata, **_path_metadata(file_path)}
+    return [(metadata, len(chunks.texts), len(content))]
+
+
+def rebuild_manifest(
+    manifest: ChunkManifest, storage_base_path: str, path: str = "chunks"
+) -> int:
+    """
+    record every filing saved under path in the manifest, reading only the
+    headers of artifacts and packs. filings saved before the manifest existed
+    are recorded with the time of the rebuild as creation time.
+
+    Returns:
+        int: number of distinct filings recorded, a filing saved both on its own
+             and in a pack counts once
+    """
+    files = [
+        file_path
+        for file_path in storage(storage_base_path).list_files(path)
+        if _path_metadata(file_path)
+    ]
+    # a filing saved both as artifact and pickle is recorded from the artifact
+    artifacts = {
+        f.removesuffix(ARTIFACT_SUFFIX) for f in files if f.endswith(ARTIFACT_SUFFIX)
+    }
+    files = [f for f in files if f.removesuffix(".pickle") not in artifacts]
+
+    recorded = set()
+    with ThreadPoolExecutor(max_workers=STORAGE_CONCURRENCY) as executor:
+        for rows in executor.map(lambda f: _file_rows(storage_base_path, f), files):
+            for metadata, n_chunks, size in rows:
+                manifest.record(metadata, n_chunks, size)
+                recorded.add(_blob_path(**metadata))
+    return len(recorded)
+
+
+def print_stats(manifest: ChunkManifest) -> None:
+    for row in manifest.stats():
+        print(
+            f"chunks/{row['chunk_algo_version']}/{row['model']}_{row['dimension']}: "
+            f"{row['filings']} filings of {row['ciks']} CIKs, {row['chunks']} chunks, "
+            f"{row['bytes'] / 1e6:.1f} MB, filed {row['first_filed']} to "
+            f"{row['last_filed']}, last saved {row['last_created']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the coverage of saved chunks, or rebuild the chunk manifest from the storage"  # noqa E501
+    )
+    parser.add_argument("command", choices=["stats", "rebuild"])
+    parser.add_argument("--storage-prefix", default=os.environ.get("STORAGE_PREFIX", ""))
+    parser.add_argument("--path", default="chunks", help="path under the storage prefix")
+    args = parser.parse_args()
+
+    manifest = chunk_manifest()
+    if manifest is None:
+        parser.error("CHUNK_MANIFEST_PATH is not set")
+
+    manifest.pull()
+    if args.command == "rebuild":
+        n = rebuild_manifest(manifest, args.storage_prefix, args.path)
+        print(f"recorded {n} filings")
+        manifest.flush(force=True)
+    print_stats(manifest)
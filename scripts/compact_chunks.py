@@ -0,0 +1,106 @@
+import argparse
+import os
+import pickle
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+from edgar_funcs.rag.vectorize import _legacy_chunks
+from edgar_funcs.rag.vectorize.artifact import ARTIFACT_SUFFIX, encode_artifact
+from edgar_funcs.rag.vectorize.pack import PACK_SUFFIX, update_pack
+from edgar_funcs.rag.vectorize.storage import storage
+
+load_dotenv()
+
+
+def filing_artifact(path: str, content: bytes | None) -> bytes | None:
+    """
+    return the artifact of the content of a per filing file, pickles are converted
+    """
+    if content is None or path.endswith(ARTIFACT_SUFFIX):
+        return content
+
+    chunks = _legacy_chunks(pickle.loads(content))
+    if chunks is None:
+        return None
+    return encode_artifact(
+        chunks.texts,
+        chunks.embeddings,
+        chunks.embedding_scales,
+        chunks.metadata,
+        norms=chunks.embedding_norms,
+    )
+
+
+def compact_chunks(storage_base_path: str, path: str, delete: bool = False) -> int:
+    """
+    pack the per filing chunks under path into one pack per CIK
+
+    path is a directory of one chunk version and model, e.g.
+    chunks/4/text-embedding-3-small_1536, with one directory per CIK. filings
+    saved both as artifact and pickle are packed from the artifact. filings
+    already in the pack of their CIK are replaced. packs are rewritten with only
+    the filings in their index, which drops the artifacts replaced by saves.
+
+    Returns:
+        int: number of filings packed
+    """
+    chunks_storage = storage(storage_base_path)
+    # files of each filing by CIK directory, artifacts sort before pickles
+    filings = defaultdict(lambda: defaultdict(list))
+    for file_path in chunks_storage.list_files(path):
+        if file_path.endswith(PACK_SUFFIX):
+            # packs without new files are rewritten too
+            filings.setdefault(file_path.removesuffix(PACK_SUFFIX), defaultdict(list))
+            continue
+        cik_dir, name = file_path.rsplit("/", 1)
+        for suffix in (ARTIFACT_SUFFIX, ".pickle"):
+            if name.endswith(suffix):
+                filings[cik_dir][name.removesuffix(suffix)].append(file_path)
+
+    n_packed = 0
+    for cik_dir, files in sorted(filings.items()):
+        # the files of the CIK are downloaded in parallel
+        pack_path = cik_dir + PACK_SUFFIX
+        paths = {
+            accession_number: file_paths[0]
+            for accession_number, file_paths in files.items()
+        }
+        contents = chunks_storage.get_many(list(paths.values()))
+
+        artifacts = {}
+        for accession_number, file_path in sorted(paths.items()):
+            artifact = filing_artifact(file_path, contents[file_path])
+            if artifact is None:
+                print(f"skipping {file_path}, not a chunks file")
+                continue
+            artifacts[accession_number] = artifact
+
+        # the pack is only replaced if no other compaction or save wrote it since
+        # it was read, the files are only deleted once they are in the pack
+        update_pack(chunks_storage, pack_path, artifacts, compact=True)
+        n_packed += len(artifacts)
+        print(f"packed {len(artifacts)} filings into {pack_path}")
+
+        if delete:
+            packed = [file for number in artifacts for file in files[number]]
+            chunks_storage.delete_many(packed)
+
+    return n_packed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack the chunks of each CIK into one file, load them with CHUNK_PACKS=1"  # noqa E501
+    )
+    parser.add_argument(
+        "path", help="path under the storage prefix, e.g. chunks/4/text-embedding-005_768"
+    )
+    parser.add_argument("--storage-prefix", default=os.environ.get("STORAGE_PREFIX", ""))
+    parser.add_argument(
+        "--delete", action="store_true", help="delete the per filing files once packed"
+    )
+    args = parser.parse_args()
+
+    n = compact_chunks(args.storage_prefix, args.path, delete=args.delete)
+    print(f"packed {n} filings")
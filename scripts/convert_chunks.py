@@ -0,0 +1,88 @@
+import argparse
+import os
+import pickle
+
+from dotenv import load_dotenv
+
+from edgar_funcs.rag.vectorize import _legacy_chunks
+from edgar_funcs.rag.vectorize.artifact import ARTIFACT_SUFFIX, encode_artifact
+from edgar_funcs.rag.vectorize.quantize import EMBEDDING_DTYPES
+from edgar_funcs.rag.vectorize.storage import storage
+
+load_dotenv()
+
+# pickles downloaded and converted at once
+CONVERT_BATCH_SIZE = 64
+
+
+def convert_chunks(
+    storage_base_path: str,
+    path: str,
+    embedding_dtype: str | None = None,
+    delete: bool = False,
+) -> int:
+    """
+    convert pickled chunks to the columnar artifact format, next to the pickles
+
+    Args:
+        embedding_dtype: store the embeddings in this dtype, keeps the dtype
+                         of the pickle by default, which is float64 for lists of floats
+        delete: delete the pickles after conversion
+    """
+    chunks_storage = storage(storage_base_path)
+    pickle_paths = [p for p in chunks_storage.list_files(path) if p.endswith(".pickle")]
+
+    n_converted = 0
+    for i in range(0, len(pickle_paths), CONVERT_BATCH_SIZE):
+        # each batch is downloaded and uploaded in parallel
+        contents = chunks_storage.get_many(pickle_paths[i : i + CONVERT_BATCH_SIZE])
+        artifacts = {}
+        for pickle_path, content in contents.items():
+            chunks = _legacy_chunks(pickle.loads(content)) if content else None
+            if chunks is None:
+                print(f"skipping {pickle_path}, not a chunks pickle")
+                continue
+            if embedding_dtype:
+                chunks.set_embeddings(chunks.vectors(), embedding_dtype=embedding_dtype)
+
+            artifact_path = pickle_path.removesuffix(".pickle") + ARTIFACT_SUFFIX
+            artifacts[artifact_path] = encode_artifact(
+                chunks.texts,
+                chunks.embeddings,
+                chunks.embedding_scales,
+                chunks.metadata,
+                norms=chunks.embedding_norms,
+            )
+            print(f"converted {pickle_path}")
+
+        chunks_storage.put_many(artifacts)
+        n_converted += len(artifacts)
+        if delete:
+            chunks_storage.delete_many(
+                [p.removesuffix(ARTIFACT_SUFFIX) + ".pickle" for p in artifacts]
+            )
+
+    return n_converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert pickled chunks to the columnar artifact format"
+    )
+    parser.add_argument(
+        "path", nargs="?", default="chunks", help="path under the storage prefix"
+    )
+    parser.add_argument("--storage-prefix", default=os.environ.get("STORAGE_PREFIX", ""))
+    parser.add_argument("--embedding-dtype", choices=EMBEDDING_DTYPES, default=None)
+    parser.add_argument(
+        "--delete", action="store_true", help="delete the pickles once converted"
+    )
+    args = parser.parse_args()
+
+    n = convert_chunks(
+        args.storage_prefix,
+        args.path,
+        embedding_dtype=args.embedding_dtype,
+        delete=args.delete,
+    )
+    print(f"converted {n} chunks")
@@ -1,46 +1,46 @@
 import json
+import os
 import sys
 from datetime import datetime, timezone
 
 from dotenv import load_dotenv
-from google.api_core.exceptions import NotFound
-from google.cloud import storage
 
-from edgar_funcs.rag.vectorize import _storage_prefix
+from edgar_funcs.rag.vectorize.storage import storage
 
 load_dotenv()
 
 
-def find_locks(bucket_name: str, path: str, force_delete: bool = False):
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blobs = bucket.list_blobs(prefix=path)
-
-    for blob in blobs:
-        if blob.name.endswith("_lock.json"):
-            try:
-                content = json.loads(blob.download_as_text())
-                expired_at = datetime.fromisoformat(content["expires_at"])
-                now = datetime.now(timezone.utc)
-
-                if expired_at < now:
-                    print(f"Deleting expired lock: {blob.name}")
-                    blob.delete()
-                elif force_delete:
-                    print(f"Force deleting lock: {blob.name}")
-                    blob.delete()
-                else:
-                    print(f"Lock not expired: {blob.name}, expires at {expired_at}")
-            except KeyError:
-                print(f"Invalid lock file format: {blob.name}")
-            except NotFound:
-                pass
+def find_locks(storage_base_path: str, path: str = "", force_delete: bool = False):
+    lock_storage = storage(storage_base_path)
+    lock_paths = [p for p in lock_storage.list_files(path) if p.endswith("_lock.json")]
+    expired = []
+
+    for lock_path, content in lock_storage.get_many(lock_paths).items():
+        if content is None:
+            # deleted since it was listed
+            continue
+        try:
+            expired_at = datetime.fromisoformat(json.loads(content)["expires_at"])
+            now = datetime.now(timezone.utc)
+
+            if expired_at < now:
+                print(f"Deleting expired lock: {lock_path}")
+                expired.append(lock_path)
+            elif force_delete:
+                print(f"Force deleting lock: {lock_path}")
+                expired.append(lock_path)
+            else:
+                print(f"Lock not expired: {lock_path}, expires at {expired_at}")
+        except KeyError:
+            print(f"Invalid lock file format: {lock_path}")
+
+    lock_storage.delete_many(expired)
 
 
 if __name__ == "__main__":
     force_delete = len(sys.argv) > 1 and sys.argv[1] == "-d"
-    bucket_name, path = _storage_prefix("gs://edgar_666/edgar-funcs")
-    if bucket_name:
-        find_locks(bucket_name, path)
+    storage_base_path = os.environ.get("STORAGE_PREFIX", "")
+    if storage_base_path and storage(storage_base_path).remote:
+        find_locks(storage_base_path, force_delete=force_delete)
     else:
-        print("STORAGE_PREFIX is not set to GCS")
+        print("STORAGE_PREFIX is not set to GCS or S3")
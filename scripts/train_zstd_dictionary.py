@@ -0,0 +1,88 @@
+import argparse
+import os
+import random
+
+from dotenv import load_dotenv
+
+from edgar_funcs.rag.vectorize.artifact import ARTIFACT_SUFFIX, decode_artifact
+from edgar_funcs.rag.vectorize.compression import (
+    ZSTD_DICTIONARY_PATH,
+    ZSTD_DICTIONARY_SIZE,
+    dictionary_id,
+    train_dictionary,
+)
+from edgar_funcs.rag.vectorize.storage import storage
+from scripts.compact_chunks import filing_artifact
+
+load_dotenv()
+
+
+def sample_texts(storage_base_path: str, path: str, n_filings: int) -> list[str]:
+    """
+    return the chunk texts of a random sample of the filings saved under path
+    """
+    return [
+        text
+        for artifact in sample_artifacts(storage_base_path, path, n_filings)
+        for text in decode_artifact(artifact)[0]
+    ]
+
+
+def sample_artifacts(storage_base_path: str, path: str, n_filings: int) -> list[bytes]:
+    """
+    return the artifacts of a random sample of the filings saved under path,
+    downloaded in parallel
+    """
+    chunks_storage = storage(storage_base_path)
+    files = [
+        file_path
+        for file_path in chunks_storage.list_files(path)
+        if file_path.endswith((ARTIFACT_SUFFIX, ".pickle"))
+    ]
+    sample = random.sample(files, min(n_filings, len(files)))
+    contents = chunks_storage.get_many(sample)
+    artifacts = [filing_artifact(file_path, contents[file_path]) for file_path in sample]
+    return [artifact for artifact in artifacts if artifact is not None]
+
+
+def train_zstd_dictionary(
+    storage_base_path: str,
+    path: str,
+    n_filings: int = 200,
+    size: int = ZSTD_DICTIONARY_SIZE,
+) -> str:
+    """
+    train a dictionary on the chunks of a sample of filings and save it to the
+    storage, chunks are compressed with it when CHUNK_COMPRESSION=zstd and
+    CHUNK_ZSTD_DICTIONARY is set to the returned id
+
+    Returns:
+        str: id of the dictionary
+    """
+    texts = sample_texts(storage_base_path, path, n_filings)
+    if not texts:
+        raise ValueError(f"no chunks found under {path}")
+
+    dictionary = train_dictionary(texts, size)
+    dict_id = dictionary_id(dictionary)
+    storage(storage_base_path).put(f"{ZSTD_DICTIONARY_PATH}/{dict_id}.dict", dictionary)
+    print(f"trained {len(dictionary)} bytes dictionary on {len(texts)} chunks")
+    return dict_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train a zstd dictionary for compressing the texts of chunks"
+    )
+    parser.add_argument(
+        "path", help="path under the storage prefix, e.g. chunks/4/text-embedding-005_768"
+    )
+    parser.add_argument("--storage-prefix", default=os.environ.get("STORAGE_PREFIX", ""))
+    parser.add_argument("--filings", type=int, default=200)
+    parser.add_argument("--size", type=int, default=ZSTD_DICTIONARY_SIZE)
+    args = parser.parse_args()
+
+    dict_id = train_zstd_dictionary(
+        args.storage_prefix, args.path, n_filings=args.filings, size=args.size
+    )
+    print(f"CHUNK_ZSTD_DICTIONARY={dict_id}")
@@ -1,15 +1,21 @@
 import os
+import re
+from types import SimpleNamespace
 from unittest.mock import patch
 
 import pytest
 
 from edgar_funcs.edgar import SECFiling
-from edgar_funcs.rag.vectorize import TextChunksWithEmbedding
+from edgar_funcs.rag.vectorize import TextChunksWithEmbedding, chunk_filings
 from edgar_funcs.rag.vectorize.chunking import (
+    SentenceCache,
     _is_line_empty,
     chunk_text,
+    chunking_method,
+    mark_text_headings,
     trim_html_content,
 )
+from edgar_funcs.rag.vectorize.sections import build_section_index, lookup_section
 from tests.utils import mock_file_content
 
 if "CLOUD_BUILD" in os.environ or "BUILDER_OUTPUT" in os.environ:
@@ -77,6 +83,127 @@ def test_chunk_filing_with_difficult_table(mock_edgar_file):
     assert "Emilie D. Wrapp" in chunk_of_table
 
 
+@patch("edgar_funcs.edgar.edgar_file")
+def test_chunk_filings_with_workers(mock_edgar_file):
+    mock_edgar_file.side_effect = mock_file_content
+    filings = [
+        SECFiling(cik="1002427", accession_number="0001133228-24-004879"),
+        SECFiling(
+            cik="1201932",
+            accession_number="0000950136-04-001365",
+            prefer_index_headers=False,
+        ),
+    ]
+
+    results = chunk_filings(filings, workers=2)
+
+    assert [result["accession_number"] for result in results] == [
+        "0001133228-24-004879",
+        "0000950136-04-001365",
+    ]
+    assert [len(result["chunks"]) for result in results] == [992, 379]
+    assert all(result["elapsed"] > 0 for result in results)
+    assert all(
+        len(result["metadata"]["token_counts"]) == len(result["chunks"])
+        for result in results
+    )
+
+
+@patch("edgar_funcs.edgar.edgar_file")
+def test_chunk_filing_by_section(mock_edgar_file):
+    mock_edgar_file.side_effect = mock_file_content
+    filing = SECFiling(cik="1274676", accession_number="0000919574-24-004904")
+    _, filing_content = filing.get_doc_content("485BPOS", file_types=["htm", "txt"])[0]
+
+    trimmed_html = trim_html_content(filing_content, mark_headings=True)
+    metadata = {}
+    chunks = chunk_text(trimmed_html, method="section", metadata=metadata)
+
+    # far fewer chunks than the 715 chunks produced by spacy
+    assert len(chunks) < 400
+    assert len(metadata["section_paths"]) == len(chunks)
+    assert len(metadata["token_counts"]) == len(chunks)
+
+    chunk_num = [i for i, chunk in enumerate(chunks) if "2,691" in chunk][0]
+    assert "Name of Trustee |  Aggregate Compensation" in chunks[chunk_num]
+    assert "Emilie D. Wrapp" in chunks[chunk_num]
+    assert metadata["section_paths"][chunk_num].startswith("AB CORPORATE SHARES")
+
+
+def test_chunk_text_by_section():
+    content = mark_text_headings(
+        "\n".join(
+            [
+                "MANAGEMENT OF THE FUND",
+                "",
+                "The Board of Trustees oversees the management of the Fund. " * 3,
+                "",
+                "COMPENSATION",
+                "",
+                "Name |  Aggregate Compensation |  Total Compensation",
+                "---|---|---",
+            ]
+            + [f"Trustee {i} |  ${i},000 |  ${i}00,000" for i in range(1, 21)]
+            + [
+                "",
+                "# | this footnote is not a heading",
+            ]
+        )
+    )
+    metadata = {}
+    chunks = chunk_text(content, chunk_size=500, method="section", metadata=metadata)
+
+    assert len(chunks) == 3
+    assert chunks[0].startswith("# MANAGEMENT OF THE FUND")
+    # the table is split by rows, each piece repeats the table header
+    assert chunks[1].startswith("# COMPENSATION\n\nName |  Aggregate Compensation")
+    assert chunks[2].startswith("Name |  Aggregate Compensation")
+    assert "this footnote is not a heading" in chunks[2]
+    assert metadata["section_paths"] == [
+        "MANAGEMENT OF THE FUND",
+        "COMPENSATION",
+        "COMPENSATION",
+    ]
+
+
+def test_chunk_text_by_section_headings():
+    rows = [f"Trustee {i} |  ${i},000 |  ${i}00,000" for i in range(1, 40)]
+    content = mark_text_headings(
+        "\n".join(
+            [
+                "MANAGEMENT OF THE FUND AND ITS BOARD OF TRUSTEES",
+                "",
+                "COMPENSATION OF THE TRUSTEES",
+                "",
+                "Name |  Aggregate Compensation |  Total Compensation",
+                "---|---|---",
+            ]
+            + rows
+            + [
+                "",
+                "The Fund does not pay retirement benefits to the Trustees.",
+                "",
+                "APPENDIX A",
+            ]
+        )
+    )
+    chunks = chunk_text(content, chunk_size=500, method="section")
+
+    # the headings are counted in the size of the chunk they are prepended to
+    assert chunks[0].startswith("# MANAGEMENT OF THE FUND AND ITS BOARD OF TRUSTEES")
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    # a heading at the end of the text is kept
+    assert chunks[-1].endswith("# APPENDIX A")
+
+
+def test_chunking_method():
+    assert chunking_method("4") == ("spacy", "char")
+    assert chunking_method("s1") == ("section", "char")
+    assert chunking_method("4t") == ("spacy", "token")
+    assert chunking_method("s1t") == ("section", "token")
+    assert chunking_method("3") == ("spacy", "char")
+
+
 def test_is_line_empty():
     assert _is_line_empty("   ")
     assert _is_line_empty(" -83-")
@@ -84,6 +211,68 @@ def test_is_line_empty():
     assert not _is_line_empty(" word ")
 
 
+def test_sentence_cache(tmp_path):
+    nlp = _FakeNLP()
+    cache = SentenceCache(maxsize=2, model="fake")
+
+    line = "The Fund may invest in bonds. It may also buy stocks."
+    assert cache.split(line, nlp) == [
+        "The Fund may invest in bonds.",
+        "It may also buy stocks.",
+    ]
+    assert cache.split(line, nlp) == [
+        "The Fund may invest in bonds.",
+        "It may also buy stocks.",
+    ]
+    assert nlp.calls == 1 and cache.hits == 1 and cache.misses == 1
+
+    # least recently used line is evicted
+    cache.split("Second line.", nlp)
+    cache.split("Third line.", nlp)
+    assert len(cache) == 2
+    cache.split(line, nlp)
+    assert nlp.calls == 4
+
+    cache_path = str(tmp_path / "sentences.json")
+    cache.save(cache_path)
+
+    restored = SentenceCache(model="fake")
+    restored.load(cache_path)
+    assert len(restored) == 2
+    restored.split(line, nlp)
+    assert nlp.calls == 4 and restored.hit_rate() == 1.0
+
+    # entries created by a different model are not used
+    other_model = SentenceCache(model="other")
+    other_model.load(cache_path)
+    assert len(other_model) == 0
+
+    # only the saved cache is left in the directory
+    assert os.listdir(tmp_path) == ["sentences.json"]
+
+    # a truncated cache is treated as empty
+    with open(cache_path, "w") as f:
+        f.write('{"model": "fake", "entries": {"')
+    truncated = SentenceCache(model="fake")
+    truncated.load(cache_path)
+    assert len(truncated) == 0
+
+
+class _FakeNLP:
+    """split sentences on period, just enough for testing SentenceCache"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text: str):
+        self.calls += 1
+        sents, start = [], 0
+        for match in re.finditer(r"\.(\s+|$)", text):
+            sents.append(SimpleNamespace(start_char=start, end_char=match.start() + 1))
+            start = match.end()
+        return SimpleNamespace(sents=sents)
+
+
 def _save_chunks_mockdata(filing: SECFiling, text_chunks: list[str]):
     metadata = {
         "cik": filing.cik,
@@ -94,3 +283,28 @@ def _save_chunks_mockdata(filing: SECFiling, text_chunks: list[str]):
     new_chunks = TextChunksWithEmbedding(text_chunks, metadata=metadata)
     new_chunks.get_embeddings(model=embedding_model, dimension=embedding_dimension)
     new_chunks.save()
+
+
+def test_section_index():
+    chunks = [
+        "MANAGEMENT OF THE FUND\n\nThe Board oversees the Fund.",
+        "(c) Compensation1\n\nName | Aggregate Compensation from the Fund",
+        "Jane Doe | $1,000\nJohn Roe | $2,000",
+        "Securities Ownership of Portfolio Managers\n\nThe dollar range of ...",
+        "Other text that is not a heading.",
+    ]
+    section_index = build_section_index(chunks)
+
+    assert section_index["headings"]["compensation"] == [[1, 2]]
+    assert section_index["keywords"]["aggregate compensation"] == [1]
+    assert lookup_section(section_index, [r"^compensation$"], ["dollar range"]) == []
+    assert lookup_section(
+        section_index, [r"^compensation$"], ["aggregate compensation"]
+    ) == [1, 2]
+    assert (
+        lookup_section(
+            section_index, [r"portfolio managers?"], ["dollar range"], max_chunks=1
+        )
+        == []
+    )
+    assert lookup_section(None, [r"^compensation$"]) == []
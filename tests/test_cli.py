@@ -6,6 +6,7 @@ import pytest
 
 from cli import main
 from edgar_funcs.edgar import load_filing_catalog
+from edgar_funcs.rag.vectorize.manifest import ChunkManifest
 
 if "CLOUD_BUILD" in os.environ or "BUILDER_OUTPUT" in os.environ:
     pytest.skip("CLI tests should not run in Cloud Build", allow_module_level=True)
@@ -75,6 +76,31 @@ def test_fundmgr_list(mock_publish_request, monkeypatch):
         assert call_args[0][0][0]["action"] == "fundmgr"
 
 
+@patch("cli._publish_messages")
+def test_chunk_list_skip_chunked(mock_publish_request, monkeypatch, tmp_path):
+    manifest = ChunkManifest(str(tmp_path / "manifest.db"))
+    metadata = {
+        "cik": "1103243",
+        "accession_number": "0001413042-24-000114",
+        "chunk_algo_version": "4",
+        "model": "text-embedding-3-small",
+        "dimension": 1536,
+    }
+    manifest.record(metadata, n_chunks=100, size=1000)
+    manifest.record({**metadata, "dimension": 512}, n_chunks=100, size=1000)
+    monkeypatch.setattr("cli.chunk_manifest", lambda: manifest)
+    monkeypatch.setattr(
+        "sys.argv",
+        shlex.split(
+            "cli.py chunk tests/mockdata/cli/filing_list.csv --chunk-algo-version 4 --skip-chunked"  # noqa E501
+        ),
+    )
+    main()
+    messages = mock_publish_request.call_args[0][0]
+    assert len(messages) == 3
+    assert "0001413042-24-000114" not in [m["accession_number"] for m in messages]
+
+
 @patch("cli._publish_messages")
 def test_invalid_accession_number(mock_publish_request, monkeypatch):
     monkeypatch.setattr(
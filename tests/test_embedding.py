@@ -1,14 +1,71 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import patch
 
+import numpy as np
 import pytest
+from google.api_core.exceptions import NotFound
+from rank_bm25 import BM25Okapi
+from scipy.spatial.distance import cosine
 
+import edgar_funcs.rag.vectorize
 from edgar_funcs.edgar import SECFiling
+from edgar_funcs.rag.extract.algo import (
+    filter_chunks_with_keywords,
+    gather_chunk_distances,
+    nearest_chunks,
+    relevance_by_appearance,
+    top_adjacent_chunks,
+)
+from edgar_funcs.rag.extract.fundmgr import FUNDMGR_OWNERSHIP_KEYWORDS
 from edgar_funcs.rag.vectorize import (
     TextChunksWithEmbedding,
-    _storage_prefix,
+    _blob_path,
+    compression,
+)
+from edgar_funcs.rag.vectorize.artifact import (
+    ArtifactChangedError,
+    GCSRangeReader,
+    LocalRangeReader,
+    RangeReadChunkTexts,
+    decode_artifact,
+    encode_artifact,
+    read_artifact,
 )
+from edgar_funcs.rag.vectorize.artifact_cache import ArtifactCache, load_chunks
+from edgar_funcs.rag.vectorize.batch_job import (
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+    run_embedding_job,
+    write_embedding_job,
+)
+from edgar_funcs.rag.vectorize.batcher import EmbeddingBatcher
 from edgar_funcs.rag.vectorize.chunking import CHUNK_ALORITHM_VERSION
-from tests.utils import mock_file_content, mock_json_dict
+from edgar_funcs.rag.vectorize.compression import dictionary_id, train_dictionary
+from edgar_funcs.rag.vectorize.embedding import (
+    _plan_batches,
+    _plan_utilization,
+    batch_embedding,
+    request_limits,
+)
+from edgar_funcs.rag.vectorize.embedding_cache import EmbeddingCache, embedding_cache
+from edgar_funcs.rag.vectorize.keyword_index import preprocess_text
+from edgar_funcs.rag.vectorize.local_embedding import model_path_name
+from edgar_funcs.rag.vectorize.manifest import ChunkManifest
+from edgar_funcs.rag.vectorize.pack import decode_pack_index, unused_bytes, update_pack
+from edgar_funcs.rag.vectorize.quantize import dequantize, quantize
+from edgar_funcs.rag.vectorize.storage import storage
+from scripts.chunk_manifest import rebuild_manifest
+from scripts.compact_chunks import compact_chunks
+from scripts.convert_chunks import convert_chunks
+from tests.utils import FakeEncoding, mock_file_content, mock_json_dict
 
 embedding_model, embedding_dimension = "vertex_ai/text-embedding-005", 768
 
@@ -41,7 +98,7 @@ def test_one_filing_chunk_save_load(mock_batch_embedding, mock_edgar_file):
         },
     )
     chunks.get_embeddings(model=embedding_model, dimension=embedding_dimension)
-    assert chunks.is_ready() and chunks.save() is None
+    assert chunks.is_ready() and chunks.save()
 
     restored_chunks = TextChunksWithEmbedding.load(
         cik="1002427",
@@ -52,7 +109,7 @@ def test_one_filing_chunk_save_load(mock_batch_embedding, mock_edgar_file):
     )
     assert restored_chunks and restored_chunks.is_ready()
     assert chunks.texts == restored_chunks.texts
-    assert chunks.embeddings == restored_chunks.embeddings
+    assert np.array_equal(chunks.embeddings, restored_chunks.embeddings)
 
 
 def test_load_non_existent_chunks():
@@ -66,9 +123,1028 @@ def test_load_non_existent_chunks():
         )
 
 
-def test_storage_prefix():
-    assert _storage_prefix("gs://bucket/prefix") == ("bucket", "prefix")
-    assert _storage_prefix("gs://bucket") == ("bucket", "")
-    bucket_name, prefix = _storage_prefix("tmp")
-    assert bucket_name is None
-    assert prefix.endswith("tmp")
+def test_default_metadata_not_shared():
+    float32_chunks = TextChunksWithEmbedding(
+        ["a"], [[1.0, 0.0]], embedding_dtype="float32"
+    )
+    int8_chunks = TextChunksWithEmbedding(["b"], [[0.0, 1.0]], embedding_dtype="int8")
+    assert float32_chunks.metadata is not int8_chunks.metadata
+    assert float32_chunks.metadata.get("embedding_dtype") == "float32"
+    assert int8_chunks.metadata.get("embedding_dtype") == "int8"
+
+
+@patch("edgar_funcs.rag.vectorize.embedding._call_embedding_api")
+@patch("edgar_funcs.rag.vectorize.embedding.tiktoken_encoding")
+def test_batch_embedding_reuse_token_counts(mock_encoding, mock_call_embedding_api):
+    encoding = FakeEncoding()
+    mock_encoding.return_value = encoding
+    mock_call_embedding_api.side_effect = lambda content, **_: [
+        [float(len(text))] for text in content
+    ]
+
+    chunks = ["word " * 4000, "word " * 4000, "word " * 300]
+    with patch.object(
+        encoding, "encode_ordinary_batch", wraps=encoding.encode_ordinary_batch
+    ) as mock_encode_batch:
+        embeddings = batch_embedding(
+            chunks,
+            model="text-embedding-3-small",
+            dimension=1,
+            token_counts=[4000, 4000, 300],
+            concurrency=1,
+        )
+        mock_encode_batch.assert_not_called()
+
+    assert len(embeddings) == 3
+    # 2 requests, the first 2 chunks fill up the 8191 token limit
+    assert mock_call_embedding_api.call_count == 2
+    calls = mock_call_embedding_api.call_args_list
+    batch_sizes = [len(c.kwargs["content"]) for c in calls]
+    assert batch_sizes == [2, 1]
+
+
+@patch("edgar_funcs.rag.vectorize.embedding._call_embedding_api")
+@patch("edgar_funcs.rag.vectorize.embedding.tiktoken_encoding")
+def test_batch_embedding_vertex_limits(mock_encoding, mock_call_embedding_api):
+    mock_encoding.return_value = FakeEncoding()
+    mock_call_embedding_api.side_effect = lambda content, **_: [
+        [float(len(text))] for text in content
+    ]
+    assert request_limits("vertex_ai/text-embedding-005") == (10000, 200)
+
+    # vertex takes at most 200 chunks and 10000 tokens in a request
+    embeddings = batch_embedding(
+        ["word"] * 250 + ["word " * 6000] * 2,
+        model="vertex_ai/text-embedding-005",
+        dimension=1,
+        concurrency=1,
+    )
+    assert len(embeddings) == 252
+    batches = [c.kwargs["content"] for c in mock_call_embedding_api.call_args_list]
+    assert sorted(len(batch) for batch in batches) == [52, 200]
+    assert all(sum(len(text.split()) for text in batch) <= 10000 for batch in batches)
+
+
+@patch("edgar_funcs.rag.vectorize.embedding._call_embedding_api")
+@patch("edgar_funcs.rag.vectorize.embedding.tiktoken_encoding")
+def test_batch_embedding_concurrent(mock_encoding, mock_call_embedding_api):
+    mock_encoding.return_value = FakeEncoding()
+    in_flight, max_in_flight = 0, 0
+    lock = threading.Lock()
+
+    def slow_embedding_api(content, **_):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.1)
+        with lock:
+            in_flight -= 1
+        return [[float(text.split()[0])] for text in content]
+
+    mock_call_embedding_api.side_effect = slow_embedding_api
+
+    # each chunk fills up a request by itself
+    chunks = [f"{i} " + "word " * 5000 for i in range(8)]
+    start_t = time.monotonic()
+    embeddings = batch_embedding(
+        chunks, model="text-embedding-3-small", dimension=1, concurrency=4
+    )
+    elapsed = time.monotonic() - start_t
+
+    assert mock_call_embedding_api.call_count == 8
+    # results are in the order of the chunks
+    assert embeddings == [[float(i)] for i in range(8)]
+    assert max_in_flight == 4
+    assert elapsed < 0.6
+
+
+@patch("edgar_funcs.rag.vectorize.embedding.embedding_cache")
+@patch("edgar_funcs.rag.vectorize.embedding._call_embedding_api")
+@patch("edgar_funcs.rag.vectorize.embedding.tiktoken_encoding")
+def test_batch_embedding_with_cache(
+    mock_encoding, mock_call_embedding_api, mock_embedding_cache, tmp_path
+):
+    mock_encoding.return_value = FakeEncoding()
+    mock_call_embedding_api.side_effect = lambda content, **_: [
+        [float(len(text)), 0.1] for text in content
+    ]
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    mock_embedding_cache.return_value = cache
+
+    first = batch_embedding(["a b", "c d e"], model="text-embedding-3-small", dimension=2)
+    assert cache.stats()["entries"] == 2 and cache.misses == 2
+
+    # only the new chunk is sent to the API
+    mock_call_embedding_api.reset_mock()
+    second = batch_embedding(
+        ["c d e", "f", "a b"], model="text-embedding-3-small", dimension=2
+    )
+    assert mock_call_embedding_api.call_count == 1
+    assert mock_call_embedding_api.call_args.kwargs["content"] == ["f"]
+    assert second == [first[1], [1.0, 0.1], first[0]]
+    assert cache.hits == 2 and cache.hit_rate() == 0.4
+
+    # another dimension is another cache key
+    mock_call_embedding_api.reset_mock()
+    batch_embedding(["a b"], model="text-embedding-3-small", dimension=3)
+    assert mock_call_embedding_api.call_count == 1
+
+
+def test_embedding_cache_eviction(tmp_path):
+    # each embedding of 4 floats takes 32 bytes
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"), max_bytes=100)
+    for i in range(3):
+        cache.put_many("m", 4, "t", [f"text {i}"], [[float(i)] * 4])
+    assert cache.size() == 96
+
+    # text 0 is used, text 1 becomes the least recently used
+    assert cache.get_many("m", 4, "t", ["text 0"]) == [[0.0] * 4]
+    cache.put_many("m", 4, "t", ["text 3"], [[3.0] * 4])
+
+    assert cache.size() <= 90
+    assert cache.get_many("m", 4, "t", ["text 1"]) == [None]
+    assert cache.get_many("m", 4, "t", ["text 3"]) == [[3.0] * 4]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_embedding_cache_shared(tmp_path):
+    cache_path = str(tmp_path / "embeddings.sqlite")
+    with (
+        patch.dict(os.environ, {"EMBEDDING_CACHE_PATH": cache_path}),
+        patch("edgar_funcs.rag.vectorize.embedding_cache._embedding_cache", None),
+    ):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            caches = list(executor.map(lambda _: embedding_cache(), range(16)))
+        assert caches[0] is not None and all(c is caches[0] for c in caches)
+        caches[0].close()
+
+
+def test_plan_batches():
+    token_counts = [3000, 6000, 2000, 5000]
+    # filling the requests in chunk order takes 3 requests
+    batches = _plan_batches(token_counts, max_tokens=8191, max_chunks=100)
+    assert batches == [[0, 3], [1, 2]]
+    assert _plan_utilization(batches, token_counts, 8191) == 16000 / (2 * 8191)
+
+    # the chunk limit is respected too
+    batches = _plan_batches([10] * 5, max_tokens=8191, max_chunks=2)
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+@patch("edgar_funcs.rag.vectorize.batcher.batch_embedding")
+def test_embedding_batcher(mock_batch_embedding):
+    mock_batch_embedding.side_effect = lambda chunks, **_: [
+        [float(chunk)] for chunk in chunks
+    ]
+    batcher = EmbeddingBatcher(max_wait=0.2)
+
+    # 3 filings submitted at the same time share one call to batch_embedding
+    futures = [
+        batcher.submit(
+            [str(i), str(i + 0.5)],
+            model="text-embedding-3-small",
+            dimension=1,
+            token_counts=[1, 1],
+        )
+        for i in range(3)
+    ]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert results == [[[float(i)], [i + 0.5]] for i in range(3)]
+    assert mock_batch_embedding.call_count == 1
+    assert mock_batch_embedding.call_args.kwargs["token_counts"] == [1] * 6
+
+    # a submission that fills up a request is sent without waiting
+    start_t = time.monotonic()
+    future = batcher.submit(
+        ["7"], model="text-embedding-3-small", dimension=1, token_counts=[8191]
+    )
+    assert future.result(timeout=5) == [[7.0]]
+    assert time.monotonic() - start_t < 0.2
+
+    batcher.close()
+    assert batcher.stats()["flushes"] == 2
+
+
+def test_local_hashing_embedding():
+    chunks = [
+        "The Trustees received aggregate compensation from the Fund.",
+        "The portfolio managers owned shares of the Fund in the dollar range shown.",
+        "The Fund may invest in foreign securities and emerging markets.",
+    ]
+    embeddings = batch_embedding(chunks, model="local/hashing", dimension=256)
+    assert len(embeddings) == 3 and all(len(e) == 256 for e in embeddings)
+    # deterministic across calls
+    assert embeddings == batch_embedding(chunks, model="local/hashing", dimension=256)
+
+    query = batch_embedding(
+        ["dollar range of fund shares owned by portfolio managers"],
+        model="local/hashing",
+        dimension=256,
+        task_type="RETRIEVAL_QUERY",
+    )
+    result = nearest_chunks(query, embeddings, top_k=1)
+    assert result[0]["chunk_num"] == 1
+
+
+def test_local_model_paths():
+    key = {
+        "cik": "1",
+        "accession_number": "2",
+        "dimension": 384,
+        "chunk_algo_version": "4",
+    }
+    paths = {
+        _blob_path(model=model, **key)
+        for model in [
+            "local/sentence-transformers/all-MiniLM-L6-v2",
+            "local/sentence-transformers/all-mpnet-base-v2",
+            "text-embedding-3-small",
+        ]
+    }
+    assert len(paths) == 3
+    assert "chunks/4/sentence-transformers--all-MiniLM-L6-v2_384/1/2.pickle" in paths
+    assert model_path_name("local/hashing") == "hashing"
+    assert model_path_name("vertex_ai/text-embedding-005") == "text-embedding-005"
+
+
+def _nearest_chunks_loop(queries, contents, top_k, filtered_chunk_nums=[]):
+    # one cosine distance per query and chunk, all of them sorted
+    distances = [
+        {"query_idx": q, "chunk_num": c, "distance": cosine(queries[q], contents[c])}
+        for c in filtered_chunk_nums or range(len(contents))
+        for q in range(len(queries))
+    ]
+    distances.sort(key=lambda x: x["distance"])
+    return distances[:top_k]
+
+
+@pytest.mark.parametrize(
+    "n_chunks,top_k,filtered", [(50, 20, False), (300, 20, True), (7, 100, False)]
+)
+def test_nearest_chunks_matches_loop(n_chunks, top_k, filtered):
+    rng = np.random.default_rng(n_chunks)
+    queries, contents = rng.normal(size=(4, 32)), rng.normal(size=(n_chunks, 32))
+    filtered_chunk_nums = (
+        sorted(int(i) for i in rng.choice(n_chunks, 40, replace=False))
+        if filtered
+        else []
+    )
+
+    expected = _nearest_chunks_loop(queries, contents, top_k, filtered_chunk_nums)
+    result = nearest_chunks(queries, contents, top_k, filtered_chunk_nums)
+    assert [(r["query_idx"], r["chunk_num"]) for r in result] == [
+        (r["query_idx"], r["chunk_num"]) for r in expected
+    ]
+    assert np.allclose([r["distance"] for r in result], [r["distance"] for r in expected])
+
+
+def test_nearest_chunks_ties():
+    # repeated chunks have equal distances, kept in chunk then query order
+    queries = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 0.0]])
+    contents = np.array([[1.0, 1.0], [1.0, 0.0], [0.0, 2.0], [3.0, 0.0], [2.0, 2.0]])
+    for top_k in range(1, 16):
+        result = nearest_chunks(queries, contents, top_k)
+        expected = _nearest_chunks_loop(queries, contents, top_k)
+        assert [(r["query_idx"], r["chunk_num"]) for r in result] == [
+            (r["query_idx"], r["chunk_num"]) for r in expected
+        ]
+    assert nearest_chunks(queries, contents, 0) == []
+
+
+def test_keyword_index():
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3"
+    )
+    bm25 = BM25Okapi([preprocess_text(text) for text in chunks.texts])
+    index = chunks.keyword_index()
+    for keywords in (FUNDMGR_OWNERSHIP_KEYWORDS, ["the", "fund", "fund"], ["zzz"], []):
+        tokens = preprocess_text(" ".join(keywords))
+        assert np.array_equal(index.scores(tokens), bm25.get_scores(tokens))
+
+    scores = bm25.get_scores(preprocess_text(" ".join(FUNDMGR_OWNERSHIP_KEYWORDS)))
+    expected = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:50]
+    with patch("edgar_funcs.rag.vectorize.KeywordIndex") as mock_index:
+        # the index is built once per chunks
+        assert (
+            filter_chunks_with_keywords(chunks, FUNDMGR_OWNERSHIP_KEYWORDS, top_k=50)
+            == expected
+        )
+        mock_index.assert_not_called()
+    # ties are kept in chunk order
+    assert filter_chunks_with_keywords(chunks, ["zzz"], top_k=3) == [0, 1, 2]
+
+
+def test_run_embedding_job_with_local_backend(tmp_path):
+    filings = [
+        TextChunksWithEmbedding(
+            [f"filing {n} chunk {i} " + "word " * 3000 for i in range(3)],
+            metadata={"cik": str(n), "accession_number": "1", "chunk_algo_version": "4"},
+        )
+        for n in range(2)
+    ]
+    backend = LocalBatchBackend(str(tmp_path / "jobs"))
+    run_embedding_job(
+        filings,
+        model="local/hashing",
+        dimension=64,
+        backend=backend,
+        job_path=str(tmp_path / "job.jsonl"),
+        poll_interval=0,
+    )
+
+    # 6 chunks of about 3000 tokens are packed into 4 requests, 2 per filing
+    with open(tmp_path / "job.0.jsonl") as f:
+        assert len(f.readlines()) == 4
+    for filing in filings:
+        assert filing.is_ready() and filing.metadata["model"] == "local/hashing"
+        assert np.allclose(
+            filing.vectors(),
+            batch_embedding(filing.texts, model="local/hashing", dimension=64),
+            atol=1e-6,
+        )
+
+
+def test_embedding_job_parts(tmp_path):
+    filings = [
+        TextChunksWithEmbedding(
+            [f"filing {n} chunk {i} " + "word " * 3000 for i in range(3)],
+            metadata={"cik": str(n), "accession_number": "1", "chunk_algo_version": "4"},
+        )
+        for n in range(2)
+    ]
+    job_path = str(tmp_path / "job.jsonl")
+
+    # 4 requests of 30 KB and 15 KB for each filing
+    parts = write_embedding_job(filings, "local/hashing", 64, job_path, max_requests=3)
+    assert [len(part["requests"]) for part in parts] == [3, 1]
+    parts = write_embedding_job(filings, "local/hashing", 64, job_path, max_bytes=50000)
+    assert [len(part["requests"]) for part in parts] == [2, 2]
+    for part in parts:
+        assert os.path.getsize(part["path"]) <= 50000
+        with open(part["path"]) as f:
+            custom_ids = [json.loads(line)["custom_id"] for line in f]
+        assert custom_ids == list(part["requests"])
+
+    # each part runs as a job of its own
+    backend = LocalBatchBackend(str(tmp_path / "jobs"))
+    with (
+        patch(
+            "edgar_funcs.rag.vectorize.batch_job.write_embedding_job",
+            partial(write_embedding_job, max_requests=1),
+        ),
+        patch.object(backend, "submit", wraps=backend.submit) as submit,
+    ):
+        run_embedding_job(
+            filings, "local/hashing", 64, backend, job_path, poll_interval=0
+        )
+    assert submit.call_count == 4
+    for filing in filings:
+        assert np.allclose(
+            filing.vectors(),
+            batch_embedding(filing.texts, model="local/hashing", dimension=64),
+            atol=1e-6,
+        )
+
+
+def test_openai_batch_results():
+    def output(custom_id, status_code, body):
+        response = {"status_code": status_code, "body": body}
+        return json.dumps({"custom_id": custom_id, "response": response, "error": None})
+
+    ok = {"data": [{"index": 1, "embedding": [1.0]}, {"index": 0, "embedding": [0.0]}]}
+    files = {
+        "output": output("0-0", 200, ok),
+        "errors": json.dumps(
+            {"custom_id": "1-2", "response": None, "error": {"code": "invalid"}}
+        ),
+    }
+    batch = SimpleNamespace(output_file_id="output", error_file_id=None)
+    client = SimpleNamespace(
+        batches=SimpleNamespace(retrieve=lambda job_id: batch),
+        files=SimpleNamespace(
+            content=lambda file_id: SimpleNamespace(text=files[file_id])
+        ),
+    )
+    backend = OpenAIBatchBackend(client)
+    assert backend.results("batch") == {"0-0": [[0.0], [1.0]]}
+
+    # failed requests are reported with their custom_id
+    files["output"] += "\n" + output("0-1", 500, {"error": "server"})
+    with pytest.raises(RuntimeError, match="0-1"):
+        backend.results("batch")
+    # a batch whose requests all failed has only an error file
+    batch.output_file_id, batch.error_file_id = None, "errors"
+    with pytest.raises(RuntimeError, match="1 requests of batch job batch failed: 1-2"):
+        backend.results("batch")
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_quantized_embeddings_recall(dtype, tmp_path):
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", "text-embedding-005", 768, "3"
+    )
+    queries = TextChunksWithEmbedding.load(
+        "0", "trustee_queries", "text-embedding-005", 768, "0"
+    )
+    # legacy pickles keep the full precision of the embeddings
+    assert chunks.embeddings.dtype == np.float64
+
+    vectors, scales = quantize(chunks.embeddings, dtype)
+    assert np.allclose(dequantize(vectors, scales), chunks.embeddings, atol=0.01)
+
+    expected = nearest_chunks(queries.embeddings, chunks.embeddings, top_k=20)
+    result = nearest_chunks(queries.embeddings, vectors, top_k=20)
+    expected_hits = {(r["query_idx"], r["chunk_num"]) for r in expected}
+    hits = {(r["query_idx"], r["chunk_num"]) for r in result}
+    assert len(expected_hits & hits) / len(expected_hits) >= 0.9
+
+    # the storage dtype survives a save and load
+    compact = TextChunksWithEmbedding(
+        chunks.texts,
+        embeddings=chunks.embeddings,
+        metadata={**chunks.metadata, "accession_number": "compact"},
+        embedding_dtype=dtype,
+    )
+    compact.save(str(tmp_path))
+    restored = TextChunksWithEmbedding.load(
+        "1002427",
+        "compact",
+        "text-embedding-005",
+        768,
+        "3",
+        storage_base_path=str(tmp_path),
+    )
+    assert restored.embeddings.dtype == np.dtype(dtype)
+    assert restored.metadata.get("embedding_dtype") == dtype
+    assert np.array_equal(restored.embeddings, vectors)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_normalized_embeddings(dtype, tmp_path):
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", "text-embedding-005", 768, "3"
+    )
+    queries = TextChunksWithEmbedding.load(
+        "0", "trustee_queries", "text-embedding-005", 768, "0"
+    )
+    expected = nearest_chunks(queries.embeddings, chunks.embeddings, top_k=20)
+
+    # chunks saved before normalization are normalized once when first used
+    assert "normalized" not in chunks.metadata
+    assert chunks.unit_vectors() is chunks.unit_vectors()
+    result = nearest_chunks(
+        queries.unit_vectors(), chunks.unit_vectors(), top_k=20, normalized=True
+    )
+    assert [(r["query_idx"], r["chunk_num"]) for r in result] == [
+        (r["query_idx"], r["chunk_num"]) for r in expected
+    ]
+    assert np.allclose([r["distance"] for r in result], [r["distance"] for r in expected])
+
+    normalized = TextChunksWithEmbedding(
+        chunks.texts,
+        embeddings=chunks.vectors() * 3,
+        metadata={
+            **chunks.metadata,
+            "accession_number": "normalized",
+            "normalized": True,
+        },
+        embedding_dtype=dtype,
+    )
+    assert normalized.embedding_norms is not None
+    normalized.save(str(tmp_path))
+    restored = TextChunksWithEmbedding.load(
+        "1002427",
+        "normalized",
+        "text-embedding-005",
+        768,
+        "3",
+        storage_base_path=str(tmp_path),
+    )
+    assert restored.metadata.get("normalized")
+    assert restored.embedding_norms is not None
+    norms = np.linalg.norm(chunks.vectors(), axis=1) * 3
+    assert np.allclose(restored.embedding_norms, norms)
+    assert np.allclose(restored.vectors(), chunks.vectors() * 3, atol=0.03)
+    unit_vectors = restored.unit_vectors()
+    assert np.allclose(np.linalg.norm(unit_vectors, axis=1), 1.0, atol=1e-5)
+    if dtype == "float32":
+        # stored unit vectors are used in place
+        assert unit_vectors is restored.embeddings
+
+    result = nearest_chunks(
+        queries.unit_vectors(), unit_vectors, top_k=20, normalized=True
+    )
+    expected_hits = {(r["query_idx"], r["chunk_num"]) for r in expected}
+    hits = {(r["query_idx"], r["chunk_num"]) for r in result}
+    assert len(expected_hits & hits) / len(expected_hits) >= 0.9
+
+
+def test_load_truncated_dimension():
+    # only 768 dimension embeddings are stored
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, 256, "3"
+    )
+    queries = TextChunksWithEmbedding.load(
+        "0", "trustee_queries", embedding_model, 256, "0"
+    )
+    assert chunks.embeddings.shape == (262, 256)
+    assert chunks.metadata["dimension"] == 256
+    assert chunks.metadata.get("source_dimension") == 768
+    assert np.allclose(np.linalg.norm(chunks.vectors(), axis=1), 1.0)
+
+    # the trustee compensation table is still the best match
+    results = nearest_chunks(queries.embeddings, chunks.embeddings, top_k=20)
+    relevance_scores = relevance_by_appearance(gather_chunk_distances(results))
+    assert top_adjacent_chunks(relevance_scores) == [192, 193]
+
+    # a larger dimension cannot be derived
+    with pytest.raises(ValueError, match="Cannot load chunks"):
+        TextChunksWithEmbedding.load(
+            "1002427", "0001133228-24-004879", embedding_model, 1024, "3"
+        )
+
+
+def test_chunks_artifact_round_trip(tmp_path):
+    texts = ["Trustee compensation", "", "Émetteur — 5% ≥ $10,000"]
+    vectors, scales = quantize(np.random.default_rng(0).normal(size=(3, 16)), "int8")
+    content = encode_artifact(texts, vectors, scales, {"cik": "1", "dimension": 16})
+    restored_texts, embeddings, restored_scales, _, metadata = decode_artifact(content)
+
+    assert restored_texts == texts and restored_texts[-1] == texts[-1]
+    assert restored_texts[1:] == texts[1:]
+    assert np.array_equal(embeddings, vectors) and embeddings.dtype == np.int8
+    assert restored_scales is not None and scales is not None
+    assert np.array_equal(restored_scales, scales)
+    assert metadata == {"cik": "1", "dimension": 16}
+    # the arrays refer to the serialized bytes instead of a copy
+    assert not embeddings.flags.owndata
+
+    with pytest.raises(ValueError, match="version"):
+        decode_artifact(content[:8] + (99).to_bytes(4, "little") + content[12:])
+
+
+def test_compressed_chunks_artifact(tmp_path):
+    pytest.importorskip("zstandard")
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3"
+    )
+    dictionary = train_dictionary(list(chunks.texts), size=16 * 1024)
+    dict_id = dictionary_id(dictionary)
+    (tmp_path / "dictionaries/zstd").mkdir(parents=True)
+    (tmp_path / f"dictionaries/zstd/{dict_id}.dict").write_bytes(dictionary)
+
+    with (
+        patch("edgar_funcs.rag.vectorize.compression.CHUNK_COMPRESSION", "zstd"),
+        patch("edgar_funcs.rag.vectorize.compression.CHUNK_ZSTD_DICTIONARY", dict_id),
+        patch.dict("edgar_funcs.rag.vectorize.compression._dictionaries", clear=True),
+    ):
+        assert chunks.save(str(tmp_path))
+        # the dictionary of the artifact is read from the storage
+        compression._dictionaries.clear()
+        loaded = TextChunksWithEmbedding.load(
+            "1002427",
+            "0001133228-24-004879",
+            embedding_model,
+            embedding_dimension,
+            "3",
+            storage_base_path=str(tmp_path),
+        )
+        assert loaded.get_text_chunks([192, 193]) == chunks.get_text_chunks([192, 193])
+        assert loaded.texts == chunks.texts
+        assert np.array_equal(loaded.embeddings, chunks.embeddings)
+        assert compression.registered_dictionary(dict_id) == dictionary
+
+    path = (
+        tmp_path / "chunks/3/text-embedding-005_768/1002427/0001133228-24-004879.chunks"
+    )
+    uncompressed = encode_artifact(
+        chunks.texts, chunks.embeddings, chunks.embedding_scales, chunks.metadata
+    )
+    texts_size = sum(len(text.encode("utf-8")) for text in chunks.texts)
+    # the texts take less than a third of their size, embeddings are not compressed
+    assert path.stat().st_size < len(uncompressed) - texts_size * 2 / 3
+
+
+def test_convert_legacy_chunks(tmp_path):
+    legacy = "chunks/3/text-embedding-005_768/1002427/0001133228-24-004879.pickle"
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3"
+    )
+    (tmp_path / legacy).parent.mkdir(parents=True)
+    (tmp_path / legacy).write_bytes(
+        (Path(os.environ["STORAGE_PREFIX"]) / legacy).read_bytes()
+    )
+
+    assert convert_chunks(str(tmp_path), "chunks", delete=True) == 1
+    assert not (tmp_path / legacy).exists()
+
+    converted = TextChunksWithEmbedding.load(
+        "1002427",
+        "0001133228-24-004879",
+        embedding_model,
+        embedding_dimension,
+        "3",
+        storage_base_path=str(tmp_path),
+    )
+    assert converted.texts == chunks.texts
+    assert converted.metadata == chunks.metadata
+    assert np.array_equal(converted.embeddings, chunks.embeddings)
+    assert converted.embeddings.dtype == np.float64
+
+
+def test_load_artifact_reads_selected_texts(tmp_path):
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3"
+    )
+    chunks.set_embeddings(chunks.vectors(), embedding_dtype="int8")
+    chunks.save(str(tmp_path))
+
+    loaded = TextChunksWithEmbedding.load(
+        "1002427",
+        "0001133228-24-004879",
+        embedding_model,
+        embedding_dimension,
+        "3",
+        storage_base_path=str(tmp_path),
+    )
+    assert isinstance(loaded.texts, RangeReadChunkTexts)
+    reader = loaded.texts._reader
+    assert isinstance(reader, LocalRangeReader)
+    bytes_loaded = reader.bytes_read
+    with patch.object(reader, "read", wraps=reader.read) as read:
+        text = loaded.get_text_chunks([192, 193, 194])
+        # adjacent chunks are read at once
+        assert read.call_count == 1
+    assert text == chunks.get_text_chunks([192, 193, 194])
+
+    texts_size = sum(len(t.encode("utf-8")) for t in chunks.texts)
+    assert reader.bytes_read - bytes_loaded < texts_size / 10
+    assert reader.bytes_read < reader.path.stat().st_size / 2
+    assert np.array_equal(loaded.embeddings, chunks.embeddings)
+    assert loaded.texts == chunks.texts
+
+
+def test_local_range_reader_maps_once(tmp_path):
+    vectors, _ = quantize(np.random.default_rng(0).normal(size=(10, 8)), "float32")
+    path = tmp_path / "chunks.chunks"
+    path.write_bytes(encode_artifact(["text"] * 10, vectors, None, {"cik": "1"}))
+
+    with LocalRangeReader(path) as reader:
+        _, embeddings, _, _, _ = read_artifact(reader)
+        mapped = reader._mapped
+        assert mapped is not None
+        read_artifact(reader)
+        assert reader._mapped is mapped
+    assert reader._file.closed
+    # arrays read before closing keep their memory map
+    assert np.array_equal(embeddings, vectors)
+
+
+def test_read_artifact_with_gcs_ranges():
+    texts = [f"chunk {i} " * 50 for i in range(100)]
+    vectors, _ = quantize(np.random.default_rng(0).normal(size=(100, 8)), "float16")
+    content = encode_artifact(texts, vectors, None, {"cik": "1"})
+
+    class FakeBlob:
+        size = len(content)
+
+        def download_as_bytes(self, start, end):
+            return content[start : end + 1]
+
+    reader = GCSRangeReader(FakeBlob())
+    restored_texts, embeddings, _, _, metadata = read_artifact(reader, header_size=256)
+    assert metadata == {"cik": "1"} and np.array_equal(embeddings, vectors)
+    assert restored_texts[42] == texts[42] and restored_texts[-1] == texts[-1]
+    assert reader.bytes_read < len(content) / 5
+
+
+def test_artifact_cache():
+    cache = ArtifactCache()
+    args = ("1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3")
+    with (
+        patch("edgar_funcs.rag.vectorize.artifact_cache._artifact_cache", cache),
+        patch.object(
+            TextChunksWithEmbedding, "load", wraps=TextChunksWithEmbedding.load
+        ) as load,
+    ):
+        chunks = load_chunks(*args)
+        assert load_chunks(*args) is chunks
+        assert load.call_count == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    # the unit vectors made for extraction count against the memory budget, and
+    # keyword indexes once they are built
+    unit_vectors = chunks.unit_vectors()
+    assert unit_vectors is not chunks.embeddings
+    size = cache.stats()["bytes"]
+    assert size > chunks.embeddings.nbytes + unit_vectors.nbytes
+    assert cache.stats()["bytes"] == size
+    keyword_index = chunks.keyword_index()
+    assert cache.stats()["bytes"] == size + keyword_index.nbytes
+
+    # least recently used chunks are evicted to stay within the memory budget
+    cache = ArtifactCache(max_bytes=int(cache.stats()["bytes"] * 2.5))
+    for key in ["a", "b", "a", "c"]:
+        if cache.get(("", key)) is None:
+            cache.put(("", key), chunks)
+    assert cache.get(("", "b")) is None
+    assert cache.get(("", "a")) is chunks and cache.get(("", "c")) is chunks
+    assert cache.stats()["evictions"] == 1 and cache.stats()["entries"] == 2
+
+
+def test_artifact_cache_reload(tmp_path):
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3"
+    )
+    TextChunksWithEmbedding(
+        chunks.texts[:5], embeddings=chunks.embeddings[:5], metadata=dict(chunks.metadata)
+    ).save(str(tmp_path))
+    args = ("1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3")
+    load = partial(load_chunks, *args, storage_base_path=str(tmp_path))
+
+    cache = ArtifactCache()
+    with patch("edgar_funcs.rag.vectorize.artifact_cache._artifact_cache", cache):
+        cached = load()
+        assert load() is cached
+        # only the texts of the selected chunks are read
+        assert cached.get_text_chunks([1, 2]) == "\n\n".join(chunks.texts[1:3])
+        assert isinstance(cached.texts, RangeReadChunkTexts)
+        assert sorted(cached.texts._texts) == [1, 2]
+        # chunks whose artifact was saved again are dropped and loaded again
+        reloaded = load(reload=True)
+        assert reloaded is not cached and load() is reloaded
+        assert cache.stats()["entries"] == 1
+        assert reloaded.texts == chunks.texts[:5]
+
+
+def test_load_from_chunk_pack(tmp_path):
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3"
+    )
+    legacy = "chunks/3/text-embedding-005_768/1002427/0001133228-24-004879.pickle"
+    (tmp_path / legacy).parent.mkdir(parents=True)
+    (tmp_path / legacy).write_bytes(
+        (Path(os.environ["STORAGE_PREFIX"]) / legacy).read_bytes()
+    )
+    # a second filing of the same CIK, saved as an artifact
+    other = TextChunksWithEmbedding(
+        chunks.texts[:10],
+        embeddings=chunks.embeddings[:10],
+        metadata={**chunks.metadata, "accession_number": "other"},
+    )
+    other.save(str(tmp_path))
+
+    model_dir = "chunks/3/text-embedding-005_768"
+    args = (embedding_model, embedding_dimension, "3")
+    storage = {"storage_base_path": str(tmp_path)}
+    assert compact_chunks(str(tmp_path), model_dir, delete=True) == 2
+    files = [p.name for p in (tmp_path / model_dir).rglob("*") if p.is_file()]
+    assert files == ["1002427.chunkpack"]
+
+    with (
+        patch("edgar_funcs.rag.vectorize.USE_CHUNK_PACKS", True),
+        patch("edgar_funcs.rag.vectorize._pack_indexes", OrderedDict()),
+        patch(
+            "edgar_funcs.rag.vectorize.read_pack_index",
+            wraps=edgar_funcs.rag.vectorize.read_pack_index,
+        ) as read_pack_index,
+    ):
+        packed = TextChunksWithEmbedding.load(
+            "1002427", "0001133228-24-004879", *args, **storage
+        )
+        packed_other = TextChunksWithEmbedding.load("1002427", "other", *args, **storage)
+        # the index of the pack is read once for all filings of the CIK
+        assert read_pack_index.call_count == 1
+
+    assert packed.texts == chunks.texts
+    assert np.array_equal(packed.embeddings, chunks.embeddings)
+    assert packed.get_text_chunks([192, 193]) == chunks.get_text_chunks([192, 193])
+    assert packed_other.texts == chunks.texts[:10]
+    assert packed_other.metadata["accession_number"] == "other"
+
+    # filings added later are appended to the pack
+    other.metadata["accession_number"] = "newer"
+    other.save(str(tmp_path))
+    assert compact_chunks(str(tmp_path), model_dir, delete=True) == 1
+    with (
+        patch("edgar_funcs.rag.vectorize.USE_CHUNK_PACKS", True),
+        patch("edgar_funcs.rag.vectorize._pack_indexes", OrderedDict()),
+    ):
+        for accession_number in ["0001133228-24-004879", "other", "newer"]:
+            assert TextChunksWithEmbedding.load(
+                "1002427", accession_number, *args, **storage
+            ).is_ready()
+
+
+def test_chunk_pack_updates(tmp_path):
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3"
+    )
+
+    def filing(accession_number: str, start: int) -> TextChunksWithEmbedding:
+        return TextChunksWithEmbedding(
+            chunks.texts[start : start + 5],
+            embeddings=chunks.embeddings[start : start + 5],
+            metadata={**chunks.metadata, "accession_number": accession_number},
+        )
+
+    storage_path = str(tmp_path)
+    model_dir = "chunks/3/text-embedding-005_768"
+    pack_path = f"{model_dir}/1002427.chunkpack"
+    args = (embedding_model, embedding_dimension, "3")
+    filing("first", 0).save(storage_path)
+    compact_chunks(storage_path, model_dir, delete=True)
+
+    with (
+        patch("edgar_funcs.rag.vectorize.USE_CHUNK_PACKS", True),
+        patch("edgar_funcs.rag.vectorize._pack_indexes", OrderedDict()),
+    ):
+        load = partial(TextChunksWithEmbedding.load, storage_base_path=storage_path)
+        assert load("1002427", "first", *args).texts == chunks.texts[:5]
+
+        # saving a filing again replaces it in the pack too
+        filing("first", 5).save(storage_path)
+        assert load("1002427", "first", *args).texts == chunks.texts[5:10]
+
+        # a pack written again after its index was read is read again
+        read_artifact = edgar_funcs.rag.vectorize.read_artifact
+        n_reads = 0
+
+        def replaced_once(*read_args, **kwargs):
+            nonlocal n_reads
+            n_reads += 1
+            if n_reads == 1:
+                raise ArtifactChangedError("pack replaced")
+            return read_artifact(*read_args, **kwargs)
+
+        with (
+            patch("edgar_funcs.rag.vectorize.read_artifact", side_effect=replaced_once),
+            patch(
+                "edgar_funcs.rag.vectorize.read_pack_index",
+                wraps=edgar_funcs.rag.vectorize.read_pack_index,
+            ) as read_pack_index,
+        ):
+            assert load("1002427", "first", *args).texts == chunks.texts[5:10]
+            assert read_pack_index.call_count == 1
+
+    # a compaction that wrote the pack after it was read makes the write of
+    # another one fail, which reads the pack again and keeps both filings
+    chunks_storage = storage(storage_path)
+    put = chunks_storage.put
+    artifact = chunks_storage.get_with_generation(pack_path)[0]
+    assert artifact is not None
+
+    raced = False
+
+    def racing_put(*put_args, **kwargs):
+        nonlocal raced
+        if not raced:
+            raced = True
+            update_pack(chunks_storage, pack_path, {"racing": b"racing"})
+        return put(*put_args, **kwargs)
+
+    with patch.object(chunks_storage, "put", side_effect=racing_put) as mock_put:
+        update_pack(chunks_storage, pack_path, {"other": b"other"})
+    assert mock_put.call_count == 3
+    pack = chunks_storage.get(pack_path)
+    assert pack is not None
+    assert sorted(decode_pack_index(pack)[0]) == ["first", "other", "racing"]
+
+    # compaction rewrites the pack without the artifacts replaced by saves
+    assert unused_bytes(pack) > 0
+    # the artifact of the filing saved again is packed again
+    assert compact_chunks(storage_path, model_dir, delete=True) == 1
+    pack = chunks_storage.get(pack_path)
+    assert pack is not None and unused_bytes(pack) == 0
+    assert sorted(decode_pack_index(pack)[0]) == ["first", "other", "racing"]
+    with (
+        patch("edgar_funcs.rag.vectorize.USE_CHUNK_PACKS", True),
+        patch("edgar_funcs.rag.vectorize._pack_indexes", OrderedDict()),
+    ):
+        assert load("1002427", "first", *args).texts == chunks.texts[5:10]
+
+        # a save whose pack update fails still succeeds
+        with patch(
+            "edgar_funcs.rag.vectorize.update_pack", side_effect=RuntimeError("raced")
+        ):
+            assert filing("first", 10).save(storage_path)
+
+    # without create, only existing packs are updated
+    assert not update_pack(chunks_storage, "missing.chunkpack", {}, create=False)
+    assert not chunks_storage.exists("missing.chunkpack")
+
+
+def test_gcs_reader_of_replaced_blob():
+    class ReplacedBlob:
+        name, size = "replaced.chunks", 100
+
+        def download_as_bytes(self, start, end):
+            raise NotFound("generation not found")
+
+    with pytest.raises(ArtifactChangedError):
+        GCSRangeReader(ReplacedBlob()).read(0, 10)
+
+
+def test_chunk_manifest(tmp_path):
+    chunks = TextChunksWithEmbedding.load(
+        "1002427", "0001133228-24-004879", embedding_model, embedding_dimension, "3"
+    )
+    manifest = ChunkManifest(str(tmp_path / "manifest.db"))
+    storage_path = str(tmp_path / "storage")
+    with patch("edgar_funcs.rag.vectorize.chunk_manifest", return_value=manifest):
+        chunks.save(storage_path)
+        other = TextChunksWithEmbedding(
+            texts=chunks.texts[:10],
+            embeddings=chunks.embeddings[:10],
+            metadata={**chunks.metadata, "accession_number": "other"},
+        )
+        other.save(storage_path)
+
+    numbers = ["0001133228-24-004879", "other", "missing"]
+    assert manifest.chunked(numbers, embedding_model, embedding_dimension, "3") == {
+        "0001133228-24-004879",
+        "other",
+    }
+    assert not manifest.chunked(numbers, embedding_model, 256, "3")
+    (stats,) = manifest.stats()
+    assert stats["model"] == "text-embedding-005" and stats["dimension"] == 768
+    assert (stats["filings"], stats["ciks"], stats["chunks"]) == (2, 1, 272)
+
+    # the same rows are recorded from the headers of the saved artifacts and packs
+    compact_chunks(storage_path, "chunks/3/text-embedding-005_768")
+    rebuilt = ChunkManifest(str(tmp_path / "rebuilt.db"))
+    assert rebuild_manifest(rebuilt, storage_path) == 2
+    assert [
+        {k: v for k, v in row.items() if k != "last_created"} for row in rebuilt.stats()
+    ] == [{k: v for k, v in stats.items() if k != "last_created"}]
+
+    # rows of another copy of the manifest are merged, newer saves win
+    newer = ChunkManifest(str(tmp_path / "newer.db"))
+    newer.record(
+        {**chunks.metadata, "accession_number": "newer"}, 5, 100, "2999-01-01T00:00:00"
+    )
+    newer.record(other.metadata, 1, 1, "2000-01-01T00:00:00")
+    newer.close()
+    manifest._merge((tmp_path / "newer.db").read_bytes())
+    assert manifest.chunked(numbers + ["newer"], embedding_model, 768, "3") == {
+        "0001133228-24-004879",
+        "other",
+        "newer",
+    }
+    assert manifest.stats()[0]["chunks"] == 277
+
+
+def test_chunk_manifest_sync(tmp_path):
+    metadata = {
+        "cik": "1",
+        "model": embedding_model,
+        "dimension": 768,
+        "chunk_algo_version": "3",
+    }
+    # the synced copy is kept in a local directory instead of a bucket
+    sync_storage = storage(str(tmp_path / "bucket"))
+    with patch(
+        "edgar_funcs.rag.vectorize.manifest.sync_location",
+        return_value=(str(tmp_path / "bucket"), "chunks.db"),
+    ):
+        first = ChunkManifest(str(tmp_path / "first.db"), "gs://bucket/chunks.db")
+        second = ChunkManifest(str(tmp_path / "second.db"), "gs://bucket/chunks.db")
+
+        # rows are uploaded after each save
+        first.record({**metadata, "accession_number": "a"}, 1, 1)
+        first.flush()
+        assert sync_storage.exists("chunks.db")
+
+        # an upload in between makes the conditional put fail, the rows of the
+        # other upload are merged again before retrying
+        second.record({**metadata, "accession_number": "b"}, 1, 1)
+        put = sync_storage.put
+
+        def racing_put(*args, **kwargs):
+            if first._unsynced:
+                first.flush()
+            return put(*args, **kwargs)
+
+        first.record({**metadata, "accession_number": "c"}, 1, 1)
+        with patch.object(sync_storage, "put", side_effect=racing_put) as mock_put:
+            second.flush()
+        assert mock_put.call_count == 3
+
+        synced = ChunkManifest(str(tmp_path / "synced.db"), "gs://bucket/chunks.db")
+        assert synced.chunked(["a", "b", "c"], embedding_model, 768, "3") == {
+            "a",
+            "b",
+            "c",
+        }
+
+        # with a sync interval, saves in between do not upload
+        third = ChunkManifest(str(tmp_path / "third.db"), "gs://bucket/chunks.db", 3600)
+        third.record({**metadata, "accession_number": "d"}, 1, 1)
+        third.flush()
+        third.record({**metadata, "accession_number": "e"}, 1, 1)
+        with patch.object(third, "upload") as upload:
+            third.flush()
+            upload.assert_not_called()
+            third.flush(force=True)
+            upload.assert_called_once()
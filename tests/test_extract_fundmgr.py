@@ -4,6 +4,7 @@ from unittest.mock import patch
 import pytest  # noqa: F401
 
 from edgar_funcs.rag.extract.fundmgr import extract_fundmgr_ownership_from_filing
+from edgar_funcs.rag.vectorize.artifact import ArtifactChangedError
 from tests.utils import mock_file_content
 
 extract_func = partial(
@@ -35,3 +36,17 @@ def test_extract_fundmgr_ownership(mock_ask_model, extraction_model):
         managers[0]["name"] == "Dennis P. Lynch"
         and managers[0]["ownership_range"].replace(",", "") == "Over 1000000"
     )
+
+
+@patch("edgar_funcs.rag.extract.fundmgr._extract_fundmgr_ownership")
+@patch("edgar_funcs.rag.extract.fundmgr._load_fundmgr_ownership_queries")
+@patch("edgar_funcs.rag.extract.fundmgr.load_chunks")
+def test_extract_fundmgr_ownership_reloads_changed_chunks(
+    mock_load_chunks, mock_load_queries, mock_extract
+):
+    # reading the texts of cached chunks fails once the filing is saved again
+    mock_extract.side_effect = [ArtifactChangedError("saved again"), "result"]
+    result = extract_func(cik="1", accession_number="2", model="gpt-4o-mini")
+    assert result == "result"
+    assert mock_load_chunks.call_count == 2
+    assert mock_load_chunks.call_args.kwargs["reload"] is True
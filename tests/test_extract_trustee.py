@@ -3,7 +3,15 @@ from unittest.mock import patch
 
 import pytest
 
-from edgar_funcs.rag.extract.trustee import extract_trustee_comp_from_filing
+from edgar_funcs.rag.extract.algo import nearest_chunks
+from edgar_funcs.rag.extract.trustee import (
+    TrusteeCompensationResponse,
+    _extract_trustee_comp,
+    _load_trustee_comp_queries,
+    extract_trustee_comp_from_filing,
+)
+from edgar_funcs.rag.vectorize import TextChunksWithEmbedding
+from edgar_funcs.rag.vectorize.sections import build_section_index
 from tests.utils import mock_file_content
 
 extract_func = partial(
@@ -56,3 +64,32 @@ def test_extract_txt_filing(mock_ask_model, extraction_model):
         and result["comp_info"]["trustees"][0]["name"] == "Michael Bozic"
         and result["comp_info"]["trustees"][0]["fund_compensation"] == "668"
     )
+
+
+@patch("edgar_funcs.rag.extract.trustee.ask_model")
+def test_extract_with_section_index(mock_ask_model):
+    mock_ask_model.return_value = mock_file_content(
+        "response/gpt-4o-mini/1002427/0001133228-24-004879_trustee_comp.txt"
+    )
+    chunks = TextChunksWithEmbedding.load(
+        cik="1002427",
+        accession_number="0001133228-24-004879",
+        model="vertex_ai/text-embedding-005",
+        dimension=768,
+        chunk_algo_version="3",
+    )
+    chunks.metadata["section_index"] = build_section_index(chunks.texts)
+    queries = _load_trustee_comp_queries(
+        embedding_model="vertex_ai/text-embedding-005", embedding_dimension=768
+    )
+
+    with patch("edgar_funcs.rag.extract.trustee.nearest_chunks") as mock_nearest:
+        mock_nearest.side_effect = nearest_chunks
+        result = _extract_trustee_comp(
+            queries, chunks, "gpt-4o-mini", TrusteeCompensationResponse
+        )
+
+    # only the chunks of the compensation section are ranked
+    assert mock_nearest.call_args.kwargs["filtered_chunk_nums"] == [192, 193, 194]
+    assert result and result["n_trustee"] == 11
+    assert "Frank L. Bowman" in result["selected_text"]
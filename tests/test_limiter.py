@@ -0,0 +1,110 @@
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from litellm.exceptions import RateLimitError
+
+from edgar_funcs.rag.limiter import AdaptiveLimiter, CallOutcome
+from edgar_funcs.rag.vectorize.embedding import _call_litellm_embedding_api
+
+
+def test_additive_increase_multiplicative_decrease():
+    limiter = AdaptiveLimiter(max_limit=8)
+    for _ in range(40):
+        with limiter.slot("m"):
+            pass
+    assert limiter.limits()["m"]["limit"] == 8
+
+    with limiter.slot("m") as call:
+        call.rate_limited = True
+        call.retry_after = 0.2
+    assert limiter.limits()["m"]["limit"] == 4
+    assert limiter.limits()["m"]["rate_limited"] == 1
+
+    # new calls wait for the retry-after period
+    start_t = time.monotonic()
+    with limiter.slot("m"):
+        pass
+    assert time.monotonic() - start_t >= 0.15
+
+
+def test_failed_calls_do_not_raise_the_limit():
+    limiter = AdaptiveLimiter(max_limit=8)
+    for _ in range(40):
+        try:
+            with limiter.slot("m"):
+                raise ConnectionError("service unavailable")
+        except ConnectionError:
+            pass
+    limits = limiter.limits()["m"]
+    assert limits["limit"] == 4 and limits["failed"] == 40
+    assert limits["latency"] is None and limits["in_flight"] == 0
+
+
+def test_calls_wait_for_a_slot():
+    limiter = AdaptiveLimiter(max_limit=4)
+    in_flight, max_in_flight = 0, 0
+    lock = threading.Lock()
+
+    def call():
+        nonlocal in_flight, max_in_flight
+        with limiter.slot("m"):
+            with lock:
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+            time.sleep(0.02)
+            with lock:
+                in_flight -= 1
+
+    threads = [threading.Thread(target=call) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # starts at half of max_limit and grows as calls succeed
+    assert 2 <= max_in_flight <= 4
+    assert limiter.limits()["m"]["in_flight"] == 0
+
+
+def test_rate_limit_headers():
+    outcome = CallOutcome()
+    response = SimpleNamespace(
+        _hidden_params={
+            "additional_headers": {
+                "llm_provider-x-ratelimit-remaining-requests": "2",
+                "retry-after": "1.5",
+            }
+        }
+    )
+    outcome.observe(response)
+    assert outcome.remaining_requests == 2 and outcome.retry_after == 1.5
+    assert not outcome.rate_limited
+
+    limiter = AdaptiveLimiter(max_limit=8)
+    with limiter.slot("m") as call:
+        call.remaining_requests = 2
+    assert limiter.limits()["m"]["limit"] == 2
+
+
+@patch("edgar_funcs.rag.vectorize.embedding.adaptive_limiter")
+@patch("edgar_funcs.rag.vectorize.embedding.embedding")
+def test_embedding_retry_after_rate_limit(mock_embedding, mock_adaptive_limiter):
+    limiter = AdaptiveLimiter(max_limit=8)
+    mock_adaptive_limiter.return_value = limiter
+    mock_embedding.side_effect = [
+        RateLimitError("slow down", llm_provider="openai", model="m"),
+        SimpleNamespace(data=[{"embedding": [0.1, 0.2]}]),
+    ]
+
+    start_t = time.monotonic()
+    result = _call_litellm_embedding_api(
+        ["text"], model="m", task_type="RETRIEVAL_DOCUMENT", dimensionality=2
+    )
+    elapsed = time.monotonic() - start_t
+
+    assert result == [[0.1, 0.2]]
+    assert limiter.limits()["m"]["rate_limited"] == 1
+    # the retry waits for the limiter's pause instead of the exponential backoff
+    assert 0.9 <= elapsed < 3
@@ -10,7 +10,7 @@ from edgar_funcs.rag.vectorize import (
     TextChunksWithEmbedding,
 )
 from edgar_funcs.rag.vectorize.chunking import chunk_text, trim_html_content
-from func_helpers import _get_lock_blob, delete_lock, write_lock
+from func_helpers import _lock_storage, delete_lock, write_lock
 
 embedding_model, embedding_dimension, extraction_model = (
     "text-embedding-3-small",
@@ -76,9 +76,9 @@ def test_lock_file():
     lock_path = "some_random_lock.json"
     assert write_lock(lock_path)
     assert not write_lock(lock_path)
-    assert _get_lock_blob(lock_path).exists()  # pyright: ignore
+    assert _lock_storage().exists(lock_path)  # pyright: ignore
     delete_lock(lock_path)
-    assert not _get_lock_blob(lock_path).exists()  # pyright: ignore
+    assert not _lock_storage().exists(lock_path)  # pyright: ignore
 
 
 def _chunk_and_get_embeddings(cik: str, accession_number: str, chunk_algo_version: str):
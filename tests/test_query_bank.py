@@ -0,0 +1,68 @@
+import os
+import threading
+from unittest.mock import patch
+
+import numpy as np
+
+from edgar_funcs.rag.extract.query_bank import QueryBank, parse_query_models
+from edgar_funcs.rag.extract.trustee import (
+    TRUSTEE_COMP_QUERIES,
+    TRUSTEE_COMP_QUERY_SET,
+)
+
+
+@patch("edgar_funcs.rag.vectorize.batch_embedding")
+def test_packaged_query_vectors(mock_batch_embedding, tmp_path):
+    # empty storage, the vectors in the package data are used, here the mock
+    # storage holds them in the same layout
+    bank = QueryBank(
+        package_path=os.environ["STORAGE_PREFIX"], storage_base_path=str(tmp_path)
+    )
+    bank.register(TRUSTEE_COMP_QUERY_SET, TRUSTEE_COMP_QUERIES)
+    bank.preload([("vertex_ai/text-embedding-005", 768)])
+
+    queries = bank.get(TRUSTEE_COMP_QUERY_SET, "vertex_ai/text-embedding-005", 768)
+    assert queries.embeddings.shape == (4, 768)
+    assert bank.get(TRUSTEE_COMP_QUERY_SET, "text-embedding-005", 768) is queries
+    # smaller dimensions are derived from the packaged ones
+    assert bank.get(TRUSTEE_COMP_QUERY_SET, "text-embedding-005", 256).is_ready()
+    mock_batch_embedding.assert_not_called()
+    assert bank.n_embedded == 0
+
+
+def test_embed_missing_queries_once(tmp_path):
+    texts = ["trustee compensation", "portfolio manager ownership"]
+    banks = [QueryBank(storage_base_path=str(tmp_path)) for _ in range(2)]
+    for bank in banks:
+        bank.register("test_queries", texts)
+
+    results = []
+
+    def get_queries(bank):
+        results.append(bank.get("test_queries", "local/hashing", 64))
+
+    threads = [threading.Thread(target=get_queries, args=(banks[0],)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert banks[0].n_embedded == 1
+    assert all(queries is results[0] for queries in results)
+
+    # another process loads the saved vectors instead of embedding them
+    queries = banks[1].get("test_queries", "local/hashing", 64)
+    assert banks[1].n_embedded == 0
+    assert np.array_equal(queries.embeddings, results[0].embeddings)
+
+    # vectors saved for other texts are embedded again and replaced
+    bank = QueryBank(storage_base_path=str(tmp_path))
+    bank.register("test_queries", texts + ["dollar range"])
+    assert len(bank.get("test_queries", "local/hashing", 64).texts) == 3
+    assert bank.n_embedded == 1
+
+
+def test_parse_query_models():
+    assert parse_query_models("") == []
+    assert parse_query_models(
+        "text-embedding-3-small:1536, vertex_ai/text-embedding-005:768"
+    ) == [("text-embedding-3-small", 1536), ("vertex_ai/text-embedding-005", 768)]
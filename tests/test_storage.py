@@ -0,0 +1,148 @@
+import io
+from unittest.mock import patch
+
+import numpy as np
+
+from edgar_funcs.rag.vectorize.storage import (
+    GCSStorage,
+    LocalStorage,
+    S3Storage,
+    storage,
+)
+
+
+class FakeS3Client:
+    """
+    in memory stand-in for the boto3 S3 client calls used by S3Storage
+    """
+
+    class exceptions:
+        class ClientError(Exception):
+            def __init__(self, code: str):
+                self.response = {"Error": {"Code": code}}
+
+        class NoSuchKey(ClientError):
+            def __init__(self):
+                super().__init__("NoSuchKey")
+
+    def __init__(self):
+        self.objects: dict[tuple[str, str], bytes] = {}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        content = self.objects[(Bucket, Key)]
+        if IfMatch is not None and IfMatch != self._etag(content):
+            raise self.exceptions.ClientError("PreconditionFailed")
+        etag = self._etag(content)
+        if Range:
+            start, end = map(int, Range.removeprefix("bytes=").split("-"))
+            content = content[start : end + 1]
+        return {"Body": io.BytesIO(content), "ETag": etag}
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, IfMatch=None):
+        if IfNoneMatch == "*" and (Bucket, Key) in self.objects:
+            raise self.exceptions.ClientError("PreconditionFailed")
+        if IfMatch is not None and (
+            (Bucket, Key) not in self.objects
+            or IfMatch != self._etag(self.objects[(Bucket, Key)])
+        ):
+            raise self.exceptions.ClientError("PreconditionFailed")
+        self.objects[(Bucket, Key)] = Body
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.ClientError("404")
+        content = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(content), "ETag": self._etag(content)}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, name):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                keys = sorted(k for b, k in client.objects if b == Bucket)
+                yield {"Contents": [{"Key": k} for k in keys if k.startswith(Prefix)]}
+
+        return Paginator()
+
+    @staticmethod
+    def _etag(content: bytes) -> str:
+        return f'"{hash(content)}"'
+
+
+def test_storage_prefix():
+    gcs = storage("gs://bucket/prefix")
+    assert isinstance(gcs, GCSStorage) and gcs.remote
+    assert (gcs.bucket_name, gcs.prefix) == ("bucket", "prefix")
+    no_prefix = storage("gs://bucket")
+    assert isinstance(no_prefix, GCSStorage) and no_prefix.prefix == ""
+
+    s3 = storage("s3://bucket/some/prefix/")
+    assert isinstance(s3, S3Storage)
+    assert (s3.bucket_name, s3.prefix) == ("bucket", "some/prefix")
+
+    local = storage("tmp")
+    assert isinstance(local, LocalStorage) and not local.remote
+    assert local.root.is_absolute() and local.root.name == "tmp"
+    assert storage("tmp") is local
+
+
+def _check_storage(store):
+    # the same operations give the same results on every backend
+    assert store.get("a/b.chunks") is None
+    assert not store.exists("a/b.chunks")
+    assert store.range_reader("a/b.chunks") is None
+
+    assert store.put("a/b.chunks", b"0123456789")
+    assert not store.put("a/b.chunks", b"other", overwrite=False)
+    assert store.get("a/b.chunks") == b"0123456789"
+
+    # conditional writes only replace the generation that was read
+    assert store.get_with_generation("a/c.chunks") == (None, None)
+    content, generation = store.get_with_generation("a/b.chunks")
+    assert content == b"0123456789" and generation is not None
+    assert store.put("a/c.chunks", b"c")
+    assert store.put("a/c.chunks", b"cc", if_generation_match=generation) is False
+    assert store.put("a/b.chunks", b"9876543210", if_generation_match=generation)
+    assert not store.put("a/b.chunks", b"0123456789", if_generation_match=generation)
+    content, generation = store.get_with_generation("a/b.chunks")
+    assert content == b"9876543210"
+    assert store.put("a/b.chunks", b"0123456789", if_generation_match=generation)
+    store.delete("a/c.chunks")
+
+    reader = store.range_reader("a/b.chunks")
+    assert reader.size == 10 and reader.read(2, 3) == b"234"
+    assert np.array_equal(reader.read_array(4, "u1", 2), [ord("4"), ord("5")])
+
+    contents = {f"a/{i}.chunks": str(i).encode() for i in range(20)}
+    assert all(store.put_many(contents).values())
+    assert store.get_many(["a/3.chunks", "a/missing"]) == {
+        "a/3.chunks": b"3",
+        "a/missing": None,
+    }
+    assert store.exists_many(["a/19.chunks", "b/0.chunks"]) == {
+        "a/19.chunks": True,
+        "b/0.chunks": False,
+    }
+    assert sorted(store.list_files("a")) == sorted([*contents, "a/b.chunks"])
+
+    store.delete_many(list(contents))
+    store.delete("a/missing")
+    assert store.list_files("a") == ["a/b.chunks"]
+
+
+def test_local_storage(tmp_path):
+    _check_storage(LocalStorage(str(tmp_path), concurrency=4))
+    # temporary files are not left behind
+    assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == ["b.chunks"]
+
+
+def test_s3_storage():
+    client = FakeS3Client()
+    with patch("edgar_funcs.rag.vectorize.storage.s3_client", return_value=client):
+        _check_storage(S3Storage("bucket", "prefix", concurrency=4))
+    assert list(client.objects) == [("bucket", "prefix/a/b.chunks")]
@@ -12,3 +12,18 @@ def mock_file_content(path: str, is_binary: bool = False):
 def mock_json_dict(path):
     with open(mockdata_path / path, "r") as f:
         return json.load(f)
+
+
+class FakeEncoding:
+    """
+    stand-in for tiktoken encoding that treats each word as a token
+    """
+
+    def encode_ordinary(self, text: str) -> list[str]:
+        return text.split()
+
+    def encode_ordinary_batch(self, texts: list[str]) -> list[list[str]]:
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)